@@ -3,15 +3,46 @@ __version__ = '3.1.1'
 print('using donkey v{} ...'.format(__version__))
 
 import sys
+import importlib
 
 if sys.version_info.major < 3:
     msg = 'Donkey Requires Python 3.4 or greater. You are using {}'.format(sys.version)
     raise ValueError(msg)
 
-from . import parts
-from .vehicle import Vehicle
-from .memory import Memory
-from . import utils
-from . import config
-from . import contrib
-from .config import load_config
+# The submodules and names below are imported on first use, so commands
+# and vehicles that don't need numpy, PIL or the parts start faster.
+# name: (module, attribute of the module or None for the module itself)
+LAZY_ATTRIBUTES = {
+    'parts': ('.parts', None),
+    'vehicle': ('.vehicle', None),
+    'memory': ('.memory', None),
+    'utils': ('.utils', None),
+    'config': ('.config', None),
+    'contrib': ('.contrib', None),
+    'Vehicle': ('.vehicle', 'Vehicle'),
+    'Memory': ('.memory', 'Memory'),
+    'load_config': ('.config', 'load_config'),
+}
+
+
+def __getattr__(name):
+    try:
+        module_name, attr = LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}"
+                             .format(__name__, name))
+    value = importlib.import_module(module_name, __name__)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ needs python 3.7
+    for _name in LAZY_ATTRIBUTES:
+        __getattr__(_name)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mailbox.py
+
+Hand the latest value from one thread to another. The update() thread of a
+threaded part and its run_threaded() in the drive loop use a LatestValue
+instead of polling a shared attribute in a tight loop: the waiting side
+sleeps on a condition variable until a new value arrives.
+"""
+from threading import Condition
+
+
+class LatestValue:
+    '''
+    Holds the most recent value put into it along with a sequence number
+    that goes up with every put. Older values are dropped, a reader only
+    ever gets the newest one. The value and its sequence number are
+    swapped together under a lock, so a reader never sees one without the
+    other.
+
+    A reader remembers the sequence number it got last and passes it to
+    wait(), which blocks until a newer value arrives, the timeout runs out
+    or the mailbox is closed.
+    '''
+    def __init__(self, value=None):
+        self.cond = Condition()
+        self.value = value
+        self.seq = 0
+        self.closed = False
+
+    def put(self, value):
+        '''
+        store a new value and wake up the waiting readers.
+        returns its sequence number
+        '''
+        with self.cond:
+            self.value = value
+            self.seq += 1
+            self.cond.notify_all()
+            return self.seq
+
+    def get(self):
+        '''
+        the latest value, without waiting
+        '''
+        return self.value
+
+    def read(self):
+        '''
+        the latest sequence number and value, without waiting
+        '''
+        with self.cond:
+            return self.seq, self.value
+
+    def wait(self, seq, timeout=None):
+        '''
+        wait for a value newer than sequence number seq.
+        returns the latest sequence number and value, the sequence number
+        is still seq when the wait timed out or the mailbox was closed.
+        '''
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq or self.closed, timeout)
+            return self.seq, self.value
+
+    def close(self):
+        '''
+        wake up all readers, wait() does not block from now on
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
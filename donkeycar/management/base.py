@@ -6,12 +6,10 @@ import shutil
 import argparse
 import json
 import time
+import subprocess
 
 import donkeycar as dk
-from donkeycar.parts.datastore import Tub
 from donkeycar.utils import *
-from donkeycar.management.tub import TubManager
-from donkeycar.management.joystick_creator import CreateJoystick
 import numpy as np
 
 PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -258,6 +256,105 @@ class MakeMovieShell(BaseCommand):
         mm = MakeMovie()
         mm.run(args, parser)
 
+class TubManagerShell(BaseCommand):
+    '''
+    start the tub manager web server with lazy imports
+    '''
+    def run(self, args):
+        from donkeycar.management.tub import TubManager
+        TubManager().run(args)
+
+
+class CreateJoystickShell(BaseCommand):
+    '''
+    run the joystick wizard with lazy imports
+    '''
+    def run(self, args):
+        from donkeycar.management.joystick_creator import CreateJoystick
+        CreateJoystick().run(args)
+
+
+def parse_importtime(text):
+    '''
+    parse the output of python -X importtime into a list of
+    (module, depth, self ms, cumulative ms) in import order
+    '''
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (ValueError, IndexError):
+            # the header line
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, self_us / 1000.0, cumulative_us / 1000.0))
+    return imports
+
+
+class StartupProfile(BaseCommand):
+    '''
+    Show where the start up time goes when importing donkeycar, the donkey
+    command or the modules of a car's manage.py.
+    '''
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='startup-profile', usage='%(prog)s [options]')
+        parser.add_argument('--module', action='append', help='module to import, option may be used more than once. default: donkeycar and donkeycar.management.base')
+        parser.add_argument('--script', help='script to profile the imports of without running it, like manage.py')
+        parser.add_argument('--top', type=int, default=15, help='number of slowest imports to show')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def profile(self, code):
+        '''
+        run code in a new python interpreter.
+        returns its imports as parsed by parse_importtime and the total time
+        the interpreter took in ms
+        '''
+        start = time.time()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+        elapsed = (time.time() - start) * 1000.0
+        if proc.returncode != 0:
+            lines = [l for l in proc.stderr.splitlines() if not l.startswith('import time:')]
+            eprint('\n'.join(lines))
+        return parse_importtime(proc.stderr), elapsed
+
+    def report(self, target, imports, elapsed, top):
+        from prettytable import PrettyTable
+        total = sum(cumulative for _, depth, _, cumulative in imports if depth == 0)
+        print('%s: %.0f ms in total, %.0f ms importing' % (target, elapsed, total))
+        pt = PrettyTable()
+        pt.field_names = ['module', 'self ms', 'cumulative ms']
+        pt.align['module'] = 'l'
+        slowest = sorted(imports, key=lambda imp: imp[3], reverse=True)[:top]
+        for name, depth, self_ms, cumulative in slowest:
+            pt.add_row([name, '%.1f' % self_ms, '%.1f' % cumulative])
+        print(pt)
+
+    def run(self, args):
+        args = self.parse_args(args)
+        targets = []
+        if args.script:
+            path = os.path.abspath(os.path.expanduser(args.script))
+            # run the script under a name other than __main__ so it only
+            # imports its modules
+            code = 'import os, sys, runpy; os.chdir(%r); sys.path.insert(0, %r); ' \
+                   'runpy.run_path(%r, run_name="startup_profile")' % \
+                   (os.path.dirname(path), os.path.dirname(path), path)
+            targets.append((args.script, code))
+        modules = args.module or ([] if args.script else ['donkeycar', 'donkeycar.management.base'])
+        targets += [(module, 'import ' + module) for module in modules]
+
+        for target, code in targets:
+            imports, elapsed = self.profile(code)
+            self.report(target, imports, elapsed, args.top)
+
+
 class Sim(BaseCommand):
     '''
     Start a websocket SocketIO server to talk to a donkey simulator    
@@ -323,27 +420,90 @@ class TubCheck(BaseCommand):
         parser.add_argument('tubs', nargs='+', help='paths to tubs')
         parser.add_argument('--fix', action='store_true', help='remove problem records')
         parser.add_argument('--delete_empty', action='store_true', help='delete tub dir with no records')
+        parser.add_argument('--full', action='store_true', help='decode images completely, not only their headers')
+        parser.add_argument('--report', default=None, help='write a json report of the problems found to this file, - for stdout')
+        parser.add_argument('--workers', type=int, default=None, help='processes checking records. default: one per cpu')
         parsed_args = parser.parse_args(args)
         return parsed_args
 
-    def check(self, tub_paths, fix=False, delete_empty=False):
+    def check(self, tub_paths, fix=False, delete_empty=False, full=False, report_path=None, workers=None):
         '''
         Check for any problems. Looks at tubs and find problems in any records or images that won't open.
+        Records unchanged since they last passed are skipped.
         If fix is True, then delete images and records that cause problems.
         '''
+        from donkeycar.parts.tub_check import check_tubs
+
         cfg = load_config('config.py')
         tubs = gather_tubs(cfg, tub_paths)
 
+        report = check_tubs(tubs, full=full, fix=fix, workers=workers)
         for tub in tubs:
-            tub.check(fix=fix)
             if delete_empty and tub.get_num_records() == 0:
                 import shutil
                 print("removing empty tub", tub.path)
                 shutil.rmtree(tub.path)
 
+        if report_path == '-':
+            print(json.dumps(report, indent=2))
+        elif report_path:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+
     def run(self, args):
         args = self.parse_args(args)
-        self.check(args.tubs, args.fix, args.delete_empty)
+        self.check(args.tubs, args.fix, args.delete_empty, args.full, args.report, args.workers)
+
+
+class TubConvert(BaseCommand):
+    '''
+    Convert tubs between the record per file layout, version 1, and chunk
+    files, version 2.
+    '''
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubconvert', usage='%(prog)s [options]')
+        parser.add_argument('tubs', nargs='+', help='paths to tubs')
+        parser.add_argument('--to', type=int, choices=[1, 2], default=2, help='tub version to convert to')
+        parser.add_argument('--out', default=None, help='directory for the converted tubs. default: next to each tub, with _v<version> appended')
+        parser.add_argument('--replace', action='store_true', help='replace each tub with the converted one')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def convert(self, tub_path, version, out=None, replace=False):
+        from donkeycar.parts.datastore import Tub, convert_tub
+
+        tub_path = os.path.normpath(os.path.expanduser(tub_path))
+        tub = Tub(tub_path)
+        if tub.version == version:
+            print('%s is a version %d tub already' % (tub_path, version))
+            return
+        if replace:
+            dst_path = tub_path + '.converting'
+        elif out is not None:
+            dst_path = os.path.join(os.path.expanduser(out), os.path.basename(tub_path))
+        else:
+            dst_path = '%s_v%d' % (tub_path, version)
+        if os.path.exists(dst_path):
+            raise Exception('%s exists already' % dst_path)
+
+        start = time.time()
+        converted = convert_tub(tub_path, dst_path, version)
+        print('converted %d records of %s to version %d in %.1f s' %
+              (converted.get_num_records(), tub_path, version, time.time() - start))
+
+        if replace:
+            old_path = tub_path + '.old'
+            os.rename(tub_path, old_path)
+            os.rename(dst_path, tub_path)
+            shutil.rmtree(old_path)
+            dst_path = tub_path
+        print('wrote', dst_path)
+
+    def run(self, args):
+        args = self.parse_args(args)
+        for tub_path in args.tubs:
+            self.convert(tub_path, args.to, args.out, args.replace)
 
 
 class ShowHistogram(BaseCommand):
@@ -352,21 +512,25 @@ class ShowHistogram(BaseCommand):
         parser = argparse.ArgumentParser(prog='tubhist', usage='%(prog)s [options]')
         parser.add_argument('--tub', nargs='+', help='paths to tubs')
         parser.add_argument('--record', default=None, help='name of record to create histogram')
+        parser.add_argument('--scan', action='store_true', help='read every record instead of the tub stats')
         parsed_args = parser.parse_args(args)
         return parsed_args
 
-    def show_histogram(self, tub_paths, record_name):
+    def show_histogram(self, tub_paths, record_name, scan=False):
         '''
         Produce a histogram of record type frequency in the given tub
         '''
         from matplotlib import pyplot as plt
         from donkeycar.parts.datastore import TubGroup
 
-        tg = TubGroup(tub_paths=tub_paths)
-        if record_name is not None:
-            tg.df[record_name].hist(bins=50)
+        if scan:
+            tg = TubGroup(tub_paths=tub_paths)
+            if record_name is not None:
+                tg.df[record_name].hist(bins=50)
+            else:
+                tg.df.hist(bins=50)
         else:
-            tg.df.hist(bins=50)
+            self.plot_stats(self.load_stats(tub_paths), record_name)
 
         try:
             filename = os.path.basename(tub_paths) + '_hist_%s.png' % record_name.replace('/', '_')
@@ -376,10 +540,49 @@ class ShowHistogram(BaseCommand):
             pass
         plt.show()
 
+    def load_stats(self, tub_paths):
+        '''
+        the merged stats of the tubs, reading only the records written
+        since the stats of a tub were saved
+        '''
+        from donkeycar.parts.datastore import Tub
+        from donkeycar.parts.tub_stats import TubStats
+        from donkeycar.utils import expand_path_masks
+
+        stats = TubStats()
+        paths = expand_path_masks([os.path.expanduser(p) for p in tub_paths.split(',')])
+        for path in paths:
+            if os.path.isdir(path):
+                stats.merge(Tub(path).get_stats())
+        return stats
+
+    def plot_stats(self, stats, record_name):
+        from matplotlib import pyplot as plt
+        from donkeycar.parts.tub_stats import NUMBER_TYPES, VALUE_TYPES
+
+        if record_name is not None:
+            keys = [record_name]
+        else:
+            keys = [k for k, c in stats.channels.items()
+                    if c['type'] in NUMBER_TYPES + VALUE_TYPES]
+        cols = int(np.ceil(np.sqrt(len(keys))))
+        rows = int(np.ceil(len(keys) / cols))
+        fig = plt.figure()
+        for n, key in enumerate(keys):
+            ax = fig.add_subplot(rows, cols, n + 1)
+            ax.set_title(key)
+            channel = stats.channels[key]
+            if channel['type'] in NUMBER_TYPES:
+                counts, edges = stats.histogram(key)
+                ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+            else:
+                values = channel.get('values', {})
+                ax.bar(list(values.keys()), list(values.values()))
+
     def run(self, args):
         args = self.parse_args(args)
         args.tub = ','.join(args.tub)
-        self.show_histogram(args.tub, args.record)
+        self.show_histogram(args.tub, args.record, args.scan)
 
 
 class ConSync(BaseCommand):
@@ -606,17 +809,19 @@ def execute_from_command_line():
             'createcar': CreateCar,
             'findcar': FindCar,
             'calibrate': CalibrateCar,
-            'tubclean': TubManager,
+            'tubclean': TubManagerShell,
             'tubhist': ShowHistogram,
             'tubplot': ShowPredictionPlots,
             'tubcheck': TubCheck,
+            'tubconvert': TubConvert,
             'makemovie': MakeMovieShell,            
-            'createjs': CreateJoystick,
+            'createjs': CreateJoystickShell,
             'consync': ConSync,
             'contrain': ConTrain,
             'cnnactivations': ShowCnnActivations,
             'update': UpdateCar,
             'sim': Sim,
+            'startup-profile': StartupProfile,
                 }
     
     args = sys.argv[:]
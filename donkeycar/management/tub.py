@@ -7,7 +7,6 @@ Manage tubs
 import os, sys, time
 import json
 import tornado.web
-from stat import S_ISREG, ST_MTIME, ST_MODE, ST_CTIME, ST_ATIME
 
 
 class TubManager:
@@ -31,6 +30,7 @@ class WebServer(tornado.web.Application):
             (r"/", tornado.web.RedirectHandler, dict(url="/tubs")),
             (r"/tubs", TubsView, dict(data_path=data_path)),
             (r"/tubs/?(?P<tub_id>[^/]+)?", TubView),
+            (r"/api/tubs/(?P<tub_id>[^/]+)/(?P<frame>[0-9]+)/(?P<part>image|record)", TubFrameApi, dict(data_path=data_path)),
             (r"/api/tubs/?(?P<tub_id>[^/]+)?", TubApi, dict(data_path=data_path)),
             (r"/static/(.*)", tornado.web.StaticFileHandler, {"path": static_file_path}),
             (r"/tub_data/(.*)", tornado.web.StaticFileHandler, {"path": data_path}),
@@ -72,29 +72,13 @@ class TubApi(tornado.web.RequestHandler):
     def initialize(self, data_path):
         self.data_path = data_path
 
-    def image_path(self, tub_path, frame_id):
-        return os.path.join(tub_path, str(frame_id) + "_cam-image_array_.jpg")
-
-    def record_path(self, tub_path, frame_id):
-        return os.path.join(tub_path, "record_" + frame_id + ".json")
-
     def clips_of_tub(self, tub_path):
-        seqs = [ int(f.split("_")[0]) for f in os.listdir(tub_path) if f.endswith('.jpg') ]
-        seqs.sort()
-
-        entries = ((os.stat(self.image_path(tub_path, seq))[ST_ATIME], seq) for seq in seqs)
-
-        (last_ts, seq) = next(entries)
-        clips = [[seq]]
-        for next_ts, next_seq in entries:
-            #if next_ts - last_ts > 100:  #greater than 1s apart
-            #    clips.append([next_seq])
-            #else:
-            #    clips[-1].append(next_seq)
-            clips[-1].append(next_seq)
-            last_ts = next_ts
-
-        return clips
+        # the records of the manifest, in version 1 and 2 tubs alike
+        from donkeycar.parts.datastore import Tub
+        seqs = Tub(tub_path).get_index(shuffled=False)
+        if not seqs:
+            return []
+        return [seqs]
 
     def get(self, tub_id):
         clips = self.clips_of_tub(os.path.join(self.data_path, tub_id))
@@ -110,7 +94,37 @@ class TubApi(tornado.web.RequestHandler):
         import itertools
         old_frames = list(itertools.chain(*old_clips))
         new_frames = list(itertools.chain(*new_clips['clips']))
-        frames_to_delete = [str(item) for item in old_frames if item not in new_frames]
+        frames_to_delete = [item for item in old_frames if item not in new_frames]
+        # erase through the tub, so its manifest stays up to date
+        from donkeycar.parts.datastore import Tub
+        tub = Tub(tub_path)
         for frm in frames_to_delete:
-            os.remove(self.record_path(tub_path, frm))
-            os.remove(self.image_path(tub_path, frm))
+            tub.erase_record(frm)
+
+
+class TubFrameApi(tornado.web.RequestHandler):
+    '''
+    the image or the json record of a frame of a tub, read through the tub
+    so chunk files of version 2 tubs are read too
+    '''
+
+    def initialize(self, data_path):
+        self.data_path = data_path
+
+    def get(self, tub_id, frame, part):
+        from donkeycar.parts.datastore import Tub
+        tub_path = os.path.join(self.data_path, tub_id)
+        if not os.path.isdir(tub_path):
+            raise tornado.web.HTTPError(404)
+        tub = Tub(tub_path)
+        if int(frame) not in tub.manifest.ids:
+            raise tornado.web.HTTPError(404)
+        record = tub.get_json_record(int(frame))
+
+        if part == 'image':
+            self.set_header("Content-Type", "image/jpeg")
+            self.write(tub.read_image_bytes(record['cam/image_array']))
+        else:
+            record = {k: v for k, v in record.items() if k != 'cam/image_array'}
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.write(json.dumps(record))
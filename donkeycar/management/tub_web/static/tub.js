@@ -50,9 +50,9 @@ $(document).ready(function(){
     // UI elements update
     var updateStreamImg = function() {
         var curFrame = selectedClip().frames[currentFrameIdx];
-        $('#img-preview').attr('src', '/tub_data/' + tubId + '/' + curFrame + '_cam-image_array_.jpg');
+        $('#img-preview').attr('src', '/api/tubs/' + tubId + '/' + curFrame + '/image');
         $('#cur-frame').text(curFrame);
-        $.getJSON('/tub_data/' + tubId + '/' + 'record_' + curFrame + '.json', function(data) {
+        $.getJSON('/api/tubs/' + tubId + '/' + curFrame + '/record', function(data) {
             var angle = data["user/angle"];
             var steeringPercent = Math.round(Math.abs(angle) * 100) + '%';
             var steeringRounded = angle.toFixed(2)
@@ -105,7 +105,7 @@ $(document).ready(function(){
             return Math.round(frames.length/16*i);
         })
         .map(function(frameIdx) {
-            return '<img class="clip-thumbnail" id="clipThumbnail" data-clip="' + clipIdx + '" data-frame="' + frameIdx + '" src="/tub_data/' + tubId + '/' + frames[frameIdx] + '_cam-image_array_.jpg" "/>';
+            return '<img class="clip-thumbnail" id="clipThumbnail" data-clip="' + clipIdx + '" data-frame="' + frameIdx + '" src="/api/tubs/' + tubId + '/' + frames[frameIdx] + '/image" "/>';
         })
         .join('');
 
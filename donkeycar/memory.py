@@ -6,55 +6,144 @@ Created on Sun Jun 25 11:07:48 2017
 @author: wroscoe
 """
 
+# values of these types count as unchanged when an equal value is written
+# again. Any other value only counts as unchanged when the very same object
+# is written again, like the latest frame of a threaded camera.
+VALUE_TYPES = (int, float, str, bool, type(None))
+
+
+def is_same_value(old, new):
+    if old is new:
+        return True
+    return type(new) in VALUE_TYPES and type(old) is type(new) and old == new
+
+
 class Memory:
     """
     A convenience class to save key/value pairs.
+
+    Values are kept in a flat list and every key is given an integer slot
+    in that list the first time it is used. The drive loop of a compiled
+    Vehicle resolves the slots of all its channels once and then reads and
+    writes the list directly with get_slots/put_slots, while the dict-like
+    methods keep working for everything else.
+
+    Each slot also has a version counter which goes up whenever a different
+    value is written to it, see is_same_value. Parts can compare versions to
+    find out whether their inputs changed since they last ran.
     """
     def __init__(self, *args, **kw):
-        self.d = {}
-    
+        self.slots = {}
+        self.buf = []
+        self.versions = []
+
+    def slot(self, key):
+        '''
+        return the integer slot of a key, allocating it when new.
+        A newly allocated slot holds None.
+        '''
+        try:
+            return self.slots[key]
+        except KeyError:
+            ix = len(self.buf)
+            self.slots[key] = ix
+            self.buf.append(None)
+            self.versions.append(0)
+            return ix
+
+    def write(self, ix, value):
+        '''
+        store a value in a slot and bump its version when it changed
+        '''
+        if not is_same_value(self.buf[ix], value):
+            self.versions[ix] += 1
+        self.buf[ix] = value
+
     def __setitem__(self, key, value):
         if type(key) is not tuple:
             print('tuples')
             key = (key,)
             value=(value,)
-        
+
         for i, k in enumerate(key):
-            self.d[k] = value[i]
-        
+            self.write(self.slot(k), value[i])
+
     def __getitem__(self, key):
         if type(key) is tuple:
-            return [self.d[k] for k in key]
+            return [self.buf[self.slots[k]] for k in key]
         else:
-            return self.d[key]
-        
+            return self.buf[self.slots[key]]
+
     def update(self, new_d):
-        self.d.update(new_d)
-        
+        for k, v in new_d.items():
+            self.write(self.slot(k), v)
+
     def put(self, keys, inputs):
         if len(keys) > 1:
             for i, key in enumerate(keys):
                 try:
-                    self.d[key] = inputs[i]
+                    self.write(self.slot(key), inputs[i])
                 except IndexError as e:
                     error = str(e) + ' issue with keys: ' + str(key)
                     raise IndexError(error)
-        
+
         else:
-            self.d[keys[0]] = inputs
+            self.write(self.slot(keys[0]), inputs)
 
-            
-            
     def get(self, keys):
-        result = [self.d.get(k) for k in keys]
+        result = []
+        for k in keys:
+            ix = self.slots.get(k)
+            result.append(None if ix is None else self.buf[ix])
         return result
-    
+
+    def get_slots(self, slots):
+        '''
+        same as get, but with slots resolved beforehand by slot()
+        '''
+        buf = self.buf
+        return [buf[ix] for ix in slots]
+
+    def put_slots(self, slots, inputs):
+        '''
+        same as put, but with slots resolved beforehand by slot(). The
+        version check of write() is inlined, this runs for every part.
+        '''
+        if len(slots) == 1:
+            inputs = (inputs,)
+        elif len(inputs) < len(slots):
+            error = 'tuple index out of range issue with slots: ' + \
+                str(slots[len(inputs):])
+            raise IndexError(error)
+        buf = self.buf
+        versions = self.versions
+        for ix, val in zip(slots, inputs):
+            old = buf[ix]
+            if old is not val:
+                typ = type(val)
+                if typ not in VALUE_TYPES or type(old) is not typ or old != val:
+                    versions[ix] += 1
+                buf[ix] = val
+
+    def get_versions(self, keys):
+        '''
+        version counters of the given keys, 0 for keys never written
+        '''
+        result = []
+        for k in keys:
+            ix = self.slots.get(k)
+            result.append(0 if ix is None else self.versions[ix])
+        return result
+
+    def get_slot_versions(self, slots):
+        versions = self.versions
+        return [versions[ix] for ix in slots]
+
     def keys(self):
-        return self.d.keys()
-    
+        return self.slots.keys()
+
     def values(self):
-        return self.d.values()
-    
+        return [self.buf[ix] for ix in self.slots.values()]
+
     def items(self):
-        return self.d.items()
-        
\ No newline at end of file
+        return [(k, self.buf[ix]) for k, ix in self.slots.items()]
@@ -7,6 +7,8 @@ are wrapped in a mixer class before being used in the drive loop.
 import time
 
 import donkeycar as dk
+from donkeycar.mailbox import LatestValue
+from donkeycar.vehicle import trace
 
         
 class PCA9685:
@@ -162,12 +164,29 @@ class JHatReader:
         time.sleep(0.1)
 
 
+def write_new_pulses(actuator):
+    '''
+    update() loop of the PWM actuators: wait for the drive loop to set a
+    pulse and write it to the controller when it differs from the last one.
+    The controller keeps repeating the pulse on its own in the meantime.
+    '''
+    seq, pulse = actuator.pulses.read()
+    last_pulse = None
+    while actuator.running:
+        if pulse != last_pulse:
+            with trace(actuator.tracer, 'set_pulse'):
+                actuator.controller.set_pulse(pulse)
+            last_pulse = pulse
+        seq, pulse = actuator.pulses.wait(seq)
+
+
 class PWMSteering:
     """
     Wrapper over a PWM motor controller to convert angles to PWM pulses.
     """
     LEFT_ANGLE = -1
     RIGHT_ANGLE = 1
+    tracer = None
 
     def __init__(self,
                  controller=None,
@@ -179,18 +198,19 @@ class PWMSteering:
         self.right_pulse = right_pulse
         self.pulse = dk.utils.map_range(0, self.LEFT_ANGLE, self.RIGHT_ANGLE,
                                         self.left_pulse, self.right_pulse)
+        self.pulses = LatestValue(self.pulse)
         self.running = True
         print('PWM Steering created')
 
     def update(self):
-        while self.running:
-            self.controller.set_pulse(self.pulse)
+        write_new_pulses(self)
 
     def run_threaded(self, angle):
         # map absolute angle to angle that vehicle can implement.
         self.pulse = dk.utils.map_range(angle,
                                         self.LEFT_ANGLE, self.RIGHT_ANGLE,
                                         self.left_pulse, self.right_pulse)
+        self.pulses.put(self.pulse)
 
     def run(self, angle):
         self.run_threaded(angle)
@@ -199,8 +219,10 @@ class PWMSteering:
     def shutdown(self):
         # set steering straight
         self.pulse = 0
+        self.pulses.put(self.pulse)
         time.sleep(0.3)
         self.running = False
+        self.pulses.close()
 
 
 class PWMThrottle:
@@ -210,6 +232,7 @@ class PWMThrottle:
     """
     MIN_THROTTLE = -1
     MAX_THROTTLE = 1
+    tracer = None
 
     def __init__(self,
                  controller=None,
@@ -231,12 +254,12 @@ class PWMThrottle:
         time.sleep(0.01)
         self.controller.set_pulse(self.zero_pulse)
         time.sleep(1)
+        self.pulses = LatestValue(self.pulse)
         self.running = True
         print('PWM Throttle created')
 
     def update(self):
-        while self.running:
-            self.controller.set_pulse(self.pulse)
+        write_new_pulses(self)
 
     def run_threaded(self, throttle):
         if throttle > 0:
@@ -245,6 +268,7 @@ class PWMThrottle:
         else:
             self.pulse = dk.utils.map_range(throttle, self.MIN_THROTTLE, 0,
                                             self.min_pulse, self.zero_pulse)
+        self.pulses.put(self.pulse)
 
     def run(self, throttle):
         self.run_threaded(throttle)
@@ -254,6 +278,7 @@ class PWMThrottle:
         # stop vehicle
         self.run(0)
         self.running = False
+        self.pulses.close()
 
 
 class Adafruit_DCMotor_Hat:
@@ -20,7 +20,7 @@ def find_coeffs(pa, pb):
         matrix.append([p1[0], p1[1], 1, 0, 0, 0, -p2[0]*p1[0], -p2[0]*p1[1]])
         matrix.append([0, 0, 0, p1[0], p1[1], 1, -p2[1]*p1[0], -p2[1]*p1[1]])
 
-    A = np.matrix(matrix, dtype=np.float)
+    A = np.matrix(matrix, dtype=np.float64)
     B = np.array(pb).reshape(8)
 
     res = np.dot(np.linalg.inv(A.T * A) * A.T, B)
@@ -69,7 +69,7 @@ def augment_image(np_img, shadow_images=None, do_warp_persp=False):
         '''
         img = rand_persp_transform(img)
 
-    return np.array(img).astype(np.float) / 255.0
+    return np.array(img).astype(np.float64) / 255.0
 
 def load_shadow_images(path_mask):
     shadow_images = []
@@ -87,3 +87,228 @@ def load_shadow_images(path_mask):
     return shadow_images
 
 
+def load_shadow_arrays(path_mask):
+    '''
+    the shadow images of load_shadow_images as float32 arrays for
+    augment_batch: the rgb image and its mask, scaled to 0..1
+    '''
+    return [(np.asarray(top, dtype=np.float32) / 255.0,
+             np.asarray(mask, dtype=np.float32) / 255.0)
+            for top, mask in load_shadow_images(path_mask)]
+
+
+'''
+Batch augmentation
+
+augment_batch does what augment_image does to each image of a whole batch
+at once, with numpy operations on the batch instead of PIL per image. The
+enhancements follow PIL's ImageEnhance: each one blends the images with a
+degenerate version of them, black for brightness, the mean gray for
+contrast, a smoothed image for sharpness and the grayscale image for
+color, by a factor drawn for each image.
+'''
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13.0
+
+
+def gray_batch(imgs):
+    '''
+    the grayscale of the images, of shape (n, height, width)
+    '''
+    if imgs.shape[-1] == 3:
+        return (imgs.reshape(-1, 3) @ GRAY_WEIGHTS).reshape(imgs.shape[:-1])
+    return imgs[..., 0]
+
+
+def smooth_batch(imgs):
+    '''
+    the images filtered with the SMOOTH kernel of PIL, which sharpness
+    blends with. The border pixels are kept. Uses OpenCV when installed.
+    '''
+    n, height, width, depth = imgs.shape
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+    if cv2 is not None and depth <= 4:
+        # the images stacked as one tall image, the rows where two images
+        # meet are their borders, which are kept
+        out = cv2.filter2D(imgs.reshape(n * height, width, depth), -1, SMOOTH_KERNEL)
+        out = out.reshape(imgs.shape)
+        out[:, 0] = imgs[:, 0]
+        out[:, -1] = imgs[:, -1]
+        out[:, :, 0] = imgs[:, :, 0]
+        out[:, :, -1] = imgs[:, :, -1]
+        return out
+    out = imgs.copy()
+    rows = imgs[:, :-2] + imgs[:, 1:-1]
+    rows += imgs[:, 2:]
+    box = rows[:, :, :-2] + rows[:, :, 1:-1]
+    box += rows[:, :, 2:]
+    box += 4.0 * imgs[:, 1:-1, 1:-1]
+    box *= 1.0 / 13.0
+    out[:, 1:-1, 1:-1] = box
+    return out
+
+
+def add_shadows(imgs, shadow_arrays, rng):
+    '''
+    composite a random shadow of load_shadow_arrays on each image, at a
+    random offset and strength
+    '''
+    n, height, width = imgs.shape[:3]
+    choices = rng.randint(0, len(shadow_arrays), n)
+    strengths = rng.uniform(0.3, 1.0, n)
+    offsets = rng.randint(-128, 128, (n, 2))
+    for i in range(n):
+        top, mask = shadow_arrays[choices[i]]
+        if imgs.shape[-1] == 1:
+            top = gray_batch(top)[..., np.newaxis]
+        x, y = offsets[i]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + top.shape[1], width), min(y + top.shape[0], height)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        m = np.clip(mask[y0 - y:y1 - y, x0 - x:x1 - x] * strengths[i], 0.0, 1.0)[..., np.newaxis]
+        region = imgs[i, y0:y1, x0:x1]
+        region += m * (top[y0 - y:y1 - y, x0 - x:x1 - x] - region)
+
+
+def persp_coeffs_batch(widths, shifts, height):
+    '''
+    the coefficients find_coeffs gives rand_persp_transform for each of
+    the new widths and shifts, solved as one batch
+    '''
+    n = len(widths)
+    pa = np.array([(0, 0), (256, 0), (256, 256), (0, 256)], dtype=np.float64)
+    pb = np.zeros((n, 4, 2))
+    pb[:, 1, 0] = 256
+    pb[:, 2, 0] = widths
+    pb[:, 2, 1] = height
+    pb[:, 3, 0] = shifts
+    pb[:, 3, 1] = height
+    A = np.zeros((n, 8, 8))
+    for k, (x, y) in enumerate(pa):
+        A[:, 2 * k, :3] = (x, y, 1)
+        A[:, 2 * k, 6:] = -pb[:, k, 0:1] * (x, y)
+        A[:, 2 * k + 1, 3:6] = (x, y, 1)
+        A[:, 2 * k + 1, 6:] = -pb[:, k, 1:2] * (x, y)
+    return np.linalg.solve(A, pb.reshape(n, 8, 1))[..., 0]
+
+
+def warp_batch(imgs, rng):
+    '''
+    warp the perspective of each image like rand_persp_transform. Uses
+    OpenCV when installed, otherwise numpy with bilinear instead of
+    bicubic sampling. Pixels from outside the image are black.
+    '''
+    n, height, width, depth = imgs.shape
+    widths = np.floor(width * rng.uniform(0.9, 1.1, n))
+    shifts = np.floor(width * rng.uniform(-0.2, 0.2, n))
+    coeffs = persp_coeffs_batch(widths, shifts, height)
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+    if cv2 is not None and depth <= 4:
+        for img, c in zip(imgs, coeffs):
+            # the coefficients map each pixel to where it is read from
+            m = np.append(c, 1.0).reshape(3, 3)
+            out = cv2.warpPerspective(img, m, (width, height),
+                                      flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+                                      borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            img[...] = out.reshape(img.shape)
+        # bicubic sampling overshoots
+        np.clip(imgs, 0.0, 1.0, out=imgs)
+        return
+
+    c = coeffs.astype(np.float32)[:, :, np.newaxis, np.newaxis]
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    den = c[:, 6] * x + c[:, 7] * y + 1.0
+    src_x = (c[:, 0] * x + c[:, 1] * y + c[:, 2]) / den
+    src_y = (c[:, 3] * x + c[:, 4] * y + c[:, 5]) / den
+
+    x0 = np.floor(src_x)
+    y0 = np.floor(src_y)
+    fx = (src_x - x0)[..., np.newaxis]
+    fy = (src_y - y0)[..., np.newaxis]
+    x0 = x0.astype(np.int64)
+    y0 = y0.astype(np.int64)
+    # the pixels are read from the images flattened to (n * height * width, depth)
+    src = imgs.reshape(-1, depth).copy()
+    base = np.arange(n).reshape(n, 1, 1) * (height * width)
+
+    def pixel(yy, xx):
+        inside = (xx >= 0) & (xx < width) & (yy >= 0) & (yy < height)
+        rows = base + np.clip(yy, 0, height - 1) * width + np.clip(xx, 0, width - 1)
+        vals = src[rows]
+        vals[~inside] = 0
+        return vals
+
+    top = pixel(y0, x0)
+    top += fx * (pixel(y0, x0 + 1) - top)
+    bottom = pixel(y0 + 1, x0)
+    bottom += fx * (pixel(y0 + 1, x0 + 1) - bottom)
+    top += fy * (bottom - top)
+    imgs[...] = top
+
+
+def augment_batch(imgs, rng=None, shadow_arrays=None, do_warp_persp=False):
+    '''
+    augment a batch of images of shape (n, height, width, depth) in place,
+    changing the brightness, contrast, sharpness and color of each image
+    by random factors like augment_image does. Optionally composite
+    shadows from load_shadow_arrays and warp the perspective. The images
+    are float32 scaled to 0..1, or uint8. The random factors are drawn
+    from rng, a np.random.RandomState, so a seeded one repeats them.
+    Returns imgs.
+    '''
+    if rng is None:
+        rng = np.random
+    if imgs.dtype == np.uint8:
+        work = imgs.astype(np.float32) * np.float32(1.0 / 255.0)
+        augment_batch(work, rng, shadow_arrays, do_warp_persp)
+        np.rint(work * 255.0, out=work)
+        imgs[...] = work
+        return imgs
+
+    n = len(imgs)
+
+    def factors(low, high):
+        return rng.uniform(low, high, n).astype(imgs.dtype).reshape(n, 1, 1, 1)
+
+    brightness = factors(0.5, 2.0)
+    contrast = factors(0.5, 1.0)
+    sharpness = factors(0.5, 1.5)
+    color = factors(0.0, 1.0)
+
+    # brightness blends with black
+    imgs *= brightness
+    np.minimum(imgs, 1.0, out=imgs)
+
+    # contrast blends with the mean gray and sharpness with the smoothed
+    # image. Both are linear, and contrast keeps the values in range, so
+    # they are applied together and clipped once:
+    # c * (s * x + (1 - s) * smooth(x)) + (1 - c) * mean
+    mean = gray_batch(imgs).reshape(n, -1).mean(axis=1).reshape(n, 1, 1, 1)
+    smooth = smooth_batch(imgs)
+    smooth *= contrast * (1 - sharpness)
+    imgs *= contrast * sharpness
+    imgs += smooth
+    imgs += (1 - contrast) * mean
+    np.clip(imgs, 0.0, 1.0, out=imgs)
+
+    # color blends with the grayscale image
+    if imgs.shape[-1] == 3:
+        gray = gray_batch(imgs)[..., np.newaxis]
+        gray *= 1 - color
+        imgs *= color
+        imgs += gray
+
+    if shadow_arrays:
+        add_shadows(imgs, shadow_arrays, rng)
+
+    if do_warp_persp:
+        warp_batch(imgs, rng)
+
+    return imgs
@@ -4,6 +4,8 @@ import numpy as np
 from PIL import Image
 import glob
 from donkeycar.utils import rgb2gray
+from donkeycar.mailbox import LatestValue
+from donkeycar.vehicle import trace
 
 class BaseCamera:
 
@@ -313,6 +315,8 @@ class USBCamera(BaseCamera):
     '''
     Use opencv camera
     '''
+    tracer = None
+
     def __init__(self, image_w=160, image_h=120, image_d=3, framerate=7):
         import cv2
         self.video = cv2.VideoCapture(0)
@@ -333,31 +337,42 @@ class USBCamera(BaseCamera):
             fps = self.video.get(cv2.CAP_PROP_FPS)
             print("Frames per second: {0}".format(fps))
 
-        # initialize the frame and the variable used to indicate
+        # initialize the frame mailbox and the variable used to indicate
         # if the thread should be stopped
-        self.frame = None
+        self.frames = LatestValue()
         self.on = True
 
         print("UsbCamera loaded.. .warming camera")
         # time.sleep(2)
 
+    @property
+    def frame(self):
+        return self.frames.get()
+
     def run(self):
         _, bgr_image = self.video.read()
         return bgr_image
 
     def update(self):
         import cv2
-        # keep looping infinitely until the thread is stopped
+        # keep looping infinitely until the thread is stopped. read() blocks
+        # until the camera delivers the next frame.
         while self.on:
-            if self.video.isOpened():
+            if not self.video.isOpened():
+                time.sleep(0.01)
+                continue
+            with trace(self.tracer, 'read'):
                 _, bgr_image = self.video.read()
-                # if the thread indicator variable is set, stop the thread
-                if bgr_image is not None:
-                    self.frame = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
+            if bgr_image is None:
+                # a failed read returns at once, don't spin on it
+                time.sleep(0.01)
+                continue
+            self.frames.put(cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB))
 
     def shutdown(self):
         # indicate that the thread should be stopped
         self.on = False
+        self.frames.close()
         print("stopping USBCamera")
         time.sleep(0.5)
         self.video.release()
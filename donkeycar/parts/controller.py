@@ -1,5 +1,6 @@
 
 import os
+import sys
 import array
 import time
 import struct
@@ -9,9 +10,22 @@ import logging
 
 from prettytable import PrettyTable
 
-#import for syntactical ease
-from donkeycar.parts.web_controller.web import LocalWebController
-from donkeycar.parts.web_controller.web import WebFpv
+
+def __getattr__(name):
+    # for syntactical ease LocalWebController and WebFpv can be imported from
+    # here, only on demand though as tornado is slow to import.
+    if name in ('LocalWebController', 'WebFpv'):
+        from donkeycar.parts.web_controller import web
+        return getattr(web, name)
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ needs python 3.7
+    from donkeycar.parts.web_controller.web import LocalWebController
+    from donkeycar.parts.web_controller.web import WebFpv
+
 
 class Joystick(object):
     '''
@@ -1,6 +1,8 @@
 import time
 import cv2
 import numpy as np
+from donkeycar.mailbox import LatestValue
+from donkeycar.vehicle import trace
 
 class ImgGreyscale():
 
@@ -168,34 +170,52 @@ class Pipeline():
         return val
     
 class CvCam(object):
+    tracer = None
+
     def __init__(self, image_w=160, image_h=120, image_d=3, iCam=0):
 
-        self.frame = None
+        self.frames = LatestValue()
         self.cap = cv2.VideoCapture(iCam)
         self.running = True
         self.cap.set(3, image_w)
         self.cap.set(4, image_h)
 
+    @property
+    def frame(self):
+        return self.frames.get()
+
     def poll(self):
+        '''
+        read a frame, blocking until the camera delivers it.
+        returns False when there was none
+        '''
         if self.cap.isOpened():
-            ret, self.frame = self.cap.read()
+            with trace(self.tracer, 'read'):
+                ret, frame = self.cap.read()
+            if ret:
+                self.frames.put(frame)
+                return True
+        return False
 
     def update(self):
         '''
         poll the camera for a frame
         '''
         while(self.running):
-            self.poll()
+            if not self.poll():
+                # a failed read returns at once, don't spin on it
+                time.sleep(0.01)
 
     def run_threaded(self):
-        return self.frame
+        return self.frames.get()
 
     def run(self):
         self.poll()
-        return self.frame
+        return self.frames.get()
 
     def shutdown(self):
         self.running = False
+        self.frames.close()
         time.sleep(0.2)
         self.cap.release()
 
@@ -12,11 +12,183 @@ import json
 import datetime
 import random
 import glob
+import io
+import queue
+import traceback
+from collections import OrderedDict
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
-import pandas as pd
 
 from PIL import Image
 
+from donkeycar.parts.tub_chunks import ChunkStore, IMAGE_TYPES, open_file, read_blob, is_blob_ref
+from donkeycar.parts.tub_stats import load_tub_stats
+
+
+class TubManifest(object):
+    """
+    Append-only index of the records in a tub, kept in manifest.txt next to
+    the records. Every record written adds a line `+<index>`, every record
+    removed a line `-<index>`, so opening a tub reads one file instead of
+    listing a directory of many thousands.
+
+    Tubs written before the manifest existed get one built from their
+    record files the first time they are opened.
+    """
+    file_name = 'manifest.txt'
+
+    def __init__(self, tub_path):
+        self.path = os.path.join(tub_path, self.file_name)
+        self.ids = set()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        ids = set()
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    ix = int(line[1:])
+                except ValueError:
+                    # a line cut short when the car lost power
+                    continue
+                if line[0] == '+':
+                    ids.add(ix)
+                elif line[0] == '-':
+                    ids.discard(ix)
+        self.ids = ids
+
+    def rebuild(self, ids):
+        '''
+        replace the manifest with one listing ids
+        '''
+        self.ids = set(ids)
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.writelines('+%d\n' % ix for ix in sorted(self.ids))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # a read only tub still works, from the index in memory
+            print('could not write tub manifest %s: %s' % (self.path, e))
+
+    def append(self, line):
+        with open(self.path, 'a') as f:
+            f.write(line)
+
+    def add(self, ix):
+        self.ids.add(ix)
+        self.append('+%d\n' % ix)
+
+    def remove(self, ix):
+        if ix in self.ids:
+            self.ids.discard(ix)
+            self.append('-%d\n' % ix)
+
+
+# file extension of the saved images by input type
+IMAGE_EXT = {'image_array': '.jpg', 'gray16_array': '.png', 'image': '.png'}
+
+# threads decoding the images of a batch, PIL releases the GIL while decoding
+IMAGE_READER_THREADS = min(8, os.cpu_count() or 1)
+# the reader pool by process id, a forked child inherits the pool of its
+# parent without its threads and makes its own
+image_readers = {}
+
+
+def load_image_arr(path):
+    return np.array(Image.open(open_file(path)))
+
+
+def read_images(paths):
+    '''
+    the images at paths, which may be blob references, decoded in parallel
+    '''
+    pid = os.getpid()
+    reader = image_readers.get(pid)
+    if reader is None:
+        image_readers.clear()
+        reader = image_readers[pid] = ThreadPoolExecutor(max_workers=IMAGE_READER_THREADS)
+    return list(reader.map(load_image_arr, paths))
+
+
+def epoch_batches(num_records, batch_size, shuffle=True):
+    '''
+    yields arrays of batch_size record positions forever. Every epoch goes
+    through all num_records records once, in a new random order when
+    shuffle is True, and batches run on across epochs.
+    '''
+    if num_records == 0:
+        raise ValueError('there are no records to make batches of')
+    order = np.zeros(0, dtype=np.int64)
+    while True:
+        while len(order) < batch_size:
+            epoch = np.random.permutation(num_records) if shuffle else np.arange(num_records)
+            order = np.concatenate([order, epoch])
+        yield order[:batch_size]
+        order = order[batch_size:]
+
+
+# json records parsed by one task when loading tubs on a process pool
+JSON_CHUNK_RECORDS = 5000
+
+
+def read_json_records(tub_path, ixs):
+    tub = Tub(tub_path)
+    return [tub.get_json_record(ix) for ix in ixs]
+
+
+def load_tub_dfs(tubs, workers=None):
+    '''
+    the DataFrames of the records of tubs. They come from the record caches
+    of the tubs when current, otherwise the json records are parsed by a
+    process pool, with one task per JSON_CHUNK_RECORDS records of a tub,
+    and cached.
+    '''
+    import pandas as pd
+    from donkeycar.parts.tub_cache import TubRecordCache
+
+    dfs = [None] * len(tubs)
+    caches = [TubRecordCache(tub) for tub in tubs]
+    jobs = []
+    for i, (tub, cache) in enumerate(zip(tubs, caches)):
+        dfs[i] = cache.load()
+        if dfs[i] is None:
+            index = tub.get_index(shuffled=False)
+            jobs += [(i, index[start:start + JSON_CHUNK_RECORDS])
+                     for start in range(0, len(index), JSON_CHUNK_RECORDS)]
+            if not index:
+                dfs[i] = pd.DataFrame()
+
+    if jobs:
+        records = {}
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if len(jobs) == 1 or workers < 2:
+            for i, ixs in jobs:
+                records.setdefault(i, []).extend(read_json_records(tubs[i].path, ixs))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [(i, pool.submit(read_json_records, tubs[i].path, ixs))
+                           for i, ixs in jobs]
+                for i, future in futures:
+                    records.setdefault(i, []).extend(future.result())
+        for i, tub_records in records.items():
+            dfs[i] = pd.DataFrame(tub_records)
+            caches[i].save(dfs[i])
+    return dfs
+
+
+def stack_column(values):
+    '''
+    array of the values of one key in a batch
+    '''
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values
+    return np.array(list(values))
+
 
 class Tub(object):
     """
@@ -32,14 +204,18 @@ class Tub(object):
     >>> types = ['float', 'image']
     >>> t=Tub(path=path, inputs=inputs, types=types)
 
+    A new tub with version=2 keeps its records in chunk files, see
+    tub_chunks.py, instead of a json and an image file per record. An
+    existing tub is opened in the version it was written in.
     """
 
-    def __init__(self, path, inputs=None, types=None, user_meta=[]):
+    def __init__(self, path, inputs=None, types=None, user_meta=[], version=1):
 
         self.path = os.path.expanduser(path)
         #print('path_in_tub:', self.path)
         self.meta_path = os.path.join(self.path, 'meta.json')
         self.exclude_path = os.path.join(self.path, "exclude.json")
+        self.manifest = TubManifest(self.path)
         self.df = None
 
         exists = os.path.exists(self.path)
@@ -60,6 +236,12 @@ class Tub(object):
             except FileNotFoundError:
                 self.exclude = set()
 
+            self.chunks = self.open_chunks()
+            if self.manifest.exists():
+                self.manifest.load()
+            else:
+                self.rebuild_manifest()
+
             try:
                 self.current_ix = self.get_last_ix() + 1
             except ValueError:
@@ -77,13 +259,16 @@ class Tub(object):
             #create log and save meta
             os.makedirs(self.path)
             self.meta = {'inputs': inputs, 'types': types, 'start': self.start_time}
+            if version != 1:
+                self.meta['tub_version'] = version
             for kv in user_meta:
                 kvs = kv.split(":")
                 if len(kvs) == 2:
                     self.meta[kvs[0]] = kvs[1]
                 # else exception? print message?
-            with open(self.meta_path, 'w') as f:
-                json.dump(self.meta, f)
+            self.write_meta()
+            self.chunks = self.open_chunks()
+            self.manifest.rebuild([])
             self.current_ix = 0
             self.exclude = set()
             print('New tub created at: {}'.format(self.path))
@@ -94,13 +279,26 @@ class Tub(object):
             raise AttributeError(msg)
 
 
+    @property
+    def version(self):
+        return self.meta.get('tub_version', 1)
+
+    def open_chunks(self):
+        if self.version == 1:
+            return None
+        if self.version != 2:
+            raise ValueError('tub %s has unknown version %s' % (self.path, self.version))
+        return ChunkStore(self.path, self.inputs, self.types)
+
+    def write_meta(self):
+        with open(self.meta_path, 'w') as f:
+            json.dump(self.meta, f)
+
     def get_last_ix(self):
-        index = self.get_index()           
-        return max(index)
+        return max(self.manifest.ids)
 
     def update_df(self):
-        df = pd.DataFrame([self.get_json_record(i) for i in self.get_index(shuffled=False)])
-        self.df = df
+        self.df = load_tub_dfs([self])[0]
 
     def get_df(self):
         if self.df is None:
@@ -109,6 +307,20 @@ class Tub(object):
 
 
     def get_index(self, shuffled=True):
+        nums = list(self.manifest.ids)
+        if shuffled:
+            random.shuffle(nums)
+        else:
+            nums.sort()
+        return nums
+
+    def scan_index(self):
+        '''
+        indexes of the record files in the tub directory, slow for large
+        tubs. The manifest keeps the same list.
+        '''
+        if self.chunks is not None:
+            return self.chunks.index()
         files = next(os.walk(self.path))[2]
         record_files = [f for f in files if f[:6]=='record']
         
@@ -120,14 +332,14 @@ class Tub(object):
                 num = 0
             return num
 
-        nums = [get_file_ix(f) for f in record_files]
-        
-        if shuffled:
-            random.shuffle(nums)
-        else:
-            nums = sorted(nums)
-            
-        return nums 
+        return sorted(get_file_ix(f) for f in record_files)
+
+    def rebuild_manifest(self):
+        '''
+        rebuild the manifest from the record files, for tubs written without
+        one or changed by other tools
+        '''
+        self.manifest.rebuild(self.scan_index())
 
 
     @property
@@ -142,8 +354,8 @@ class Tub(object):
         input_types = dict(zip(self.inputs, self.types))
         return input_types.get(key)
 
-    def write_json_record(self, json_data):
-        path = self.get_json_record_path(self.current_ix)
+    def write_json_record(self, json_data, ix=None):
+        path = self.get_json_record_path(self.current_ix if ix is None else ix)
         try:
             with open(path, 'w') as fp:
                 json.dump(json_data, fp)
@@ -157,9 +369,7 @@ class Tub(object):
             raise
 
     def get_num_records(self):
-        import glob
-        files = glob.glob(os.path.join(self.path, 'record_*.json'))
-        return len(files)
+        return len(self.manifest.ids)
 
 
 
@@ -178,33 +388,33 @@ class Tub(object):
 
 
 
-    def check(self, fix=False):
+    def check(self, fix=False, full=False, workers=None):
         '''
-        Iterate over all records and make sure we can load them.
+        Check the records that are new or changed since the last check can
+        be loaded, see tub_check.py. With full the images are decoded
+        completely, not only their headers.
         Optionally remove records that cause a problem.
+        Returns the report of the tub.
         '''
-        print('Checking tub:%s.' % self.path)
-        print('Found: %d records.' % self.get_num_records())
-        problems = False
-        for ix in self.get_index(shuffled=False):
-            try:
-                self.get_record(ix)
-            except:
-                problems = True
-                if fix == False:
-                    print('problems with record:', self.path, ix)
-                else:
-                    print('problems with record, removing:', self.path, ix)
-                    self.remove_record(ix)
-        if not problems:
-            print("No problems found.")
+        from donkeycar.parts.tub_check import check_tubs
+        return check_tubs([self], full=full, fix=fix, workers=workers)['tubs'][0]
+
+    def get_stats(self):
+        '''
+        The statistics of the records of the tub, see tub_stats.py. Only
+        records written since they were last saved are read.
+        '''
+        return load_tub_stats(self)
 
     def remove_record(self, ix):
         '''
         remove data associate with a record
         '''
-        record = self.get_json_record_path(ix)
-        os.unlink(record)
+        if self.chunks is None:
+            record = self.get_json_record_path(ix)
+            if os.path.exists(record):
+                os.unlink(record)
+        self.manifest.remove(ix)
 
     def put_record(self, data):
         """
@@ -212,9 +422,17 @@ class Tub(object):
         return a record with references to the saved values that can
         be saved in a csv.
         """
-        json_data = {}
         self.current_ix += 1
-        
+        ms = int((time.time() - self.start_time) * 1000)
+        self.write_record(self.current_ix, data, ms)
+        return self.current_ix
+
+    def write_record(self, ix, data, ms):
+        '''
+        write the record with index ix, made ms milliseconds after the tub
+        was started
+        '''
+        json_data = {}
         for key, val in data.items():
             typ = self.get_input_type(key)
 
@@ -225,32 +443,51 @@ class Tub(object):
             elif typ in ['str', 'float', 'int', 'boolean', 'vector']:
                 json_data[key] = val
 
-            elif typ == 'image':
-                path = self.make_file_path(key)
-                val.save(path)
-                json_data[key]=path
-
-            elif typ == 'image_array':
-                img = Image.fromarray(np.uint8(val))
-                name = self.make_file_name(key, ext='.jpg')
-                img.save(os.path.join(self.path, name))
-                json_data[key]=name
-
-            elif typ == 'gray16_array':
-                # save np.uint16 as a 16bit png
-                img = Image.fromarray(np.uint16(val))
-                name = self.make_file_name(key, ext='.png')
-                img.save(os.path.join(self.path, name))
-                json_data[key]=name
+            elif typ in IMAGE_TYPES:
+                if val is not None and not isinstance(val, bytes):
+                    val = self.encode_image(typ, val)
+                if val is not None and self.chunks is None:
+                    name = self.make_file_name(key, ext=IMAGE_EXT[typ], ix=ix)
+                    with open(os.path.join(self.path, name), 'wb') as f:
+                        f.write(val)
+                    val = name
+                json_data[key] = val
 
             else:
                 msg = 'Tub does not know what to do with this type {}'.format(typ)
                 raise TypeError(msg)
 
-        json_data['milliseconds'] = int((time.time() - self.start_time) * 1000)
+        if self.chunks is not None:
+            self.chunks.append(ix, ms, json_data)
+        else:
+            json_data['milliseconds'] = ms
+            self.write_json_record(json_data, ix)
+        self.manifest.add(ix)
+
+    @staticmethod
+    def encode_image(typ, val):
+        '''
+        the bytes of the image file saved for val
+        '''
+        if typ == 'image_array':
+            img = Image.fromarray(np.uint8(val))
+        elif typ == 'gray16_array':
+            # save np.uint16 as a 16bit png
+            img = Image.fromarray(np.uint16(val))
+        else:
+            img = val
+        f = io.BytesIO()
+        img.save(f, format='JPEG' if typ == 'image_array' else 'PNG')
+        return f.getvalue()
 
-        self.write_json_record(json_data)
-        return self.current_ix
+    def read_image_bytes(self, value):
+        '''
+        the encoded bytes of an image value of get_json_record()
+        '''
+        if is_blob_ref(value):
+            return read_blob(value)
+        with open(value, 'rb') as f:
+            return f.read()
 
     def erase_last_n_records(self, num_erase):
         '''
@@ -268,6 +505,9 @@ class Tub(object):
             self.erase_record(i)
 
     def erase_record(self, i):
+        if self.chunks is not None:
+            self.manifest.remove(i)
+            return
         json_path = self.get_json_record_path(i)
         if os.path.exists(json_path):
             os.unlink(json_path)
@@ -275,11 +515,14 @@ class Tub(object):
         img_path = os.path.join(self.path, img_filename)
         if os.path.exists(img_path):
             os.unlink(img_path)
+        self.manifest.remove(i)
 
     def get_json_record_path(self, ix):
         return os.path.join(self.path, 'record_'+str(ix)+'.json')
 
     def get_json_record(self, ix):
+        if self.chunks is not None:
+            return self.make_record_paths_absolute(self.chunks.read(ix))
         path = self.get_json_record_path(ix)
         try:
             with open(path, 'r') as fp:
@@ -310,9 +553,8 @@ class Tub(object):
             typ = self.get_input_type(key)
 
             #load objects that were saved as separate files
-            if typ == 'image_array':
-                img = Image.open((val))
-                val = np.array(img)
+            if typ == 'image_array' and val is not None:
+                val = load_image_arr(val)
 
             data[key] = val
 
@@ -321,16 +563,12 @@ class Tub(object):
 
 
     def gather_records(self):
-        ri = lambda fnm : int( os.path.basename(fnm).split('_')[1].split('.')[0] )
-
-        record_paths = glob.glob(os.path.join(self.path, 'record_*.json'))
-        if len(self.exclude) > 0:
-            record_paths = [f for f in record_paths if ri(f) not in self.exclude]
-        record_paths.sort(key=ri)
-        return record_paths
+        return [self.get_json_record_path(ix)
+                for ix in self.get_index(shuffled=False)
+                if ix not in self.exclude]
 
-    def make_file_name(self, key, ext='.png'):
-        name = '_'.join([str(self.current_ix), key, ext])
+    def make_file_name(self, key, ext='.png', ix=None):
+        name = '_'.join([str(self.current_ix if ix is None else ix), key, ext])
         name = name = name.replace('/', '-')
         return name
 
@@ -340,7 +578,8 @@ class Tub(object):
         shutil.rmtree(self.path)
 
     def shutdown(self):
-        pass
+        if self.chunks is not None:
+            self.chunks.close()
 
 
     def excluded(self, index):
@@ -364,18 +603,23 @@ class Tub(object):
             with open(self.exclude_path,'w') as f:
                 json.dump( list(self.exclude), f )
 
+    @staticmethod
+    def get_columns(df):
+        '''
+        the columns of df as arrays, taken out of pandas once so batches
+        are gathered with numpy indexing
+        '''
+        return {k: df[k].to_numpy() for k in df.columns}
+
     def get_record_gen(self, record_transform=None, shuffle=True, df=None):
 
         if df is None:
             df = self.get_df()
 
-
-        while True:
-            for _, row in self.df.iterrows():
-                if shuffle:
-                    record_dict = df.sample(n=1).to_dict(orient='record')[0]
-                else:
-                    record_dict = row
+        columns = self.get_columns(df)
+        for order in epoch_batches(len(df), len(df), shuffle=shuffle):
+            for i in order:
+                record_dict = {k: col[i] for k, col in columns.items()}
 
                 if record_transform:
                     record_dict = record_transform(record_dict)
@@ -387,22 +631,29 @@ class Tub(object):
 
     def get_batch_gen(self, keys, record_transform=None, batch_size=128, shuffle=True, df=None):
 
-        record_gen = self.get_record_gen(record_transform, shuffle=shuffle, df=df)
+        if df is None:
+            df = self.get_df()
 
         if keys == None:
-            keys = list(self.df.columns)
+            keys = list(df.columns)
 
-        while True:
-            record_list = []
-            for _ in range(batch_size):
-                record_list.append(next(record_gen))
+        columns = self.get_columns(df)
+        image_keys = [k for k in keys if self.get_input_type(k) == 'image_array']
+
+        for batch in epoch_batches(len(df), batch_size, shuffle=shuffle):
+            if record_transform is None:
+                values = {k: columns[k][batch] for k in keys}
+            else:
+                record_list = [record_transform({k: col[i] for k, col in columns.items()})
+                               for i in batch]
+                values = {k: [r[k] for r in record_list] for k in keys}
 
             batch_arrays = {}
-            for i, k in enumerate(keys):
-                arr = np.array([r[k] for r in record_list])
-                # if len(arr.shape) == 1:
-                #    arr = arr.reshape(arr.shape + (1,))
-                batch_arrays[k] = arr
+            for k in keys:
+                if k in image_keys:
+                    batch_arrays[k] = np.array(read_images(values[k]))
+                else:
+                    batch_arrays[k] = stack_column(values[k])
 
             yield batch_arrays
 
@@ -436,8 +687,43 @@ class Tub(object):
 
 
 class TubWriter(Tub):
-    def __init__(self, *args, **kwargs):
+    '''
+    Part that saves a record of its inputs on every run.
+
+    With a queue_size larger than 0, run() only copies the record into a
+    queue of that size and returns, while worker threads encode the images
+    and write the files. When the queue is full the record is dropped with
+    policy 'drop', or run() waits for room with policy 'block'. run() then
+    returns the record index, the number of records waiting in the queue
+    and the number dropped so far. shutdown() writes all queued records.
+
+    The writer keeps the statistics of the records in the tub, see
+    tub_stats.py, and saves them every stats_interval seconds and on
+    shutdown.
+    '''
+    POLICIES = ('drop', 'block')
+
+    def __init__(self, *args, queue_size=0, policy='block', workers=1,
+                 stats_interval=10, **kwargs):
         super(TubWriter, self).__init__(*args, **kwargs)
+        assert policy in self.POLICIES, \
+            'policy must be one of {}'.format(self.POLICIES)
+        self.policy = policy
+        self.stats = load_tub_stats(self, save=False)
+        self.stats_lock = Lock()
+        self.stats_interval = stats_interval
+        self.stats_saved = time.time()
+        self.dropped = 0
+        self.errors = 0
+        self.queue = None
+        self.workers = []
+        if queue_size > 0:
+            self.queue = queue.Queue(maxsize=queue_size)
+            for i in range(workers):
+                t = Thread(target=self.write_queued, name='TubWriter-%d' % i)
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
 
     def run(self, *args):
         '''
@@ -450,8 +736,96 @@ class TubWriter(Tub):
 
         self.record_time = int(time.time() - self.start_time)
         record = dict(zip(self.inputs, args))
-        self.put_record(record)
-        return self.current_ix
+        if self.queue is None:
+            self.put_record(record)
+            return self.current_ix
+
+        self.enqueue_record(record)
+        return self.current_ix, self.queue.qsize(), self.dropped
+
+    def enqueue_record(self, data):
+        '''
+        queue a record for the workers, copying arrays as the parts which
+        made them may reuse them
+        '''
+        ix = self.current_ix + 1
+        ms = int((time.time() - self.start_time) * 1000)
+        data = {k: v.copy() if isinstance(v, np.ndarray) else v
+                for k, v in data.items()}
+        try:
+            self.queue.put((ix, data, ms), block=self.policy == 'block')
+        except queue.Full:
+            self.dropped += 1
+            return None
+        self.current_ix = ix
+        return ix
+
+    def write_queued(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                self.write_record(*item)
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def write_record(self, ix, data, ms):
+        super(TubWriter, self).write_record(ix, data, ms)
+        with self.stats_lock:
+            self.stats.add(ix, data)
+            if time.time() - self.stats_saved > self.stats_interval:
+                self.save_stats()
+
+    def erase_record(self, i):
+        if i in self.manifest.ids:
+            try:
+                record = self.get_json_record(i)
+            except Exception:
+                record = {}
+            with self.stats_lock:
+                self.stats.remove(record)
+        super(TubWriter, self).erase_record(i)
+
+    def save_stats(self):
+        self.stats.save(self.path)
+        self.stats_saved = time.time()
+
+    def flush(self):
+        '''
+        wait until all queued records are written
+        '''
+        if self.queue is not None:
+            self.queue.join()
+
+    def erase_last_n_records(self, num_erase):
+        self.flush()
+        super(TubWriter, self).erase_last_n_records(num_erase)
+
+    def shutdown(self):
+        if self.queue is None:
+            self.save_stats()
+            super(TubWriter, self).shutdown()
+            return
+        print('TubWriter: writing %d queued records' % self.queue.qsize())
+        for _ in self.workers:
+            self.queue.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+        # without workers the records are still queued
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                self.write_record(*item)
+        self.queue = None
+        if self.dropped:
+            print('TubWriter: dropped %d records' % self.dropped)
+        self.save_stats()
+        super(TubWriter, self).shutdown()
 
 
 class TubReader(Tub):
@@ -499,12 +873,86 @@ class TubHandler():
         tub_path = os.path.join(self.path, name)
         return tub_path
 
-    def new_tub_writer(self, inputs, types, user_meta=[]):
+    def new_tub_writer(self, inputs, types, user_meta=[], **kwargs):
+        '''
+        create a TubWriter in a new tub, kwargs go to the TubWriter
+        '''
         tub_path = self.create_tub_path()
-        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta)
+        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta, **kwargs)
         return tw
 
 
+def convert_tub(src_path, dst_path, version):
+    '''
+    copy the tub at src_path to a new tub at dst_path in the given version.
+    Records keep their index and time, images are copied without decoding
+    them, removed records are left out. Returns the new tub.
+    '''
+    src = Tub(src_path)
+    dst = Tub(dst_path, inputs=src.inputs, types=src.types, version=version)
+    for k, v in src.meta.items():
+        if k not in ('inputs', 'types', 'tub_version'):
+            dst.meta[k] = v
+    dst.start_time = src.start_time
+    dst.write_meta()
+
+    for ix in src.get_index(shuffled=False):
+        json_data = src.get_json_record(ix)
+        ms = json_data.get('milliseconds', 0)
+        data = {}
+        for key in src.inputs:
+            val = json_data.get(key)
+            if val is not None and src.get_input_type(key) in IMAGE_TYPES:
+                val = src.read_image_bytes(val)
+            data[key] = val
+        dst.write_record(ix, data, ms)
+
+    dst.exclude = set(src.exclude) & dst.manifest.ids
+    dst.write_exclude()
+    dst.current_ix = src.current_ix
+    dst.shutdown()
+    src.shutdown()
+    return dst
+
+
+
+class RecordWindow(object):
+    '''
+    The records of a tub used last, by index, loaded once by load(ix).
+    Stacking neighbouring records reads each of them only once when going
+    through a tub in order.
+    '''
+    def __init__(self, load, size=8):
+        self.load = load
+        self.size = size
+        self.records = OrderedDict()
+
+    def get(self, ix):
+        record = self.records.get(ix)
+        if record is None:
+            record = self.load(ix)
+            self.records[ix] = record
+            if len(self.records) > self.size:
+                self.records.popitem(last=False)
+        else:
+            self.records.move_to_end(ix)
+        return record
+
+    def clear(self):
+        self.records.clear()
+
+
+def gray_frame(rgb):
+    '''
+    single channel uint8 image of an rgb image
+    '''
+    gray = np.dot(rgb[..., :3], GRAY_WEIGHTS)
+    return gray.astype(np.uint8)
+
+
+# weights of the red, green and blue channels in a grayscale image
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
 
 class TubImageStacker(Tub):
     '''
@@ -513,8 +961,19 @@ class TubImageStacker(Tub):
     NN some chance of building a model based on motion.
     If you drive with the ImageFIFO part, then you don't need this.
     Just make sure your inference pass uses the ImageFIFO that the NN will now expect.
+
+    The grayscale frames of the records read last are kept in a window of
+    window records, so reading the records in order decodes every image once.
+    iter_records(reuse=True) stacks every record into the same arrays, so
+    going through a tub doesn't allocate an image per record.
     '''
-    
+
+    def __init__(self, *args, window=8, **kwargs):
+        super(TubImageStacker, self).__init__(*args, **kwargs)
+        self.frames = RecordWindow(self.load_gray_record, size=window)
+        # the stacked images of iter_records(reuse=True), by key
+        self.stacked = {}
+
     def rgb2gray(self, rgb):
         '''
         take a numpy rgb image return a new single channel image converted to greyscale
@@ -526,45 +985,71 @@ class TubImageStacker(Tub):
         convert 3 rgb images into grayscale and put them into the 3 channels of
         a single output image
         '''
-        width, height, _ = img_a.shape
-
-        gray_a = self.rgb2gray(img_a)
-        gray_b = self.rgb2gray(img_b)
-        gray_c = self.rgb2gray(img_c)
-        
-        img_arr = np.zeros([width, height, 3], dtype=np.dtype('B'))
+        return self.stack_frames([gray_frame(img) for img in (img_a, img_b, img_c)])
 
-        img_arr[...,0] = np.reshape(gray_a, (width, height))
-        img_arr[...,1] = np.reshape(gray_b, (width, height))
-        img_arr[...,2] = np.reshape(gray_c, (width, height))
+    @staticmethod
+    def stack_frames(frames, out=None):
+        '''
+        put single channel uint8 frames into the channels of one image,
+        into out when given
+        '''
+        frames = [np.reshape(f, f.shape[:2]) for f in frames]
+        return np.stack(frames, axis=-1, out=out)
 
-        return img_arr
+    def load_gray_record(self, ix):
+        '''
+        record ix with its images as grayscale frames
+        '''
+        data = super(TubImageStacker, self).get_record(ix)
+        for key, val in data.items():
+            typ = self.get_input_type(key)
+            if typ == 'image' and val is not None:
+                data[key] = gray_frame(np.array(Image.open(open_file(val))))
+            elif typ == 'image_array' and val is not None:
+                data[key] = gray_frame(val)
+        return data
 
-    def get_record(self, ix):
+    def get_record(self, ix, out=None):
         '''
         get the current record and two previous.
         stack the 3 images into a single image.
+        A previous record that is not in the tub, as before the first one,
+        is replaced by the record after it. out maps image keys to arrays
+        to stack the images into, new ones are added when missing or of
+        another shape.
         '''
-        data = super(TubImageStacker, self).get_record(ix)
-
-        if ix > 1:
-            data_ch1 = super(TubImageStacker, self).get_record(ix - 1)
-            data_ch0 = super(TubImageStacker, self).get_record(ix - 2)
-
-            json_data = self.get_json_record(ix)
-            for key, val in json_data.items():
-                typ = self.get_input_type(key)
-
-                #load objects that were saved as separate files
-                if typ == 'image':
-                    val = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    data[key] = val
-                elif typ == 'image_array':
-                    img = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    val = np.array(img)
-
+        records = []
+        for i in (ix, ix - 1, ix - 2):
+            if i == ix or i in self.manifest.ids:
+                records.insert(0, self.frames.get(i))
+            else:
+                records.insert(0, records[0])
+        data = dict(records[-1])
+        for key in data:
+            if self.get_input_type(key) in ('image', 'image_array') and data[key] is not None:
+                frames = [r[key] for r in records]
+                if out is None:
+                    data[key] = self.stack_frames(frames)
+                    continue
+                shape = frames[0].shape[:2] + (len(frames),)
+                buf = out.get(key)
+                if buf is None or buf.shape != shape or buf.dtype != frames[0].dtype:
+                    buf = out[key] = np.empty(shape, frames[0].dtype)
+                data[key] = self.stack_frames(frames, out=buf)
         return data
 
+    def iter_records(self, ixs=None, reuse=False):
+        '''
+        yield the stacked records ixs, all records of the tub by default, in
+        index order. With reuse the images of every record are stacked into
+        the same arrays, so they are only valid until the next record.
+        '''
+        if ixs is None:
+            ixs = self.get_index(shuffled=False)
+        out = self.stacked if reuse else None
+        for ix in sorted(ixs):
+            yield ix, self.get_record(ix, out)
+
 
 
 class TubTimeStacker(TubImageStacker):
@@ -572,6 +1057,9 @@ class TubTimeStacker(TubImageStacker):
     A Tub for training N with records stacked through time. 
     The idea here is to force the network to learn to look ahead in time.
     Init with an array of time offsets from the current time.
+
+    The json records of the frames read last are kept in a window, so
+    reading the records in order parses each of them once.
     '''
 
     def __init__(self, frame_list, *args, **kwargs):
@@ -583,34 +1071,34 @@ class TubTimeStacker(TubImageStacker):
         '''
         super(TubTimeStacker, self).__init__(*args, **kwargs)
         self.frame_list = frame_list
+        span = max(frame_list) - min(frame_list) + 2
+        self.json_records = RecordWindow(self.get_json_record, size=span)
   
-    def get_record(self, ix):
+    def get_record(self, ix, out=None):
         '''
         stack the N records into a single record.
         Each key value has the record index with a suffix of _N where N is
-        the frame offset into the data.
+        the frame offset into the data. Images are not stacked, so out is
+        not used.
         '''
         data = {}
         for i, iOffset in enumerate(self.frame_list):
             iRec = ix + iOffset
             
             try:
-                json_data = self.get_json_record(iRec)
-            except FileNotFoundError:
-                pass
-            except:
-                pass
+                json_data = self.json_records.get(iRec)
+            except Exception:
+                continue
 
             for key, val in json_data.items():
                 typ = self.get_input_type(key)
 
                 #load only the first image saved as separate files
                 if typ == 'image' and i == 0:
-                    val = Image.open(os.path.join(self.path, val))
+                    val = Image.open(open_file(val))
                     data[key] = val                    
                 elif typ == 'image_array' and i == 0:
-                    d = super(TubTimeStacker, self).get_record(ix)
-                    data[key] = d[key]
+                    data[key] = None if val is None else load_image_arr(val)
                 else:
                     '''
                     we append a _offset to the key
@@ -629,18 +1117,18 @@ class TubGroup(Tub):
         self.input_types = {}
 
         record_count = 0
-        for t in tubs:
-            t.update_df()
+        for t, df in zip(tubs, load_tub_dfs(tubs)):
+            t.df = df
             record_count += len(t.df)
             self.input_types.update(dict(zip(t.inputs, t.types)))
 
-        print('joining the tubs {} records together. This could take {} minutes.'.format(record_count,
-                                                                                         int(record_count / 300000)))
+        print('joining the tubs {} records together.'.format(record_count))
 
         self.meta = {'inputs': list(self.input_types.keys()),
                      'types': list(self.input_types.values())}
 
 
+        import pandas as pd
         self.df = pd.concat([t.df for t in tubs], axis=0, join='inner')
 
 
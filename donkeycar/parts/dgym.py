@@ -3,11 +3,14 @@ import os
 import time
 import gym
 import gym_donkeycar
+from donkeycar.mailbox import LatestValue
+from donkeycar.vehicle import trace
 
 def is_exe(fpath):
     return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
 
 class DonkeyGymEnv(object):
+    tracer = None
 
     def __init__(self, sim_path, host="127.0.0.1", port=9091, headless=0, env_name="donkey-generated-track-v0", sync="asynchronous", conf={}, delay=0):
         os.environ['DONKEY_SIM_PATH'] = sim_path
@@ -24,7 +27,7 @@ class DonkeyGymEnv(object):
 
         self.env = gym.make(env_name, exe_path=sim_path, host=host, port=port)
         self.frame = self.env.reset()
-        self.action = [0.0, 0.0]
+        self.actions = LatestValue([0.0, 0.0])
         self.running = True
         self.info = { 'pos' : (0., 0., 0.)}
         self.delay = float(delay)
@@ -34,9 +37,18 @@ class DonkeyGymEnv(object):
             #without this small delay, we seem to miss packets
             time.sleep(0.1)
 
+    @property
+    def action(self):
+        return self.actions.get()
+
     def update(self):
+        # step the sim once for every action of the drive loop instead of
+        # as fast as it goes
+        seq, action = self.actions.read()
         while self.running:
-            self.frame, _, _, self.info = self.env.step(self.action)
+            with trace(self.tracer, 'step'):
+                self.frame, _, _, self.info = self.env.step(action)
+            seq, action = self.actions.wait(seq)
 
     def run_threaded(self, steering, throttle):
         if steering is None or throttle is None:
@@ -44,11 +56,12 @@ class DonkeyGymEnv(object):
             throttle = 0.0
         if self.delay > 0.0:
             time.sleep(self.delay / 1000.0)
-        self.action = [steering, throttle]
+        self.actions.put([steering, throttle])
         return self.frame
 
     def shutdown(self):
         self.running = False
+        self.actions.close()
         time.sleep(0.2)
         self.env.close()
 
@@ -7,6 +7,8 @@ import donkeycar as dk
 
 class ImgArrToJpg():
 
+    skip_if_unchanged = True
+
     def run(self, img_arr):
         if img_arr is None:
             return None
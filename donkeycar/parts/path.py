@@ -19,7 +19,8 @@ class Path(object):
     def run(self, x, y):
         d = dist(x, y, self.x, self.y)
         if self.recording and d > self.min_dist:
-            self.path.append((x, y))
+            # emit a new list so parts reading the path see it changed
+            self.path = self.path + [(x, y)]
             logging.info("path point (%f, %f)" % ( x, y))
             self.x = x
             self.y = y
@@ -74,6 +75,8 @@ class PathPlot(object):
     '''
     draw a path plot to an image
     '''
+    skip_if_unchanged = True
+
     def __init__(self, scale=1.0, offset=(0., 0.0)):
         self.scale = scale
         self.offset = offset
@@ -143,6 +146,8 @@ from donkeycar.la import Line3D, Vec3
 
 class CTE(object):
 
+    skip_if_unchanged = True
+
     def nearest_two_pts(self, path, x, y):
         if len(path) < 2:
             return None, None
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+replay.py
+
+Parts to run a drive loop against recorded data instead of the car's
+hardware. A TubSource plays back the camera images, sensor readings and user
+inputs of existing tubs, one record per loop, and MockActuator takes the
+place of the steering and throttle. With these the whole pipeline of a
+template can be benchmarked on a desktop, see `manage.py replay`.
+"""
+import os
+import time
+
+from donkeycar.parts.datastore import Tub
+
+
+# channels that come from the camera, the sensors or the user on the car
+REPLAY_PREFIXES = ('cam/', 'imu/', 'user/')
+
+# loop rate when replaying as fast as possible
+MAX_RATE_HZ = 10000
+
+
+class TubSource:
+    '''
+    Plays back the records of one or more tubs in the order they were
+    recorded, returning the values of keys for one record per run. By
+    default keys are the camera, sensor and user channels of the first tub.
+    overrides maps keys to values returned instead of the recorded ones,
+    like a pilot mode for user/mode so a model drives the replay. They are
+    added to keys when missing.
+
+    run() never waits, one record is played per loop. When realtime is
+    True, replay() runs the loop at the rate the records were made with,
+    record_rate(), so the waiting is the loop's sleep and not part of its
+    busy time. After the last record run() keeps returning it and done is
+    True.
+    '''
+    def __init__(self, paths, keys=None, realtime=False, overrides=None):
+        self.tubs = [Tub(os.path.expanduser(p)) for p in paths]
+        self.records = []
+        for tub in self.tubs:
+            self.records += [(tub, ix) for ix in tub.get_index(shuffled=False)
+                             if ix not in tub.exclude]
+        if keys is None:
+            keys = [k for k in self.tubs[0].inputs
+                    if k.startswith(REPLAY_PREFIXES)]
+        self.overrides = dict(overrides or {})
+        self.keys = list(keys) + [k for k in self.overrides if k not in keys]
+        self.realtime = realtime
+        self.next_ix = 0
+        self.outputs = None
+        self.done = False
+
+    @property
+    def num_records(self):
+        return len(self.records)
+
+    def record_rate(self):
+        '''
+        records per second the tubs were recorded at, from the milliseconds
+        of the first and last record of each tub. None when the tubs don't
+        have milliseconds.
+        '''
+        records, seconds = 0, 0.0
+        for tub in self.tubs:
+            index = [ix for ix in tub.get_index(shuffled=False) if ix not in tub.exclude]
+            if len(index) < 2:
+                continue
+            first = tub.get_json_record(index[0]).get('milliseconds')
+            last = tub.get_json_record(index[-1]).get('milliseconds')
+            if first is None or last is None or last <= first:
+                continue
+            records += len(index) - 1
+            seconds += (last - first) / 1000.0
+        if not records:
+            return None
+        return records / seconds
+
+    def run(self):
+        if self.next_ix >= len(self.records):
+            self.done = True
+            return self.outputs
+        tub, ix = self.records[self.next_ix]
+        self.next_ix += 1
+        data = tub.get_record(ix)
+        data.update(self.overrides)
+        values = [data.get(k) for k in self.keys]
+        self.outputs = values[0] if len(values) == 1 else tuple(values)
+        return self.outputs
+
+    def shutdown(self):
+        pass
+
+
+class MockActuator:
+    '''
+    Stands in for a steering, throttle or motor part, keeping the last
+    values it was given.
+    '''
+    def __init__(self):
+        self.values = None
+        self.count = 0
+
+    def run(self, *args):
+        self.values = args
+        self.count += 1
+
+    def shutdown(self):
+        pass
+
+
+def replay(V, source, verbose=False):
+    '''
+    run the vehicle V until source played all its records and return the
+    replay report. The loop runs as fast as it can, or at the rate the
+    records were made with for a realtime source.
+    '''
+    # the loop stops after max_loop_count + 1 loops
+    loops = max(source.num_records - 1, 1)
+    rate_hz = MAX_RATE_HZ
+    if source.realtime:
+        rate_hz = source.record_rate() or MAX_RATE_HZ
+        print("Replaying at the recorded rate of %.1f records/s" % rate_hz)
+    start = time.time()
+    V.start(rate_hz=rate_hz, max_loop_count=loops, verbose=verbose)
+    elapsed = time.time() - start
+    return replay_report(V.profiler, source.next_ix, elapsed)
+
+
+def replay_report(profiler, num_records, elapsed):
+    '''
+    print and return the throughput of a replay and the end-to-end latency,
+    the time one loop took from reading a record to the actuators. The
+    per part table is printed by the vehicle when it stops.
+    '''
+    latency = profiler.loop['busy'].summary(profiler.pctile)
+    report = {'records': num_records,
+              'seconds': elapsed,
+              'records_per_sec': num_records / elapsed if elapsed > 0 else 0.0,
+              'latency': latency}
+    print("Replayed %d records in %.2f s, %.1f records/s" %
+          (num_records, elapsed, report['records_per_sec']))
+    print("End-to-end loop latency: " +
+          ", ".join("%s %.2f ms" % (k[:-3], v)
+                    for k, v in latency.items() if k.endswith('_ms')))
+    return report
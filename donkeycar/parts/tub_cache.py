@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tub_cache.py
+
+Caches kept in the cache directory of a tub, to skip decoding its records
+again on every run.
+
+TubImageCache holds the training images of a tub, decoded, resized,
+cropped and converted to the image depth of the model once and saved as
+one uint8 array. Training maps the array with np.load(mmap_mode='r') and reads a
+batch with one fancy index instead of opening a jpg per record and epoch.
+
+Its name is a hash of the records in the tub manifest, the size and
+modification time of the manifest and the image settings of the config,
+so recording more data, writing records again after erasing them or
+changing IMAGE_W, IMAGE_H, IMAGE_DEPTH or the ROI crop makes a new
+cache. The labels of the cached records are saved next to the images.
+
+TubRecordCache holds the DataFrame of the json records of a tub, one .npy
+file per column, so loading a tub reads a few arrays instead of parsing a
+json file per record. The frame is in memory like a parsed one. It is made
+again when the number of records or the modification time of the manifest
+changes, or the tub moved, as the records hold absolute paths.
+
+CollatedIndex holds what training collates of every record of a tub: its
+image, labels, IMU and behavior vectors and whether it is in the train or
+the validation set, as columns in one .npz file. It remembers how far it
+read the manifest, so only records added or written again since are
+parsed, and records keep the set they were put in across trainings.
+
+ImageMemoryCache is not kept in a tub: it holds preprocessed uint8 images
+of any tubs in memory while training, in one array allocated up front for
+a budget of bytes, and evicts images with the CLOCK algorithm when full.
+"""
+import os
+import json
+import glob
+import zlib
+import shutil
+import hashlib
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from donkeycar.utils import img_crop, rgb2gray, one_byte_scale
+from donkeycar.parts.tub_chunks import open_file
+
+
+# config settings the cached images depend on
+CACHE_SETTINGS = ('IMAGE_W', 'IMAGE_H', 'IMAGE_DEPTH', 'ROI_CROP_TOP', 'ROI_CROP_BOTTOM')
+
+# labels saved with the images
+LABEL_KEYS = ('user/angle', 'user/throttle')
+
+# json records collated by one task on the process pool
+COLLATE_CHUNK_RECORDS = 5000
+IMU_KEYS = ('imu/acl_x', 'imu/acl_y', 'imu/acl_z', 'imu/gyr_x', 'imu/gyr_y', 'imu/gyr_z')
+# columns of vectors collated by the record keys they come from
+VECTOR_KEYS = {'behavior': 'behavior/one_hot_state_array',
+               'location': 'location/one_hot_state_array'}
+
+
+def preprocess_image(img, cfg):
+    '''
+    resize, crop and convert a PIL image like load_scaled_image_arr does,
+    but keep it uint8
+    '''
+    if img.height != cfg.IMAGE_H or img.width != cfg.IMAGE_W:
+        img = img.resize((cfg.IMAGE_W, cfg.IMAGE_H))
+    img_arr = np.array(img)
+    if cfg.ROI_CROP_TOP or cfg.ROI_CROP_BOTTOM:
+        img_arr = img_crop(img_arr, cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM)
+    if img_arr.ndim == 2:
+        img_arr = img_arr[..., np.newaxis]
+    if img_arr.shape[2] == 3 and cfg.IMAGE_DEPTH == 1:
+        img_arr = np.round(rgb2gray(img_arr)).astype(np.uint8)[..., np.newaxis]
+    return img_arr
+
+
+def load_preprocessed_image(path, cfg):
+    '''
+    the uint8 image at path, which may be a blob reference, preprocessed
+    like preprocess_image. None when it can't be loaded.
+    '''
+    try:
+        return preprocess_image(Image.open(open_file(path)), cfg)
+    except Exception as e:
+        print(e)
+        print('failed to load image:', path)
+        return None
+
+
+def cache_key(tub, cfg):
+    '''
+    hash of the records of the tub and the image settings. The manifest
+    gets a line for every record written, so its size and modification
+    time change when erased records are written again under the same
+    indexes.
+    '''
+    try:
+        st = os.stat(tub.manifest.path)
+        manifest = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        manifest = None
+    h = hashlib.sha1()
+    h.update(json.dumps({'path': os.path.basename(os.path.normpath(tub.path)),
+                         'start': tub.meta.get('start'),
+                         'manifest': manifest,
+                         'settings': [getattr(cfg, k, None) for k in CACHE_SETTINGS]},
+                        sort_keys=True).encode('utf-8'))
+    h.update(np.array(tub.get_index(shuffled=False), dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+
+class TubImageCache(object):
+    '''
+    The image cache of one tub for the image settings of cfg. images is
+    an array of the preprocessed uint8 images with one row per record,
+    ixs holds the record index of each row, sorted, and valid is False for
+    records whose image could not be read. labels maps LABEL_KEYS to float32
+    arrays.
+    '''
+    dir_name = 'cache'
+
+    def __init__(self, tub, cfg):
+        self.tub = tub
+        self.cfg = cfg
+        self.key = cache_key(tub, cfg)
+        self.dir = os.path.join(tub.path, self.dir_name)
+        self.images_path = os.path.join(self.dir, self.key + '.images.npy')
+        self.labels_path = os.path.join(self.dir, self.key + '.labels.npz')
+        self.images = None
+        self.ixs = None
+        self.valid = None
+        self.labels = {}
+
+    def exists(self):
+        return os.path.exists(self.images_path) and os.path.exists(self.labels_path)
+
+    def build(self, verbose=False):
+        '''
+        decode every record of the tub into the cache files
+        '''
+        tub = self.tub
+        ixs = np.array(tub.get_index(shuffled=False), dtype=np.int64)
+        os.makedirs(self.dir, exist_ok=True)
+        if verbose:
+            print('caching %d images of %s' % (len(ixs), tub.path))
+
+        images = None
+        valid = np.zeros(len(ixs), dtype=bool)
+        labels = {k: np.full(len(ixs), np.nan, dtype=np.float32) for k in LABEL_KEYS}
+        tmp_images = self.images_path + '.tmp'
+        for row, ix in enumerate(ixs):
+            try:
+                record = tub.get_json_record(int(ix))
+                img = Image.open(open_file(record['cam/image_array']))
+                img_arr = preprocess_image(img, self.cfg)
+            except Exception as e:
+                print('failed to cache record %d of %s: %s' % (ix, tub.path, e))
+                continue
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    tmp_images, mode='w+', dtype=np.uint8,
+                    shape=(len(ixs),) + img_arr.shape)
+            if img_arr.shape != images.shape[1:]:
+                print('record %d of %s has an image of shape %s, not %s' %
+                      (ix, tub.path, img_arr.shape, images.shape[1:]))
+                continue
+            images[row] = img_arr
+            valid[row] = True
+            for k in LABEL_KEYS:
+                if record.get(k) is not None:
+                    labels[k][row] = float(record[k])
+
+        if images is None:
+            images = np.lib.format.open_memmap(tmp_images, mode='w+',
+                                               dtype=np.uint8, shape=(0, 0, 0, 0))
+        images.flush()
+        del images
+        tmp_labels = self.labels_path + '.tmp.npz'
+        np.savez(tmp_labels, ixs=ixs, valid=valid,
+                 **{k.replace('/', '-'): v for k, v in labels.items()})
+        os.replace(tmp_labels, self.labels_path)
+        os.replace(tmp_images, self.images_path)
+        self.remove_stale()
+
+    def remove_stale(self):
+        '''
+        delete caches of this tub made for other records or settings
+        '''
+        paths = glob.glob(os.path.join(self.dir, '*.images.npy*')) + \
+            glob.glob(os.path.join(self.dir, '*.labels.npz*'))
+        for path in paths:
+            if not os.path.basename(path).startswith(self.key + '.'):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def load(self):
+        self.images = np.load(self.images_path, mmap_mode='r')
+        with np.load(self.labels_path) as f:
+            self.ixs = f['ixs']
+            self.valid = f['valid']
+            self.labels = {k: f[k.replace('/', '-')] for k in LABEL_KEYS}
+        return self
+
+    @classmethod
+    def open(cls, tub, cfg, verbose=False):
+        '''
+        the loaded cache of tub, built first when there is none for its
+        current records and cfg. None when it can't be written.
+        '''
+        cache = cls(tub, cfg)
+        try:
+            if not cache.exists():
+                cache.build(verbose)
+            return cache.load()
+        except OSError as e:
+            print('could not cache images of %s: %s' % (tub.path, e))
+            return None
+
+    def row(self, ix):
+        '''
+        row of record ix, None when it is not cached
+        '''
+        row = int(np.searchsorted(self.ixs, ix))
+        if row < len(self.ixs) and self.ixs[row] == ix and self.valid[row]:
+            return row
+        return None
+
+    def get_images(self, rows, out=None):
+        '''
+        the normalized float32 images of rows, like load_scaled_image_arr
+        returns them, written into the array out when given
+        '''
+        rows = np.asarray(rows)
+        if out is None:
+            out = np.empty((len(rows),) + self.images.shape[1:], dtype=np.float32)
+        np.multiply(self.images[rows], np.float32(one_byte_scale), out=out, casting='unsafe')
+        return out
+
+
+class ImageMemoryCache(object):
+    '''
+    Preprocessed uint8 images kept in memory, by their path. The images are
+    stored in one array of as many image slots as fit in budget bytes,
+    allocated when the first image is stored, as all images have the
+    shape of the first one. When the slots are full the CLOCK algorithm
+    picks the slot to reuse: a hand goes round the slots, clearing the
+    referenced flag of images used since it last passed and evicting the
+    first image without it.
+
+    get_images() is safe to call from several threads. hits and misses
+    count the images found and loaded since reset_stats().
+    '''
+
+    def __init__(self, cfg, budget):
+        self.cfg = cfg
+        self.budget = budget
+        self.arena = None
+        self.slots = {}
+        self.keys = []
+        self.referenced = None
+        self.hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @property
+    def nbytes(self):
+        return 0 if self.arena is None else self.arena.nbytes
+
+    def allocate(self, shape):
+        num_slots = int(self.budget // int(np.prod(shape)))
+        self.arena = np.empty((num_slots,) + shape, dtype=np.uint8)
+        self.referenced = np.zeros(num_slots, dtype=bool)
+        self.keys = [None] * num_slots
+
+    def get(self, key):
+        '''
+        a copy of the image of key, None when it is not cached
+        '''
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.referenced[slot] = True
+            return self.arena[slot].copy()
+
+    def put(self, key, img_arr):
+        with self.lock:
+            if self.arena is None:
+                self.allocate(img_arr.shape)
+            if len(self.keys) == 0 or img_arr.shape != self.arena.shape[1:] \
+                    or key in self.slots:
+                return
+            if len(self.slots) < len(self.keys):
+                slot = len(self.slots)
+            else:
+                while self.referenced[self.hand]:
+                    self.referenced[self.hand] = False
+                    self.hand = (self.hand + 1) % len(self.keys)
+                slot = self.hand
+                self.hand = (self.hand + 1) % len(self.keys)
+                del self.slots[self.keys[slot]]
+            self.arena[slot] = img_arr
+            self.keys[slot] = key
+            self.slots[key] = slot
+
+    def get_image(self, path):
+        '''
+        the uint8 image at path, loaded and cached when it is not cached.
+        None when it can't be loaded.
+        '''
+        img_arr = self.get(path)
+        if img_arr is None:
+            img_arr = load_preprocessed_image(path, self.cfg)
+            if img_arr is not None:
+                self.put(path, img_arr)
+        return img_arr
+
+    def get_images(self, paths):
+        '''
+        the images at paths as normalized float32 arrays, like
+        load_scaled_image_arr returns them, None for the images that
+        can't be loaded
+        '''
+        imgs = [self.get_image(path) for path in paths]
+        return [None if img is None else img.astype(np.float32) * np.float32(one_byte_scale)
+                for img in imgs]
+
+    def reset_stats(self):
+        '''
+        the hits, misses and hit rate since the last reset
+        '''
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        total = hits + misses
+        return hits, misses, hits / total if total else 0.0
+
+
+class TubRecordCache(object):
+    '''
+    The DataFrame of the json records of a tub, saved as one .npy file per
+    column in a directory named after the number of records, the
+    modification time of the manifest and the path of the tub. Columns of
+    strings and lists are pickled.
+    '''
+    dir_name = TubImageCache.dir_name
+    prefix = 'records_'
+
+    def __init__(self, tub):
+        self.tub = tub
+        try:
+            mtime = os.stat(tub.manifest.path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        path_crc = zlib.crc32(os.path.abspath(tub.path).encode('utf-8'))
+        self.key = '%d_%d_%08x' % (tub.get_num_records(), mtime, path_crc)
+        self.cache_dir = os.path.join(tub.path, self.dir_name)
+        self.dir = os.path.join(self.cache_dir, self.prefix + self.key)
+        self.columns_path = os.path.join(self.dir, 'columns.json')
+
+    def column_path(self, n):
+        return os.path.join(self.dir, 'column_%d.npy' % n)
+
+    def load(self):
+        '''
+        the cached DataFrame, None when there is no current one
+        '''
+        import pandas as pd
+
+        try:
+            with open(self.columns_path, 'r') as f:
+                columns = json.load(f)
+            data = {}
+            for n, (name, is_object) in enumerate(columns):
+                data[name] = np.load(self.column_path(n), allow_pickle=is_object)
+        except (OSError, ValueError):
+            return None
+        return pd.DataFrame(data, columns=[c[0] for c in columns])
+
+    def save(self, df):
+        '''
+        save df as the cache of the current records and delete older ones
+        '''
+        tmp_dir = self.dir + '.tmp'
+        try:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            columns = []
+            for n, name in enumerate(df.columns):
+                arr = df[name].to_numpy()
+                is_object = arr.dtype == object
+                np.save(os.path.join(tmp_dir, 'column_%d.npy' % n), arr,
+                        allow_pickle=is_object)
+                columns.append((name, bool(is_object)))
+            # written last, a cache without it is not loaded
+            with open(os.path.join(tmp_dir, 'columns.json'), 'w') as f:
+                json.dump(columns, f)
+            shutil.rmtree(self.dir, ignore_errors=True)
+            os.rename(tmp_dir, self.dir)
+        except OSError as e:
+            print('could not cache records of %s: %s' % (self.tub.path, e))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        for path in glob.glob(os.path.join(self.cache_dir, self.prefix + '*')):
+            if path != self.dir:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def new_columns(n):
+    columns = {'index': np.zeros(n, dtype=np.int64),
+               'valid': np.zeros(n, dtype=bool),
+               'train': np.zeros(n, dtype=bool),
+               'image': np.full(n, '', dtype=object),
+               'angle': np.full(n, np.nan),
+               'throttle': np.full(n, np.nan),
+               'imu': np.full((n, len(IMU_KEYS)), np.nan)}
+    for name in VECTOR_KEYS:
+        columns[name] = np.full(n, None, dtype=object)
+    return columns
+
+
+def take_rows(columns, rows):
+    return {name: col[rows] for name, col in columns.items()}
+
+
+def join_columns(parts):
+    if not parts:
+        return new_columns(0)
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def collate_tub_records(tub_path, ixs):
+    '''
+    the columns of records ixs of a tub. valid is False for records that
+    can't be read or have no image or labels.
+    '''
+    from donkeycar.parts.datastore import Tub
+
+    tub = Tub(tub_path)
+    columns = new_columns(len(ixs))
+    columns['index'][:] = ixs
+    for row, ix in enumerate(ixs):
+        try:
+            record = tub.get_json_record(ix)
+            image = os.path.relpath(record['cam/image_array'], tub.path)
+            angle = float(record['user/angle'])
+            throttle = float(record['user/throttle'])
+        except Exception:
+            continue
+        columns['valid'][row] = True
+        columns['image'][row] = image
+        columns['angle'][row] = angle
+        columns['throttle'][row] = throttle
+        try:
+            columns['imu'][row] = [float(record[k]) for k in IMU_KEYS]
+        except (KeyError, TypeError, ValueError):
+            pass
+        for name, key in VECTOR_KEYS.items():
+            columns[name][row] = record.get(key)
+    tub.shutdown()
+    return columns
+
+
+def manifest_ids_after(path, offset):
+    '''
+    indexes of the records added to a manifest after offset bytes, all of
+    them when the manifest is shorter, as it was written again
+    '''
+    ids = set()
+    try:
+        with open(path, 'r') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(offset if offset <= f.tell() else 0)
+            for line in f:
+                if line[0] == '+':
+                    try:
+                        ids.add(int(line[1:]))
+                    except ValueError:
+                        pass
+    except OSError:
+        pass
+    return ids
+
+
+class CollatedIndex(object):
+    '''
+    The collated records of a tub, see collate_tubs(). columns maps names
+    to arrays with one row per record, sorted by the record index.
+    manifest_size is the size the manifest had when they were collated
+    and split the train ratio they were split with.
+    '''
+    dir_name = TubImageCache.dir_name
+    file_name = 'collated.npz'
+
+    def __init__(self, tub):
+        self.tub = tub
+        self.path = os.path.join(tub.path, self.dir_name, self.file_name)
+        self.columns = None
+        self.manifest_size = 0
+        self.split = None
+        self.changed = False
+
+    def load(self):
+        try:
+            with np.load(self.path, allow_pickle=True) as f:
+                self.manifest_size = int(f['manifest_size'])
+                self.split = float(f['split'])
+                self.columns = {name: f[name] for name in new_columns(0)}
+            self.columns['image'] = self.columns['image'].astype(object)
+        except (OSError, ValueError, KeyError):
+            self.columns = None
+        return self
+
+    def save(self):
+        tmp_path = self.path + '.tmp.npz'
+        columns = dict(self.columns, image=self.columns['image'].astype(str))
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            np.savez(tmp_path, manifest_size=self.manifest_size, split=self.split,
+                     **columns)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print('could not save the collated records of %s: %s' % (self.tub.path, e))
+
+
+def split_rows(columns, rows, split):
+    '''
+    put a random split of the valid rows in the train set and the rest in
+    the validation set
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    rows = rows[columns['valid'][rows]]
+    rows = rows[np.random.permutation(len(rows))]
+    num_train = int(split * len(rows))
+    columns['train'][rows[:num_train]] = True
+    columns['train'][rows[num_train:]] = False
+
+
+def collate_tubs(tubs, split, workers=None):
+    '''
+    the collated columns of the records of each tub. They are loaded from
+    the CollatedIndex of the tub, records it doesn't have are collated on
+    a process pool, with one task per COLLATE_CHUNK_RECORDS records, and
+    the new records are split into the train and validation set at the
+    ratio split. The index of each tub is then saved again.
+    '''
+    indexes = [CollatedIndex(tub).load() for tub in tubs]
+    jobs = []
+    for n, (tub, index) in enumerate(zip(tubs, indexes)):
+        ids = tub.manifest.ids
+        try:
+            manifest_size = os.path.getsize(tub.manifest.path)
+        except OSError:
+            manifest_size = 0
+        if manifest_size != index.manifest_size or index.split != split:
+            index.changed = True
+        if index.columns is None:
+            index.columns = new_columns(0)
+            index.changed = True
+            known = set()
+        else:
+            written = manifest_ids_after(tub.manifest.path, index.manifest_size)
+            ixs = index.columns['index']
+            keep = np.isin(ixs, list(ids)) & ~np.isin(ixs, list(written))
+            index.columns = take_rows(index.columns, keep)
+            known = set(index.columns['index'].tolist())
+        index.manifest_size = manifest_size
+        new = sorted(ids - known)
+        jobs += [(n, new[start:start + COLLATE_CHUNK_RECORDS])
+                 for start in range(0, len(new), COLLATE_CHUNK_RECORDS)]
+
+    results = {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(jobs) <= 1 or workers < 2:
+        for n, ixs in jobs:
+            results.setdefault(n, []).append(collate_tub_records(tubs[n].path, ixs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(n, pool.submit(collate_tub_records, tubs[n].path, ixs))
+                       for n, ixs in jobs]
+            for n, future in futures:
+                results.setdefault(n, []).append(future.result())
+
+    for n, index in enumerate(indexes):
+        old = len(index.columns['index'])
+        columns = join_columns([index.columns] + results.get(n, []))
+        if index.split != split:
+            split_rows(columns, np.arange(len(columns['index'])), split)
+        else:
+            split_rows(columns, np.arange(old, len(columns['index'])), split)
+        order = np.argsort(columns['index'], kind='stable')
+        index.columns = take_rows(columns, order)
+        index.split = split
+        if index.changed:
+            index.save()
+    return [index.columns for index in indexes]
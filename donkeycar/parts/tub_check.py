@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tub_check.py
+
+Checks that the records of tubs can be read: the json parses and the
+images open, or fully decode when asked to. Records are checked on a
+process pool, in tasks of CHECK_CHUNK_RECORDS records.
+
+Every record that passed gets a stamp in checked.json in its tub: the
+size, modification time and a crc32 of its files, and whether its images
+were fully decoded. Later checks skip records whose files have the same
+size and time, and do not decode images with the same crc, after they
+were copied. A nightly check only reads the records that are new or
+changed.
+"""
+import io
+import os
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from donkeycar.parts.tub_chunks import IMAGE_TYPES, is_blob_ref, read_blob
+
+
+CHECK_CHUNK_RECORDS = 2000
+STAMPS_FILE = 'checked.json'
+
+
+def load_stamps(tub_path):
+    try:
+        with open(os.path.join(tub_path, STAMPS_FILE), 'r') as f:
+            return {int(ix): stamp for ix, stamp in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_stamps(tub_path, stamps):
+    path = os.path.join(tub_path, STAMPS_FILE)
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump({str(ix): stamp for ix, stamp in stamps.items()}, f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print('could not save the check stamps of %s: %s' % (tub_path, e))
+
+
+def record_files(tub, ix, record):
+    '''
+    names relative to the tub of the files of record ix, blob references
+    for a version 2 tub
+    '''
+    names = []
+    if tub.chunks is None:
+        names.append(os.path.basename(tub.get_json_record_path(ix)))
+    for key in tub.inputs:
+        val = record.get(key)
+        if val is not None and tub.get_input_type(key) in IMAGE_TYPES:
+            names.append(os.path.relpath(val, tub.path))
+    return names
+
+
+def stamps_unchanged(tub, ix, stamp):
+    '''
+    True when the files of record ix have the size and time of its stamp
+    '''
+    if tub.chunks is not None:
+        # records of chunk files are never changed, only written again
+        # under the same index, which points it to other blobs
+        try:
+            record = tub.get_json_record(ix)
+        except Exception:
+            return False
+        return record_files(tub, ix, record) == [f[0] for f in stamp['files']]
+    for name, size, mtime in stamp['files']:
+        try:
+            st = os.stat(os.path.join(tub.path, name))
+        except OSError:
+            return False
+        if st.st_size != size or st.st_mtime_ns != mtime:
+            return False
+    return True
+
+
+def check_record(tub, ix, stamp, full):
+    '''
+    check record ix. returns the error, None when it passed, and its new
+    stamp, or None for the stamp when the files were not read because they
+    are unchanged.
+    '''
+    if stamp is not None and full and not stamp.get('full'):
+        # only checked the image headers before
+        stamp = None
+    if stamp is not None and stamps_unchanged(tub, ix, stamp):
+        return None, None
+    try:
+        record = tub.get_json_record(ix)
+        files = []
+        images = []
+        crc = 0
+        for name in record_files(tub, ix, record):
+            path = os.path.join(tub.path, name)
+            if is_blob_ref(path):
+                data = read_blob(path)
+                files.append([name, len(data), 0])
+            else:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                st = os.stat(path)
+                files.append([name, st.st_size, st.st_mtime_ns])
+            crc = zlib.crc32(data, crc)
+            if not name.endswith('.json'):
+                images.append(data)
+        # copied files keep their content, they need not be decoded again
+        same = stamp is not None and stamp['crc'] == crc
+        if not same:
+            for data in images:
+                img = Image.open(io.BytesIO(data))
+                if full:
+                    img.load()
+    except Exception as e:
+        return '%s: %s' % (type(e).__name__, e), None
+    return None, {'files': files, 'crc': crc, 'full': full or (same and stamp['full'])}
+
+
+# the tubs opened by a check worker process, by path
+worker_tubs = {}
+
+
+def open_worker_tubs(tub_paths):
+    '''
+    opens the tubs once in a check worker process, so its tasks need not
+    read the manifests again
+    '''
+    from donkeycar.parts.datastore import Tub
+
+    worker_tubs.clear()
+    for tub_path in tub_paths:
+        worker_tubs[tub_path] = Tub(tub_path)
+
+
+def check_records(tub, ixs, stamps, full):
+    '''
+    check records ixs of the tub, which in a worker process is the path of
+    a tub opened by open_worker_tubs. returns (ix, error, stamp) for each
+    record, see check_record.
+    '''
+    if isinstance(tub, str):
+        tub = worker_tubs[tub]
+    results = []
+    for ix in ixs:
+        error, stamp = check_record(tub, ix, stamps.get(ix), full)
+        results.append((ix, error, stamp))
+    return results
+
+
+def check_tubs(tubs, full=False, fix=False, workers=None):
+    '''
+    check the records of tubs, removing the records with problems when fix
+    is True. returns a report with a dict for each tub listing its
+    problems.
+    '''
+    jobs = []
+    all_stamps = []
+    for n, tub in enumerate(tubs):
+        stamps = load_stamps(tub.path)
+        all_stamps.append(stamps)
+        index = tub.get_index(shuffled=False)
+        for start in range(0, len(index), CHECK_CHUNK_RECORDS):
+            ixs = index[start:start + CHECK_CHUNK_RECORDS]
+            jobs.append((n, ixs, {ix: stamps[ix] for ix in ixs if ix in stamps}))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    results = [[] for _ in tubs]
+    if len(jobs) <= 1 or workers < 2:
+        for n, ixs, stamps in jobs:
+            results[n] += check_records(tubs[n], ixs, stamps, full)
+    else:
+        tub_paths = [tub.path for tub in tubs]
+        with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_tubs,
+                                 initargs=(tub_paths,)) as pool:
+            futures = [(n, pool.submit(check_records, tubs[n].path, ixs, stamps, full))
+                       for n, ixs, stamps in jobs]
+            for n, future in futures:
+                results[n] += future.result()
+
+    report = {'full': full, 'fix': fix, 'tubs': []}
+    for tub, old_stamps, tub_results in zip(tubs, all_stamps, results):
+        print('Checking tub:%s.' % tub.path)
+        print('Found: %d records.' % len(tub_results))
+        stamps = {}
+        problems = []
+        checked = 0
+        for ix, error, stamp in tub_results:
+            if error is not None:
+                problems.append({'index': ix, 'error': error})
+                if fix:
+                    print('problems with record, removing:', tub.path, ix, error)
+                    tub.remove_record(ix)
+                else:
+                    print('problems with record:', tub.path, ix, error)
+                continue
+            if stamp is None:
+                stamps[ix] = old_stamps[ix]
+            else:
+                stamps[ix] = stamp
+                checked += 1
+        save_stamps(tub.path, stamps)
+        print('Checked %d records, %d were unchanged.' % (checked, len(stamps) - checked))
+        if not problems:
+            print("No problems found.")
+        report['tubs'].append({'path': tub.path,
+                               'records': len(tub_results),
+                               'checked': checked,
+                               'unchanged': len(stamps) - checked,
+                               'problems': problems,
+                               'removed': [p['index'] for p in problems] if fix else []})
+    return report
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tub_chunks.py
+
+Storage of tub records in chunk files, version 2 of the tub format. Instead
+of a json file and an image file for every record, a chunk holds up to
+chunk_size records in two append only files:
+
+chunk_<n>.rows   one fixed size row per record with the record index, the
+                 milliseconds and a column for every input. Numbers are kept
+                 in their column, any other value as the offset of its
+                 payload in the blobs file.
+chunk_<n>.blobs  the payloads, jpg or png bytes for images and json for
+                 other values, each one prefixed by its length.
+
+The rows are read into memory, a few dozen bytes per record, and the blobs
+files through mmap, so reading a record touches its payloads only. At most
+MAX_OPEN_BLOBS blobs files are mapped at once, the ones read least recently
+are closed. A tub of a million records is a thousand pairs of files instead
+of two million small ones.
+
+Images are not decoded when a record is read, their value is a reference
+`<path of the blobs file>#<offset>` that open_file() turns into a file
+object for PIL.
+"""
+import io
+import os
+import json
+import mmap
+import glob
+import struct
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+
+CHUNK_SIZE = 1000
+MAX_OPEN_BLOBS = 64
+ROWS_EXT = '.rows'
+BLOBS_EXT = '.blobs'
+BLOB_SEP = '#'
+
+# types stored in a column of the row, with the value marking None
+SCALAR_TYPES = {'float': '<f8', 'int': '<i8', 'boolean': 'i1'}
+MISSING_INT = np.iinfo(np.int64).min
+MISSING_BOOL = -1
+
+# types stored as encoded image bytes, any other type is stored as json
+IMAGE_TYPES = ('image_array', 'gray16_array', 'image')
+
+# offset of a payload that is None
+NO_BLOB = -1
+
+LENGTH = struct.Struct('<I')
+
+
+def row_dtype(inputs, types):
+    '''
+    numpy dtype of the rows of a tub with the given inputs
+    '''
+    fields = [('_ix', '<i8'), ('_ms', '<i8')]
+    for key, typ in zip(inputs, types):
+        fields.append((key, SCALAR_TYPES.get(typ, '<i8')))
+    return np.dtype(fields)
+
+
+def to_column(typ, val):
+    if typ == 'float':
+        return np.nan if val is None else float(val)
+    if typ == 'int':
+        return MISSING_INT if val is None else int(val)
+    return MISSING_BOOL if val is None else int(bool(val))
+
+
+def from_column(typ, val):
+    if typ == 'float':
+        val = float(val)
+        return None if np.isnan(val) else val
+    if typ == 'int':
+        val = int(val)
+        return None if val == MISSING_INT else val
+    val = int(val)
+    return None if val == MISSING_BOOL else bool(val)
+
+
+def blob_ref(path, offset):
+    return '%s%s%d' % (path, BLOB_SEP, offset)
+
+
+def split_blob_ref(value):
+    '''
+    path and offset of a blob reference, None when value is not one
+    '''
+    if not isinstance(value, str):
+        return None
+    path, sep, offset = value.rpartition(BLOB_SEP)
+    if not sep or not path.endswith(BLOBS_EXT) or not offset.isdigit():
+        return None
+    return path, int(offset)
+
+
+def is_blob_ref(value):
+    return split_blob_ref(value) is not None
+
+
+def source_path(value):
+    '''
+    the file a path or a blob reference points to
+    '''
+    ref = split_blob_ref(value)
+    return value if ref is None else ref[0]
+
+
+def read_blob(value):
+    '''
+    the bytes of the payload a blob reference points to
+    '''
+    path, offset = split_blob_ref(value)
+    return blob_file(path).read(offset)
+
+
+def open_file(value):
+    '''
+    a path or a blob reference as something to pass to Image.open
+    '''
+    if is_blob_ref(value):
+        return io.BytesIO(read_blob(value))
+    return value
+
+
+class BlobFile(object):
+    '''
+    Read only mmap of a blobs file. The file is mapped again when a payload
+    past the end of the mapping is read, as a tub can grow while it is read.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.map = b''
+        self.lock = Lock()
+
+    def remap(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = b''
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > 0:
+                self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def read(self, offset):
+        with self.lock:
+            if offset + LENGTH.size > len(self.map):
+                self.remap()
+            length, = LENGTH.unpack_from(self.map, offset)
+            start = offset + LENGTH.size
+            if start + length > len(self.map):
+                self.remap()
+            if start + length > len(self.map):
+                raise ValueError('payload at %d is cut short in %s' % (offset, self.path))
+            return self.map[start:start + length]
+
+    def close(self):
+        with self.lock:
+            if isinstance(self.map, mmap.mmap):
+                self.map.close()
+            self.map = b''
+
+
+# the blobs files mapped for reading by path, in the order they were read
+blob_files = OrderedDict()
+blob_files_lock = Lock()
+
+
+def blob_file(path):
+    '''
+    the BlobFile of path. The files read least recently are closed, so at
+    most MAX_OPEN_BLOBS stay mapped. A closed file maps itself again when
+    it is read.
+    '''
+    with blob_files_lock:
+        bf = blob_files.get(path)
+        if bf is None:
+            bf = blob_files[path] = BlobFile(path)
+            while len(blob_files) > MAX_OPEN_BLOBS:
+                blob_files.popitem(last=False)[1].close()
+        else:
+            blob_files.move_to_end(path)
+    return bf
+
+
+class Chunk(object):
+    '''
+    The rows and blobs files of one chunk. rows holds the complete rows
+    in the file, refresh() reads the rows written since.
+    '''
+    def __init__(self, path, dtype):
+        self.path = path
+        self.rows_path = path + ROWS_EXT
+        self.blobs_path = path + BLOBS_EXT
+        self.dtype = dtype
+        self.rows = np.zeros(0, dtype)
+
+    def num_rows(self):
+        try:
+            return os.path.getsize(self.rows_path) // self.dtype.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def refresh(self):
+        n = self.num_rows()
+        if n < len(self.rows):
+            self.rows = np.zeros(0, self.dtype)
+        if n > len(self.rows):
+            # rows are only appended, so only the new ones are read
+            with open(self.rows_path, 'rb') as f:
+                f.seek(len(self.rows) * self.dtype.itemsize)
+                new = np.fromfile(f, dtype=self.dtype, count=n - len(self.rows))
+            self.rows = np.concatenate([self.rows, new]) if len(self.rows) else new
+        return self.rows
+
+
+class ChunkStore(object):
+    '''
+    Writes and reads the records of a version 2 tub. Values go in and come
+    out like the values of the json records of a version 1 tub, except that
+    images go in as encoded bytes and come out as blob references.
+
+    Records are only ever appended. A record written again with the same
+    index, as after erasing the last records, hides the older one. Records
+    are removed from the tub by its manifest, their data stays until the
+    tub is converted.
+    '''
+    def __init__(self, path, inputs, types, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.inputs = list(inputs)
+        self.types = list(types)
+        self.dtype = row_dtype(self.inputs, self.types)
+        self.chunk_size = chunk_size
+        paths = glob.glob(os.path.join(path, 'chunk_*' + ROWS_EXT))
+        paths.sort(key=lambda p: int(os.path.basename(p)[6:-len(ROWS_EXT)]))
+        self.chunks = [Chunk(p[:-len(ROWS_EXT)], self.dtype) for p in paths]
+        # sorted indexes of the records, with their chunk and row numbers
+        self.locations = None
+        self.lock = Lock()
+        self.rows_file = None
+        self.blobs_file = None
+        self.rows_in_chunk = 0
+
+    def chunk_path(self, n):
+        return os.path.join(self.path, 'chunk_%05d' % n)
+
+    def open_for_append(self):
+        if self.rows_file is not None and self.rows_in_chunk < self.chunk_size:
+            return
+        if self.rows_file is None and self.chunks and \
+                self.chunks[-1].num_rows() < self.chunk_size:
+            # carry on with the last chunk of the tub
+            chunk = self.chunks[-1]
+        else:
+            self.close_files()
+            chunk = Chunk(self.chunk_path(len(self.chunks)), self.dtype)
+            self.chunks.append(chunk)
+        self.rows_file = open(chunk.rows_path, 'ab')
+        self.blobs_file = open(chunk.blobs_path, 'ab')
+        self.blobs_file.seek(0, os.SEEK_END)
+        # drop a row cut short when the car lost power
+        size = self.rows_file.seek(0, os.SEEK_END)
+        self.rows_in_chunk = size // self.dtype.itemsize
+        if size % self.dtype.itemsize:
+            self.rows_file.truncate(self.rows_in_chunk * self.dtype.itemsize)
+            self.rows_file.seek(0, os.SEEK_END)
+
+    def append(self, ix, ms, values):
+        '''
+        append the record ix, made ms milliseconds after the tub started
+        '''
+        row = np.zeros(1, self.dtype)
+        row['_ix'] = ix
+        row['_ms'] = ms
+        payloads = []
+        for key, typ in zip(self.inputs, self.types):
+            val = values.get(key)
+            if typ in SCALAR_TYPES:
+                row[key] = to_column(typ, val)
+            elif val is None:
+                row[key] = NO_BLOB
+            elif typ in IMAGE_TYPES:
+                payloads.append((key, bytes(val)))
+            else:
+                payloads.append((key, json.dumps(val).encode('utf-8')))
+
+        with self.lock:
+            self.open_for_append()
+            offset = self.blobs_file.tell()
+            for key, payload in payloads:
+                row[key] = offset
+                self.blobs_file.write(LENGTH.pack(len(payload)))
+                self.blobs_file.write(payload)
+                offset += LENGTH.size + len(payload)
+            # the payloads are on disk before the row pointing to them
+            self.blobs_file.flush()
+            self.rows_file.write(row.tobytes())
+            self.rows_file.flush()
+            self.rows_in_chunk += 1
+            self.locations = None
+
+    def build_locations(self):
+        ixs, chunk_nos, row_nos = [], [], []
+        for n, chunk in enumerate(self.chunks):
+            rows = chunk.refresh()
+            ixs.append(np.asarray(rows['_ix']))
+            chunk_nos.append(np.full(len(rows), n, dtype=np.int32))
+            row_nos.append(np.arange(len(rows), dtype=np.int64))
+        if not ixs:
+            ixs, chunk_nos, row_nos = [np.zeros(0, np.int64)], [np.zeros(0, np.int32)], [np.zeros(0, np.int64)]
+        ixs = np.concatenate(ixs)
+        # stable, so the latest of records with the same index sorts last
+        order = np.argsort(ixs, kind='stable')
+        self.locations = (ixs[order], np.concatenate(chunk_nos)[order],
+                          np.concatenate(row_nos)[order])
+        return self.locations
+
+    def index(self):
+        '''
+        sorted indexes of all records in the chunks
+        '''
+        ixs = self.build_locations()[0]
+        return [int(ix) for ix in np.unique(ixs)]
+
+    def locate(self, ix):
+        locations = self.locations
+        for _ in range(2):
+            if locations is None:
+                locations = self.build_locations()
+            ixs, chunk_nos, row_nos = locations
+            i = np.searchsorted(ixs, ix, side='right') - 1
+            if i >= 0 and ixs[i] == ix:
+                return self.chunks[chunk_nos[i]], row_nos[i]
+            # written since the locations were built
+            locations = None
+        raise KeyError('no record %d in tub %s' % (ix, self.path))
+
+    def read(self, ix):
+        '''
+        the values of record ix, image values are references relative to
+        the tub path
+        '''
+        chunk, row_no = self.locate(ix)
+        if row_no >= len(chunk.rows):
+            chunk.refresh()
+        row = chunk.rows[row_no]
+        blobs_name = os.path.basename(chunk.blobs_path)
+        data = {}
+        for key, typ in zip(self.inputs, self.types):
+            val = row[key]
+            if typ in SCALAR_TYPES:
+                data[key] = from_column(typ, val)
+            elif val == NO_BLOB:
+                data[key] = None
+            elif typ in IMAGE_TYPES:
+                data[key] = blob_ref(blobs_name, int(val))
+            else:
+                payload = blob_file(chunk.blobs_path).read(int(val))
+                data[key] = json.loads(payload.decode('utf-8'))
+        data['milliseconds'] = int(row['_ms'])
+        return data
+
+    def close_files(self):
+        for f in (self.rows_file, self.blobs_file):
+            if f is not None:
+                f.close()
+        self.rows_file = None
+        self.blobs_file = None
+
+    def close(self):
+        with self.lock:
+            self.close_files()
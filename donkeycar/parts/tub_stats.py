@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tub_stats.py
+
+Statistics of the records of a tub, kept in stats.json in the tub so the
+distribution of a channel can be read without opening every record.
+
+Number channels (float and int) keep their count, min, max, sum and sum of
+squares and a histogram of bins of bin_width. A histogram starts with bins
+of BIN_WIDTH and doubles their width whenever more than MAX_BINS bins lie
+between min and max, so the widths of all histograms are BIN_WIDTH times
+a power of two and can be merged. String and boolean channels, like user/mode, keep the count
+of each value. Other channels only count their values.
+
+TubWriter adds the records it writes and saves the file on shutdown and at
+intervals. For other tubs load_tub_stats() adds the records written after
+the last index in the file, or reads all of them again when records were
+removed.
+"""
+import os
+import json
+import math
+
+import numpy as np
+
+
+STATS_FILE = 'stats.json'
+BIN_WIDTH = 0.02
+MAX_BINS = 200
+NUMBER_TYPES = ('float', 'int')
+VALUE_TYPES = ('str', 'boolean')
+
+
+class TubStats(object):
+    '''
+    Running statistics of the channels of a tub. records is the number of
+    records added and last_ix the largest index added. After records were
+    removed min and max are only bounds.
+    '''
+
+    def __init__(self, inputs=(), types=()):
+        self.records = 0
+        self.last_ix = 0
+        self.channels = {}
+        for key, typ in zip(inputs, types):
+            self.channels[key] = self.new_channel(typ)
+
+    @staticmethod
+    def new_channel(typ):
+        channel = {'type': typ, 'count': 0, 'missing': 0}
+        if typ in NUMBER_TYPES:
+            channel.update({'min': None, 'max': None, 'sum': 0.0, 'sum_sq': 0.0,
+                            'bin_width': BIN_WIDTH, 'hist': {}})
+        elif typ in VALUE_TYPES:
+            channel['values'] = {}
+        return channel
+
+    def add(self, ix, record):
+        '''
+        add the values of record ix
+        '''
+        self.records += 1
+        self.last_ix = max(self.last_ix, ix)
+        for key, channel in self.channels.items():
+            self.add_value(channel, record.get(key), 1)
+
+    def remove(self, record):
+        '''
+        take the values of an added record out again
+        '''
+        self.records -= 1
+        for key, channel in self.channels.items():
+            self.add_value(channel, record.get(key), -1)
+
+    @staticmethod
+    def add_value(channel, val, n):
+        typ = channel['type']
+        if typ in NUMBER_TYPES:
+            try:
+                val = float(val)
+            except (TypeError, ValueError):
+                val = None
+            if val is None or not math.isfinite(val):
+                channel['missing'] += n
+                return
+            channel['count'] += n
+            channel['sum'] += n * val
+            channel['sum_sq'] += n * val * val
+            if n > 0:
+                if channel['min'] is None or val < channel['min']:
+                    channel['min'] = val
+                if channel['max'] is None or val > channel['max']:
+                    channel['max'] = val
+            hist = channel['hist']
+            b = str(int(math.floor(val / channel['bin_width'] + 1e-9)))
+            hist[b] = hist.get(b, 0) + n
+            if hist[b] <= 0:
+                del hist[b]
+            while bin_span(channel) > MAX_BINS:
+                coarsen(channel)
+        elif val is None:
+            channel['missing'] += n
+        else:
+            channel['count'] += n
+            if typ in VALUE_TYPES:
+                values = channel['values']
+                v = str(val)
+                values[v] = values.get(v, 0) + n
+                if values[v] <= 0:
+                    del values[v]
+
+    def merge(self, other):
+        '''
+        add the statistics of other, of another tub
+        '''
+        self.records += other.records
+        self.last_ix = max(self.last_ix, other.last_ix)
+        for key, theirs in other.channels.items():
+            if key not in self.channels:
+                self.channels[key] = self.new_channel(theirs['type'])
+            ours = self.channels[key]
+            if ours['type'] != theirs['type']:
+                continue
+            ours['count'] += theirs['count']
+            ours['missing'] += theirs['missing']
+            if ours['type'] in NUMBER_TYPES:
+                ours['sum'] += theirs['sum']
+                ours['sum_sq'] += theirs['sum_sq']
+                for k in ('min', 'max'):
+                    vals = [v for v in (ours[k], theirs[k]) if v is not None]
+                    if vals:
+                        ours[k] = min(vals) if k == 'min' else max(vals)
+                theirs = dict(theirs, hist=dict(theirs['hist']))
+                while theirs['bin_width'] < ours['bin_width']:
+                    coarsen(theirs)
+                while ours['bin_width'] < theirs['bin_width']:
+                    coarsen(ours)
+                for b, count in theirs['hist'].items():
+                    ours['hist'][b] = ours['hist'].get(b, 0) + count
+                while bin_span(ours) > MAX_BINS:
+                    coarsen(ours)
+            elif ours['type'] in VALUE_TYPES:
+                for v, count in theirs['values'].items():
+                    ours['values'][v] = ours['values'].get(v, 0) + count
+        return self
+
+    def mean(self, key):
+        channel = self.channels[key]
+        if not channel['count']:
+            return None
+        return channel['sum'] / channel['count']
+
+    def std(self, key):
+        channel = self.channels[key]
+        if not channel['count']:
+            return None
+        mean = channel['sum'] / channel['count']
+        return math.sqrt(max(channel['sum_sq'] / channel['count'] - mean * mean, 0.0))
+
+    def histogram(self, key):
+        '''
+        counts and bin edges of the histogram of a number channel, like
+        np.histogram returns them
+        '''
+        channel = self.channels[key]
+        hist = {int(b): count for b, count in channel['hist'].items()}
+        if not hist:
+            return np.zeros(0, dtype=np.int64), np.zeros(1)
+        first, last = min(hist), max(hist)
+        counts = np.array([hist.get(b, 0) for b in range(first, last + 1)], dtype=np.int64)
+        edges = np.arange(first, last + 2) * channel['bin_width']
+        return counts, edges
+
+    def to_json(self):
+        return {'records': self.records, 'last_ix': self.last_ix,
+                'channels': self.channels}
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.records = data['records']
+        stats.last_ix = data['last_ix']
+        stats.channels = data['channels']
+        return stats
+
+    def save(self, tub_path):
+        path = os.path.join(tub_path, STATS_FILE)
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.to_json(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print('could not save the stats of %s: %s' % (tub_path, e))
+
+    @classmethod
+    def load(cls, tub_path):
+        '''
+        the saved stats of a tub, None when there are none
+        '''
+        try:
+            with open(os.path.join(tub_path, STATS_FILE), 'r') as f:
+                return cls.from_json(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def bin_span(channel):
+    '''
+    the number of bins from min to max of a number channel
+    '''
+    if channel['min'] is None:
+        return 0
+    width = channel['bin_width']
+    return int(math.floor(channel['max'] / width + 1e-9)) - \
+        int(math.floor(channel['min'] / width + 1e-9)) + 1
+
+
+def coarsen(channel):
+    '''
+    double the bin width of the histogram of a number channel
+    '''
+    hist = {}
+    for b, count in channel['hist'].items():
+        b = str(int(b) // 2)
+        hist[b] = hist.get(b, 0) + count
+    channel['hist'] = hist
+    channel['bin_width'] *= 2
+
+
+def load_tub_stats(tub, save=True):
+    '''
+    the stats of the current records of a tub, adding the records written
+    since they were saved, or all of them when records were removed
+    since or the channels changed. The updated stats are saved when save is
+    True.
+    '''
+    index = tub.get_index(shuffled=False)
+    stats = TubStats.load(tub.path)
+    if stats is not None:
+        types = {k: c['type'] for k, c in stats.channels.items()}
+        known = sum(1 for ix in index if ix <= stats.last_ix)
+        if known != stats.records or types != dict(zip(tub.inputs, tub.types)):
+            stats = None
+    if stats is None:
+        stats = TubStats(tub.inputs, tub.types)
+    new = [ix for ix in index if ix > stats.last_ix]
+    for ix in new:
+        try:
+            record = tub.get_json_record(ix)
+        except Exception as e:
+            print('could not read record %d of %s: %s' % (ix, tub.path, e))
+            record = {}
+        stats.add(ix, record)
+    if save and (new or not os.path.exists(os.path.join(tub.path, STATS_FILE))):
+        stats.save(tub.path)
+    return stats
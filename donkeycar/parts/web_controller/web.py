@@ -114,11 +114,17 @@ class LocalWebController(tornado.web.Application):
         self.mode = mode
         self.recording = False
         self.port = port
+        # set to the PartProfiler of the vehicle to serve it at /profile
+        self.profiler = None
+        # set to the Tracer of the vehicle to serve it at /trace
+        self.tracer = None
 
         handlers = [
             (r"/", RedirectHandler, dict(url="/drive")),
             (r"/drive", DriveAPI),
             (r"/video", VideoAPI),
+            (r"/profile", ProfileAPI),
+            (r"/trace", TraceAPI),
             (r"/static/(.*)", StaticFileHandler,
              {"path": self.static_file_path}),
         ]
@@ -165,6 +171,38 @@ class DriveAPI(RequestHandler):
         self.application.recording = data['recording']
 
 
+class ProfileAPI(RequestHandler):
+    '''
+    Serves a json snapshot of the vehicle's part profiler.
+    '''
+
+    def get(self):
+        profiler = self.application.profiler
+        if profiler is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(json.dumps(profiler.snapshot()))
+
+
+class TraceAPI(RequestHandler):
+    '''
+    Serves the vehicle's timeline of the last seconds as a Chrome trace,
+    /trace?seconds=5 for the last 5 seconds.
+    '''
+
+    def get(self):
+        tracer = self.application.tracer
+        if tracer is None:
+            raise tornado.web.HTTPError(404)
+        seconds = self.get_argument('seconds', None)
+        seconds = float(seconds) if seconds else None
+        trace = tracer.chrome_trace(tracer.window(seconds))
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.set_header("Content-Disposition",
+                        "attachment; filename=trace.json")
+        self.write(json.dumps(trace))
+
+
 class VideoAPI(RequestHandler):
     '''
     Serves a MJPEG of the images posted from the vehicle.
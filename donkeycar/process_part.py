@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+process_part.py
+
+Run a vehicle part in a child process, so it gets a core and a GIL of its
+own. NumPy arrays, like the frames of cam/image_array, travel through ring
+buffers in shared memory. The inputs arrive in the child as views without
+a copy, the outputs are copied once out of the ring in the parent, as other
+parts may keep them. Every other value is pickled through a pipe.
+
+Shared memory needs multiprocessing.shared_memory of python 3.8 or newer.
+On older pythons the arrays are pickled through the pipe as well, which
+works the same but copies every frame.
+"""
+import traceback
+import multiprocessing as mp
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# arrays smaller than this are cheaper to pickle than to share
+MIN_SHARED_BYTES = 1024
+
+# bytes of the sequence number in front of the slots of a ring
+SEQ_BYTES = 8
+
+# blocks closed while views of them were left, kept so they stay mapped
+# until the process ends
+lingering_blocks = []
+
+
+class FrameRing:
+    '''
+    A ring of equally shaped arrays in one block of shared memory. The
+    writer copies each new array into the next slot, readers map the slot
+    as a NumPy view. A view stays valid until the ring wraps around, that is
+    for depth - 1 further frames, so parts keeping frames longer must copy.
+
+    The block starts with a sequence number per slot. It is 0 while the
+    slot is written and the number of the frame after, so a reader can tell
+    a frame that was overwritten or is half written from the one it was
+    sent.
+    '''
+    def __init__(self, shape, dtype, depth=4):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.depth = depth
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=slot_offset(depth, depth, self.frame_bytes))
+        self.seqs = ring_seqs(self.shm, depth)
+        self.seqs[:] = 0
+        self.next_slot = 0
+        self.next_seq = 1
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, arr):
+        return arr.shape == self.shape and arr.dtype == self.dtype
+
+    def put(self, arr):
+        '''
+        copy arr into the next slot, returns the slot and its sequence number
+        '''
+        slot = self.next_slot
+        seq = self.next_seq
+        self.next_slot = (slot + 1) % self.depth
+        self.next_seq += 1
+        view = shared_array(self.shm, self.shape, self.dtype,
+                            slot_offset(slot, self.depth, self.frame_bytes))
+        self.seqs[slot] = 0
+        view[...] = arr
+        self.seqs[slot] = seq
+        return slot, seq
+
+    def close(self):
+        self.seqs = None
+        if not close_block(self.shm):
+            # views are still in use, the mapping goes away with the process
+            lingering_blocks.append(self.shm)
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def slot_offset(slot, depth, frame_bytes):
+    '''
+    offset of a slot in the block of a ring, after the sequence numbers
+    '''
+    return depth * SEQ_BYTES + slot * frame_bytes
+
+
+def shared_array(shm, shape, dtype, offset):
+    '''
+    a view of a block of shared memory. np.frombuffer keeps the buffer of
+    the block exported, so closing the block fails with BufferError while
+    views are left instead of unmapping memory still in use.
+    '''
+    count = int(np.prod(shape))
+    return np.frombuffer(shm.buf, dtype, count=count, offset=offset).reshape(shape)
+
+
+def ring_seqs(shm, depth):
+    return shared_array(shm, (depth,), np.int64, 0)
+
+
+class FrameWriter:
+    '''
+    Encodes values for the pipe, moving arrays into one FrameRing per
+    position of the value in the run arguments or outputs. Without shared
+    memory arrays are pickled like other values.
+    '''
+    def __init__(self, depth=4):
+        self.depth = depth
+        self.rings = {}
+
+    def encode(self, pos, val):
+        if shared_memory is not None and isinstance(val, np.ndarray) \
+                and val.nbytes >= MIN_SHARED_BYTES:
+            ring = self.rings.get(pos)
+            if ring is None or not ring.fits(val):
+                if ring is not None:
+                    ring.close()
+                ring = FrameRing(val.shape, val.dtype, self.depth)
+                self.rings[pos] = ring
+            slot, seq = ring.put(val)
+            return ('shm', ring.name, slot, seq, ring.depth, ring.shape, ring.dtype.str)
+        return ('val', val)
+
+    def encode_all(self, values):
+        return [self.encode(i, v) for i, v in enumerate(values)]
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+
+class FrameReader:
+    '''
+    Decodes values from a FrameWriter, attaching to its rings by name. The
+    block of a ring the writer replaced is closed once no views of it are
+    left. A frame whose slot was written again since it was sent decodes
+    as None, and is counted in stale.
+    '''
+    def __init__(self):
+        self.blocks = {}
+        # the ring of each position, and replaced blocks with views left
+        self.names = {}
+        self.replaced = []
+        self.stale = 0
+
+    def attach(self, name):
+        shm = self.blocks.get(name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                # the writer owns the block and unlinks it, the resource
+                # tracker must not do that again when this process ends.
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+            self.blocks[name] = shm
+        return shm
+
+    def use(self, pos, name):
+        '''
+        note that position pos comes in the ring name, closing the block of
+        the ring it came in before
+        '''
+        old = self.names.get(pos)
+        self.names[pos] = name
+        if old is not None and old != name and old not in self.names.values():
+            shm = self.blocks.pop(old, None)
+            if shm is not None:
+                self.replaced.append(shm)
+        if self.replaced:
+            self.replaced = [shm for shm in self.replaced if not close_block(shm)]
+
+    def decode(self, msg, pos=0):
+        if msg[0] == 'val':
+            return msg[1]
+        _, name, slot, seq, depth, shape, dtype = msg
+        self.use(pos, name)
+        shm = self.attach(name)
+        if ring_seqs(shm, depth)[slot] != seq:
+            # overwritten by a later frame, or being written
+            self.stale += 1
+            return None
+        dtype = np.dtype(dtype)
+        frame_bytes = int(np.prod(shape)) * dtype.itemsize
+        return shared_array(shm, shape, dtype, slot_offset(slot, depth, frame_bytes))
+
+    def decode_all(self, msgs):
+        return [self.decode(m, i) for i, m in enumerate(msgs)]
+
+    def close(self):
+        for shm in list(self.blocks.values()) + self.replaced:
+            if not close_block(shm):
+                lingering_blocks.append(shm)
+        self.blocks = {}
+        self.names = {}
+        self.replaced = []
+
+
+def close_block(shm):
+    '''
+    close a block attached by a reader, False while views of it are left
+    '''
+    try:
+        shm.close()
+        return True
+    except BufferError:
+        return False
+
+
+def encode_outputs(writer, outputs):
+    if isinstance(outputs, tuple):
+        return ('tuple', writer.encode_all(outputs))
+    return ('one', [writer.encode(0, outputs)])
+
+
+def decode_outputs(reader, msg):
+    '''
+    the outputs of the child. Arrays from shared memory are copied, as the
+    vehicle hands them to parts that may keep them longer than the ring
+    keeps its slots, like the web controller or a part caching its inputs.
+    '''
+    kind, msgs = msg
+    values = reader.decode_all(msgs)
+    values = [v.copy() if m[0] == 'shm' and v is not None else v
+              for m, v in zip(msgs, values)]
+    if kind == 'tuple':
+        return tuple(values)
+    return values[0]
+
+
+def serve_part(part, conn, depth):
+    '''
+    main function of the child process: run the part on every request
+    until asked to shut down.
+    '''
+    reader = FrameReader()
+    writer = FrameWriter(depth)
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == 'run':
+                try:
+                    outputs = part.run(*reader.decode_all(msg[1]))
+                    conn.send(('out', encode_outputs(writer, outputs)))
+                except Exception:
+                    conn.send(('error', traceback.format_exc()))
+            elif msg[0] == 'shutdown':
+                try:
+                    if hasattr(part, 'shutdown'):
+                        part.shutdown()
+                except Exception:
+                    traceback.print_exc()
+                conn.send(('done',))
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        reader.close()
+        writer.close()
+        conn.close()
+
+
+class ProcessPart:
+    '''
+    Proxy that runs a part in a child process.
+
+    By default run() behaves like run_threaded of a threaded part: it hands
+    the latest inputs to the child when it is idle and returns the latest
+    outputs the child produced, None until the first one arrives. With
+    sync=True every run() waits for the child to finish.
+
+    The part is copied into the child when the process forks, so create it
+    without opening cameras, models or devices in the parent when possible.
+    '''
+    def __init__(self, part, sync=False, depth=4):
+        self.part_name = part.__class__.__name__
+        self.sync = sync
+        self.writer = FrameWriter(depth)
+        self.reader = FrameReader()
+        # fork, so the part does not need to be picklable
+        if 'fork' in mp.get_all_start_methods():
+            ctx = mp.get_context('fork')
+        else:
+            ctx = mp.get_context()
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=serve_part,
+                                  args=(part, child_conn, depth),
+                                  name='donkey-' + self.part_name,
+                                  daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.busy = False
+        self.outputs = None
+
+    def receive(self):
+        msg = self.conn.recv()
+        self.busy = False
+        if msg[0] == 'error':
+            raise RuntimeError('part {} failed in its process:\n{}'
+                               .format(self.part_name, msg[1]))
+        if msg[0] == 'out':
+            self.outputs = decode_outputs(self.reader, msg[1])
+
+    def run(self, *args):
+        if self.busy and (self.sync or self.conn.poll()):
+            self.receive()
+        if not self.busy:
+            self.conn.send(('run', self.writer.encode_all(args)))
+            self.busy = True
+            if self.sync:
+                self.receive()
+        return self.outputs
+
+    def shutdown(self, timeout=5.0):
+        if self.process is None:
+            return
+        try:
+            while self.busy and self.conn.poll(timeout):
+                try:
+                    self.receive()
+                except RuntimeError:
+                    pass
+            self.conn.send(('shutdown',))
+            if self.conn.poll(timeout):
+                self.conn.recv()
+        except (EOFError, BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        self.outputs = None
+        self.conn.close()
+        self.reader.close()
+        self.writer.close()
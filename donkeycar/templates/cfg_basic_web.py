@@ -58,7 +58,15 @@ PRINT_MODEL_SUMMARY = True      #print layers and weights to stdout
 OPTIMIZER = None                #adam, sgd, rmsprop, etc.. None accepts default
 LEARNING_RATE = 0.001           #only used when OPTIMIZER specified
 LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
-CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs, but crater if not enough mem.
+CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs.
+CACHE_IMAGES_MB = 2048          #memory the cached images may use, the images used least recently are dropped when it is full.
+TRAIN_IMAGE_CACHE = True        #decode, resize and crop the images of each tub once into a file in the tub's cache dir, reused by later epochs and trainings.
+TRAIN_WORKERS = 4               #how many workers make the training batches. 0 uses one per cpu core.
+TRAIN_MULTIPROCESSING = False   #make the batches in processes instead of threads. faster with many workers, but images are not cached in memory.
+TRAIN_PREFETCH = 10             #how many batches to make ahead of the model.
+TRAIN_SEED = None               #seed of the order records are shuffled in every epoch and of the augmentation, None picks one. set it to repeat a run.
+AUG_SHADOW_IMAGES = None        #glob of png images with an alpha channel composited on training images as shadows with --aug, like 'shadows/*.png'.
+AUG_WARP_PERSPECTIVE = False    #warp the perspective of training images at random with --aug.
 PRUNE_CNN = False
 PRUNE_PERCENT_TARGET = 75 # The desired percentage of pruning.
 PRUNE_PERCENT_PER_ITERATION = 20 # Percenge of pruning that is perform per iteration.
@@ -23,6 +23,12 @@ MODELS_PATH = os.path.join(CAR_PATH, 'models')
 #VEHICLE
 DRIVE_LOOP_HZ = 20      # the vehicle loop will pause if faster than this speed.
 MAX_LOOPS = None        # the vehicle loop can abort after this many iterations, when given a positive integer.
+DRIVE_LOOP_WORKERS = 0  # when > 0, parts that don't share channels run concurrently on this many threads.
+DRIVE_LOOP_OVERRUN = 'skip' # (skip|catchup|stretch) what the loop does after running longer than its period.
+TRACE_DRIVE_LOOP = False    # when true, keep a timeline of the drive loop, served as a Chrome trace at <your car>:8887/trace
+TRACE_SECONDS = 10          # length of the timeline in seconds.
+TRACE_ON_MISS = False       # when true, save the timeline to TRACE_PATH whenever a loop misses its deadline.
+TRACE_PATH = os.path.join(CAR_PATH, 'logs')
 
 #CAMERA
 CAMERA_TYPE = "PICAM"   # (PICAM|WEBCAM|CVCAM|CSIC|V4L|D435|MOCK)
@@ -95,7 +101,15 @@ OPTIMIZER = None                #adam, sgd, rmsprop, etc.. None accepts default
 LEARNING_RATE = 0.001           #only used when OPTIMIZER specified
 LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
-CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs, but crater if not enough mem.
+CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs.
+CACHE_IMAGES_MB = 2048          #memory the cached images may use, the images used least recently are dropped when it is full.
+TRAIN_IMAGE_CACHE = True        #decode, resize and crop the images of each tub once into a file in the tub's cache dir, reused by later epochs and trainings.
+TRAIN_WORKERS = 4               #how many workers make the training batches. 0 uses one per cpu core.
+TRAIN_MULTIPROCESSING = False   #make the batches in processes instead of threads. faster with many workers, but images are not cached in memory.
+TRAIN_PREFETCH = 10             #how many batches to make ahead of the model.
+TRAIN_SEED = None               #seed of the order records are shuffled in every epoch and of the augmentation, None picks one. set it to repeat a run.
+AUG_SHADOW_IMAGES = None        #glob of png images with an alpha channel composited on training images as shadows with --aug, like 'shadows/*.png'.
+AUG_WARP_PERSPECTIVE = False    #warp the perspective of training images at random with --aug.
 
 PRUNE_CNN = False               #This will remove weights from your model. The primary goal is to increase performance.
 PRUNE_PERCENT_TARGET = 75       # The desired percentage of pruning.
@@ -160,6 +174,11 @@ HAVE_ROBOHAT = False             #set to true when using the Robo HAT MM1 from R
 
 #RECORD OPTIONS
 RECORD_DURING_AI = False        #normally we do not record during ai mode. Set this to true to get image and steering records for your Ai. Be careful not to use them to train.
+RECORD_LOOP_STATS = False       #when true, the drive loop period and deadline misses are recorded along with each record.
+RECORD_QUEUE_SIZE = 20          #records waiting to be written to disk by background threads, so saving images does not slow the drive loop. 0 writes them in the drive loop.
+RECORD_QUEUE_POLICY = 'block'   #when the queue is full, 'block' waits for room in the drive loop, 'drop' skips the record.
+RECORD_WORKERS = 1              #threads encoding and writing the queued records.
+TUB_VERSION = 1                 #1 saves a json and an image file per record, 2 saves records in chunk files of 1000 records, see `donkey tubconvert`.
 
 #LED
 HAVE_RGB_LED = False            #do you have an RGB LED like https://www.amazon.com/dp/B07BNRZWNF
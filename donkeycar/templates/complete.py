@@ -5,6 +5,7 @@ Scripts to drive a donkey 2 car
 Usage:
     manage.py (drive) [--model=<model>] [--js] [--type=(linear|categorical|rnn|imu|behavior|3d|localizer|latent)] [--camera=(single|stereo)] [--meta=<key:value> ...] [--myconfig=<filename>]
     manage.py (train) [--tub=<tub1,tub2,..tubn>] [--file=<file> ...] (--model=<model>) [--transfer=<model>] [--type=(linear|categorical|rnn|imu|behavior|3d|localizer)] [--continuous] [--aug] [--myconfig=<filename>]
+    manage.py (replay) (--tub=<tub1,tub2,..tubn>) [--model=<model>] [--type=(linear|categorical|rnn|imu|behavior|3d|localizer|latent)] [--realtime] [--myconfig=<filename>]
 
 
 Options:
@@ -12,11 +13,14 @@ Options:
     --js                    Use physical joystick.
     -f --file=<file>        A text file containing paths to tub files, one per line. Option may be used more than once.
     --meta=<key:value>      Key/Value strings describing describing a piece of meta data about this drive. Option may be used more than once.
+    --realtime              Replay the tubs at the timing they were recorded with instead of as fast as possible.
     --myconfig=filename     Specify myconfig file to use. 
                             [default: myconfig.py]
 """
 import os
 import time
+import shutil
+import tempfile
 
 from docopt import docopt
 import numpy as np
@@ -26,15 +30,15 @@ import donkeycar as dk
 #import parts
 from donkeycar.parts.transform import Lambda, TriggeredCallback, DelayedTrigger
 from donkeycar.parts.datastore import TubHandler
-from donkeycar.parts.controller import LocalWebController, \
-    JoystickController, WebFpv
+from donkeycar.parts.controller import JoystickController
 from donkeycar.parts.throttle_filter import ThrottleFilter
 from donkeycar.parts.behavior import BehaviorPart
 from donkeycar.parts.file_watcher import FileWatcher
 from donkeycar.parts.launch import AiLaunch
 from donkeycar.utils import *
 
-def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type='single', meta=[]):
+def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type='single', meta=[],
+          replay_tubs=None, realtime=False):
     '''
     Construct a working robotic vehicle from many parts.
     Each part runs as a job in the Vehicle loop, calling either
@@ -43,6 +47,10 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
     cfg.DRIVE_LOOP_HZ assuming each part finishes processing in a timely manner.
     Parts may have named outputs and inputs. The framework handles passing named outputs
     to parts requesting the same named input.
+
+    When replay_tubs is given, the camera, sensors and user inputs are played
+    back from these tubs instead, the actuators are mocked and the loop runs
+    until all records were played, then prints a latency and throughput report.
     '''
 
     if cfg.DONKEY_GYM:
@@ -59,10 +67,24 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
             model_type = cfg.DEFAULT_MODEL_TYPE
     
     #Initialize car
-    V = dk.vehicle.Vehicle()
+    tracer = None
+    if cfg.TRACE_DRIVE_LOOP:
+        tracer = dk.vehicle.Tracer(seconds=cfg.TRACE_SECONDS,
+                                   dump_dir=cfg.TRACE_PATH,
+                                   dump_on_miss=cfg.TRACE_ON_MISS)
+    V = dk.vehicle.Vehicle(workers=cfg.DRIVE_LOOP_WORKERS, tracer=tracer)
 
     print("cfg.CAMERA_TYPE", cfg.CAMERA_TYPE)
-    if camera_type == "stereo":
+    if replay_tubs:
+        from donkeycar.parts.replay import TubSource
+        # the recorded user/mode is mostly 'user', which would keep the
+        # pilot from running, so a model drives the replay in local mode
+        overrides = {'user/mode': 'local'} if model_path else None
+        source = TubSource(replay_tubs, realtime=realtime, overrides=overrides)
+        print("Replaying {} records of {}".format(source.num_records, ', '.join(source.keys)))
+        V.add(source, outputs=source.keys)
+
+    elif camera_type == "stereo":
 
         if cfg.CAMERA_TYPE == "WEBCAM":
             from donkeycar.parts.camera import Webcam            
@@ -135,7 +157,11 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
             
         V.add(cam, inputs=inputs, outputs=['cam/image_array'], threaded=threaded)
         
-    if use_joystick or cfg.USE_JOYSTICK_AS_DEFAULT:
+    if replay_tubs:
+        #the user inputs come from the tubs
+        ctr = None
+
+    elif use_joystick or cfg.USE_JOYSTICK_AS_DEFAULT:
         #modify max_throttle closer to 1.0 to have more power
         #modify steering_scale lower than 1.0 to have less responsive steering
         if cfg.HAVE_ROBOHAT:
@@ -156,13 +182,18 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
     else:
         #This web controller will create a web server that is capable
         #of managing steering, throttle, and modes, and more.
+        from donkeycar.parts.controller import LocalWebController
         ctr = LocalWebController(port=cfg.WEB_CONTROL_PORT, mode=cfg.WEB_INIT_MODE)
+        ctr.profiler = V.profiler
+        ctr.tracer = V.tracer
+        print("You can now go to <your pis hostname.local>:8887 to drive your car.")
 
     
-    V.add(ctr, 
-          inputs=['cam/image_array'],
-          outputs=['user/angle', 'user/throttle', 'user/mode', 'recording'],
-          threaded=True)
+    if ctr is not None:
+        V.add(ctr, 
+              inputs=['cam/image_array'],
+              outputs=['user/angle', 'user/throttle', 'user/mode', 'recording'],
+              threaded=True)
 
     #this throttle filter will allow one tap back for esc reverse
     th_filter = ThrottleFilter()
@@ -217,7 +248,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
                 return 0.1
             return 0
 
-    if cfg.HAVE_RGB_LED and not cfg.DONKEY_GYM:
+    if cfg.HAVE_RGB_LED and not cfg.DONKEY_GYM and not replay_tubs:
         from donkeycar.parts.led_status import RGB_LED
         led = RGB_LED(cfg.LED_PIN_R, cfg.LED_PIN_G, cfg.LED_PIN_B, cfg.LED_INVERT)
         led.set_rgb(cfg.LED_R, cfg.LED_G, cfg.LED_B)        
@@ -273,12 +304,12 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         ctr.set_button_down_trigger('circle', show_record_acount_status)
 
     #Sombrero
-    if cfg.HAVE_SOMBRERO:
+    if cfg.HAVE_SOMBRERO and not replay_tubs:
         from donkeycar.parts.sombrero import Sombrero
         s = Sombrero()
 
     #IMU
-    if cfg.HAVE_IMU:
+    if cfg.HAVE_IMU and not replay_tubs:
         from donkeycar.parts.imu import IMU
         imu = IMU(sensor=cfg.IMU_SENSOR, dlp_setting=cfg.IMU_DLP_CONFIG)
         V.add(imu, outputs=['imu/acl_x', 'imu/acl_y', 'imu/acl_z',
@@ -302,10 +333,12 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         V.add(ImgPreProcess(cfg),
             inputs=['cam/image_array'],
             outputs=[inf_input],
-            run_condition='run_pilot')
+            run_condition='run_pilot',
+            skip_if_unchanged=True)
 
     # Use the FPV preview, which will show the cropped image output, or the full frame.
     if cfg.USE_FPV:
+        from donkeycar.parts.controller import WebFpv
         V.add(WebFpv(), inputs=['cam/image_array'], threaded=True)
 
     #Behavioral state
@@ -464,7 +497,11 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         V.add(AiRecordingCondition(), inputs=['user/mode', 'recording'], outputs=['recording'])
     
     #Drive train setup
-    if cfg.DONKEY_GYM:
+    if replay_tubs:
+        from donkeycar.parts.replay import MockActuator
+        V.add(MockActuator(), inputs=['angle', 'throttle'])
+
+    elif cfg.DONKEY_GYM:
         pass
 
     elif cfg.DRIVE_TRAIN_TYPE == "SERVO_ESC":
@@ -551,7 +588,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         V.add(throttle, inputs=['throttle'])
     
     # OLED setup
-    if cfg.USE_SSD1306_128_32:
+    if cfg.USE_SSD1306_128_32 and not replay_tubs:
         from donkeycar.parts.oled import OLEDPart
         auto_record_on_throttle = cfg.USE_JOYSTICK_AS_DEFAULT and cfg.AUTO_RECORD_ON_THROTTLE
         oled_part = OLEDPart(cfg.SSD1306_128_32_I2C_BUSNUM, auto_record_on_throttle=auto_record_on_throttle)
@@ -585,10 +622,28 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
     if cfg.RECORD_DURING_AI:
         inputs += ['pilot/angle', 'pilot/throttle']
         types += ['float', 'float']
+
+    if cfg.RECORD_LOOP_STATS:
+        inputs += ['vehicle/loop_ms', 'vehicle/missed', 'vehicle/late_part']
+        types += ['float', 'int', 'str']
     
-    th = TubHandler(path=cfg.DATA_PATH)
-    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
-    V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+    if replay_tubs:
+        #record like on the car, into a directory that is removed afterwards
+        data_path = tempfile.mkdtemp(prefix='replay_')
+        V.mem['recording'] = True
+    else:
+        data_path = cfg.DATA_PATH
+
+    th = TubHandler(path=data_path)
+    writer_args = {'queue_size': cfg.RECORD_QUEUE_SIZE,
+                   'policy': cfg.RECORD_QUEUE_POLICY,
+                   'workers': cfg.RECORD_WORKERS,
+                   'version': cfg.TUB_VERSION}
+    tub_outputs = ["tub/num_records"]
+    if cfg.RECORD_QUEUE_SIZE > 0:
+        tub_outputs += ["tub/queue_depth", "tub/dropped"]
+    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, **writer_args)
+    V.add(tub, inputs=inputs, outputs=tub_outputs, run_condition='recording')
 
     if cfg.PUB_CAMERA_IMAGES:
         from donkeycar.parts.network import TCPServeValue
@@ -597,9 +652,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         V.add(ImgArrToJpg(), inputs=['cam/image_array'], outputs=['jpg/bin'])
         V.add(pub, inputs=['jpg/bin'])
 
-    if type(ctr) is LocalWebController:
-        print("You can now go to <your pis hostname.local>:8887 to drive your car.")
-    elif isinstance(ctr, JoystickController):
+    if isinstance(ctr, JoystickController):
         print("You can now move your joystick to drive your car.")
         #tell the controller about the tub        
         ctr.set_tub(tub)
@@ -607,17 +660,26 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         if cfg.BUTTON_PRESS_NEW_TUB:
     
             def new_tub_dir():
-                V.parts.pop()
-                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
-                V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+                V.parts.pop()['part'].shutdown()
+                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, **writer_args)
+                V.add(tub, inputs=inputs, outputs=tub_outputs, run_condition='recording')
                 ctr.set_tub(tub)
     
             ctr.set_button_down_trigger('cross', new_tub_dir)
         ctr.print_controls()
 
+    if replay_tubs:
+        from donkeycar.parts.replay import replay
+        try:
+            replay(V, source)
+        finally:
+            shutil.rmtree(data_path, ignore_errors=True)
+        return
+
     #run the vehicle for 20 seconds
     V.start(rate_hz=cfg.DRIVE_LOOP_HZ, 
-            max_loop_count=cfg.MAX_LOOPS)
+            max_loop_count=cfg.MAX_LOOPS,
+            overrun=cfg.DRIVE_LOOP_OVERRUN)
 
 
 if __name__ == '__main__':
@@ -632,6 +694,11 @@ if __name__ == '__main__':
               model_type=model_type, camera_type=camera_type,
               meta=args['--meta'])
 
+    if args['replay']:
+        tub_paths = [os.path.expanduser(n) for n in args['--tub'].split(',')]
+        drive(cfg, model_path=args['--model'], model_type=args['--type'],
+              replay_tubs=tub_paths, realtime=args['--realtime'])
+
     if args['train']:
         from train import multi_train, preprocessFileList
         
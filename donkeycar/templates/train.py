@@ -18,6 +18,7 @@ Options:
     --figure_format=png    The file format of the generated figure (see https://matplotlib.org/api/_as_gen/matplotlib.pyplot.savefig.html), e.g. 'png', 'pdf', 'svg', ...
 """
 import os
+import copy
 import glob
 import random
 import json
@@ -26,6 +27,7 @@ import zlib
 from os.path import basename, join, splitext, dirname
 import pickle
 import datetime
+from threading import Lock
 
 from tensorflow.python import keras
 from docopt import docopt
@@ -34,10 +36,11 @@ from PIL import Image
 
 import donkeycar as dk
 from donkeycar.parts.datastore import Tub
+from donkeycar.parts.tub_chunks import source_path
 from donkeycar.parts.keras import KerasLinear, KerasIMU,\
      KerasCategorical, KerasBehavioral, Keras3D_CNN,\
      KerasRNN_LSTM, KerasLatent, KerasLocalizer
-from donkeycar.parts.augment import augment_image
+from donkeycar.parts.augment import augment_batch, load_shadow_arrays
 from donkeycar.utils import *
 
 figure_format = 'png'
@@ -71,97 +74,312 @@ def make_next_key(sample, index_offset):
 
 def collate_records(records, gen_records, opts):
     '''
-    open all the .json records from records list passed in,
-    read their contents,
+    collate the records from records list passed in,
     add them to a list of gen_records, passed in.
-    use the opts dict to specify config choices
+    use the opts dict to specify config choices.
+    the records of each tub are collated once into an index in its cache
+    dir, see CollatedIndex, records not in it are read on a process pool.
     '''
+    from donkeycar.parts.tub_cache import collate_tubs
 
-    new_records = {}
-    
+    by_tub = {}
     for record_path in records:
+        basepath = os.path.dirname(record_path)
+        by_tub.setdefault(basepath, []).append(record_path)
 
-        basepath = os.path.dirname(record_path)        
-        index = get_record_index(record_path)
-        sample = { 'tub_path' : basepath, "index" : index }
-             
-        key = make_key(sample)
+    tub_paths = list(by_tub.keys())
+    # the train - validate ratio is kept across the dataset, even if continuous
+    # training, as the new records of each tub are split by it.
+    collated = collate_tubs([Tub(p) for p in tub_paths], opts['cfg'].TRAIN_TEST_SPLIT)
 
-        if key in gen_records:
-            continue
+    for basepath, columns in zip(tub_paths, collated):
+        ixs = columns['index']
+        for record_path in by_tub[basepath]:
+            index = get_record_index(record_path)
+            sample = { 'tub_path' : basepath, "index" : index }
 
-        try:
-            with open(record_path, 'r') as fp:
-                json_data = json.load(fp)
-        except:
-            continue
+            key = make_key(sample)
 
-        image_filename = json_data["cam/image_array"]
-        image_path = os.path.join(basepath, image_filename)
+            if key in gen_records:
+                continue
 
-        sample['record_path'] = record_path
-        sample["image_path"] = image_path
-        sample["json_data"] = json_data        
+            row = int(np.searchsorted(ixs, index))
+            if row == len(ixs) or ixs[row] != index or not columns['valid'][row]:
+                continue
 
-        angle = float(json_data['user/angle'])
-        throttle = float(json_data["user/throttle"])
+            sample['record_path'] = record_path
+            sample["image_path"] = os.path.join(basepath, columns['image'][row])
 
-        if opts['categorical']:
-            angle = dk.utils.linear_bin(angle)
-            throttle = dk.utils.linear_bin(throttle, N=20, offset=0, R=opts['cfg'].MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
+            angle = float(columns['angle'][row])
+            throttle = float(columns['throttle'][row])
 
-        sample['angle'] = angle
-        sample['throttle'] = throttle
+            if opts['categorical']:
+                angle = dk.utils.linear_bin(angle)
+                throttle = dk.utils.linear_bin(throttle, N=20, offset=0, R=opts['cfg'].MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
 
-        try:
-            accl_x = float(json_data['imu/acl_x'])
-            accl_y = float(json_data['imu/acl_y'])
-            accl_z = float(json_data['imu/acl_z'])
+            sample['angle'] = angle
+            sample['throttle'] = throttle
 
-            gyro_x = float(json_data['imu/gyr_x'])
-            gyro_y = float(json_data['imu/gyr_y'])
-            gyro_z = float(json_data['imu/gyr_z'])
+            imu = columns['imu'][row]
+            if not np.isnan(imu).any():
+                sample['imu_array'] = imu
 
-            sample['imu_array'] = np.array([accl_x, accl_y, accl_z, gyro_x, gyro_y, gyro_z])
-        except:
-            pass
+            if columns['behavior'][row] is not None:
+                sample["behavior_arr"] = np.array(columns['behavior'][row])
 
-        try:
-            behavior_arr = np.array(json_data['behavior/one_hot_state_array'])
-            sample["behavior_arr"] = behavior_arr
-        except:
-            pass
+            if columns['location'][row] is not None:
+                sample["location"] = np.array(columns['location'][row])
 
-        try:
-            location_arr = np.array(json_data['location/one_hot_state_array'])
-            sample["location"] = location_arr
-        except:
-            pass
+            sample['train'] = bool(columns['train'][row])
 
+            gen_records[key] = sample
 
-        sample['img_data'] = None
 
-        # Initialise 'train' to False
-        sample['train'] = False
-        
-        # We need to maintain the correct train - validate ratio across the dataset, even if continous training
-        # so don't add this sample to the main records list (gen_records) yet.
-        new_records[key] = sample
-        
-    # new_records now contains all our NEW samples
-    # - set a random selection to be the training samples based on the ratio in CFG file
-    shufKeys = list(new_records.keys())
-    random.shuffle(shufKeys)
-    trainCount = 0
-    #  Ratio of samples to use as training data, the remaining are used for evaluation
-    targetTrainCount = int(opts['cfg'].TRAIN_TEST_SPLIT * len(shufKeys))
-    for key in shufKeys:
-        new_records[key]['train'] = True
-        trainCount += 1
-        if trainCount >= targetTrainCount:
-            break
-    # Finally add all the new records to the existing list
-    gen_records.update(new_records)
+def attach_image_caches(gen_records, cfg):
+    '''
+    point the records at the image caches of their tubs, building the
+    caches of tubs without one for their records and image settings.
+    '''
+    from donkeycar.parts.tub_cache import TubImageCache
+
+    caches = {}
+    for record in gen_records.values():
+        tub_path = record['tub_path']
+        if tub_path not in caches:
+            caches[tub_path] = TubImageCache.open(Tub(tub_path), cfg, verbose=True)
+        cache = caches[tub_path]
+        row = None if cache is None else cache.row(record['index'])
+        record['image_cache'] = None if row is None else cache
+        record['cache_row'] = row
+
+
+class RecordSequence(keras.utils.Sequence):
+    '''
+    The batches of a list of records for fit_generator. Keras asks for a
+    batch by its index, so its workers can make several batches at once,
+    and queues up to max_queue_size of them ahead of the model.
+
+    The records are shuffled at every epoch, in the order given by the
+    seed and the epoch, so a run can be repeated with the same seed.
+    make_batch(records, rng) gets a RandomState of the seed, the epoch and
+    the index of the batch for the augmentation, so it doesn't depend on
+    which worker makes the batch when.
+    '''
+
+    def __init__(self, records, batch_size, make_batch, seed=0):
+        self.records = records
+        self.batch_size = batch_size
+        self.make_batch = make_batch
+        self.seed = seed
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        rs = np.random.RandomState([self.seed, epoch])
+        self.order = rs.permutation(len(self.records))
+
+    def __len__(self):
+        return len(self.records) // self.batch_size
+
+    def __getitem__(self, i):
+        rows = self.order[i * self.batch_size:(i + 1) * self.batch_size]
+        rng = np.random.RandomState([self.seed, self.epoch, i])
+        return self.make_batch([self.records[row] for row in rows], rng)
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
+
+
+def make_image_cache(cfg):
+    '''
+    the memory cache of the training images, None when CACHE_IMAGES is off
+    or the batches are made in processes, which would each have their own.
+    '''
+    from donkeycar.parts.tub_cache import ImageMemoryCache
+
+    if not cfg.CACHE_IMAGES:
+        return None
+    if cfg.TRAIN_MULTIPROCESSING:
+        print('not caching images in memory, as TRAIN_MULTIPROCESSING is on')
+        return None
+    return ImageMemoryCache(cfg, cfg.CACHE_IMAGES_MB * 1024 * 1024)
+
+
+class ImageCacheStats(keras.callbacks.Callback):
+    '''
+    print how many of the images of each epoch came from the image cache
+    '''
+    def __init__(self, image_cache):
+        super(ImageCacheStats, self).__init__()
+        self.image_cache = image_cache
+
+    def on_epoch_end(self, epoch, logs=None):
+        hits, misses, rate = self.image_cache.reset_stats()
+        print('image cache: %.1f%% hits, %d loaded, %d MB' %
+              (rate * 100, misses, self.image_cache.nbytes // (1024 * 1024)))
+
+
+class BufferRing(object):
+    '''
+    A ring of sets of arrays to make batches in, so making a batch doesn't
+    allocate new arrays and copy lists of records into them. A set is
+    handed out again after count others, so count has to be larger than
+    the number of batches keras holds at once from the one generator or
+    sequence the ring makes batches for.
+    '''
+
+    def __init__(self, count):
+        self.sets = [{} for _ in range(max(count, 1))]
+        self.next = 0
+        self.lock = Lock()
+
+    def take(self):
+        with self.lock:
+            buffers = self.sets[self.next]
+            self.next = (self.next + 1) % len(self.sets)
+        return buffers
+
+
+def take_buffer(buffers, name, shape, dtype=np.float32):
+    '''
+    the array name of a set of buffers, made again when the shape changes
+    '''
+    arr = buffers.get(name)
+    if arr is None or arr.shape != shape or arr.dtype != dtype:
+        arr = np.empty(shape, dtype=dtype)
+        buffers[name] = arr
+    return arr
+
+
+def fill_column(buffers, name, records, key):
+    '''
+    an array of the values of key in records, with one row per record
+    '''
+    if not records:
+        return np.zeros(0)
+    first = np.asarray(records[0][key])
+    arr = take_buffer(buffers, name, (len(records),) + first.shape, first.dtype)
+    arr[...] = [record[key] for record in records]
+    return arr
+
+
+class BatchMaker(object):
+    '''
+    Makes the inputs and labels of the model of kl for a list of records,
+    in the form its type needs. The arrays are filled in place in buffers
+    from a BufferRing of num_buffers sets, which only one generator or
+    sequence may use, others get their own with for_split(). Records whose
+    image can't be loaded are left out. With aug the images of each batch are augmented
+    together, by factors drawn from the RandomState given with the batch,
+    or else from one seeded with seed.
+    '''
+
+    def __init__(self, kl, cfg, aug=False, image_cache=None, num_buffers=2, seed=None):
+        self.cfg = cfg
+        self.aug = aug
+        self.image_cache = image_cache
+        self.ring = BufferRing(num_buffers)
+        self.rng = np.random.RandomState(seed)
+        self.shadow_arrays = None
+        if aug and cfg.AUG_SHADOW_IMAGES:
+            self.shadow_arrays = load_shadow_arrays(cfg.AUG_SHADOW_IMAGES)
+
+        if type(kl.model.output) is list:
+            self.model_out_shape = (2, 1)
+        else:
+            self.model_out_shape = kl.model.output.shape
+
+        self.has_imu = type(kl) is KerasIMU
+        self.has_bvh = type(kl) is KerasBehavioral
+        self.img_out = type(kl) is KerasLatent
+        self.loc_out = type(kl) is KerasLocalizer
+
+    def for_split(self):
+        '''
+        a BatchMaker like this one with a ring of buffers of its own, for
+        the batches of another generator or sequence. keras queues the
+        training and validation batches at the same time, so sharing a
+        ring would overwrite the batches of one with the other.
+        '''
+        maker = copy.copy(self)
+        maker.ring = BufferRing(len(self.ring.sets))
+        return maker
+
+    def fill_images(self, batch_data, img_arr):
+        '''
+        write the normalized images of the records into img_arr, from their
+        tub image cache, the memory cache or their files. returns the
+        records in the order of their images, leaving out the records
+        whose image can't be loaded.
+        '''
+        by_cache = {}
+        others = []
+        for record in batch_data:
+            cache = record.get('image_cache')
+            if cache is not None:
+                by_cache.setdefault(id(cache), (cache, []))[1].append(record)
+            else:
+                others.append(record)
+
+        records = []
+        # the images of a tub image cache go straight into their rows
+        for cache, cached in by_cache.values():
+            row = len(records)
+            cache.get_images([r['cache_row'] for r in cached],
+                             out=img_arr[row:row + len(cached)])
+            records += cached
+
+        for record in others:
+            if self.image_cache is not None:
+                img = self.image_cache.get_images([record['image_path']])[0]
+            else:
+                img = load_scaled_image_arr(record['image_path'], self.cfg)
+            if img is not None:
+                img_arr[len(records)] = img.reshape(img_arr.shape[1:])
+                records.append(record)
+        return records
+
+    def __call__(self, batch_data, rng=None):
+        cfg = self.cfg
+        buffers = self.ring.take()
+
+        img_arr = take_buffer(buffers, 'img', (len(batch_data), cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D))
+        records = self.fill_images(batch_data, img_arr)
+        batch_size = len(records)
+        img_arr = img_arr[:batch_size]
+        if self.aug:
+            augment_batch(img_arr, self.rng if rng is None else rng, self.shadow_arrays,
+                          self.cfg.AUG_WARP_PERSPECTIVE)
+
+        angles = fill_column(buffers, 'angle', records, 'angle')
+        throttles = fill_column(buffers, 'throttle', records, 'throttle')
+
+        if self.has_imu:
+            X = [img_arr, fill_column(buffers, 'imu', records, 'imu_array')]
+        elif self.has_bvh:
+            X = [img_arr, fill_column(buffers, 'behavior', records, 'behavior_arr')]
+        else:
+            X = [img_arr]
+
+        if self.img_out:
+            import cv2
+            out_img = take_buffer(buffers, 'out_img', (batch_size, 127, 127, 1))
+            for row in range(batch_size):
+                rz_img_arr = cv2.resize(img_arr[row], (127, 127)) / 255.0
+                out_img[row, :, :, 0] = rz_img_arr[:,:,0]
+            y = [out_img, angles, throttles]
+        elif self.loc_out:
+            y = [angles, throttles, fill_column(buffers, 'location', records, 'location')]
+        elif self.model_out_shape[1] == 2:
+            out = take_buffer(buffers, 'out', (batch_size, 2), angles.dtype)
+            out[:, 0] = angles
+            out[:, 1] = throttles
+            y = [out]
+        else:
+            y = [angles, throttles]
+
+        return X, y
+
 
 def save_json_and_weights(model, filename):
     '''
@@ -354,8 +572,19 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
     records = gather_records(cfg, tub_names, opts, verbose=True)
     print('collating %d records ...' % (len(records)))
     collate_records(records, gen_records, opts)
+    if cfg.TRAIN_IMAGE_CACHE and not continuous:
+        attach_image_caches(gen_records, cfg)
 
-    def generator(save_best, opts, data, batch_size, isTrainSet=True, min_records_to_train=1000):
+    seed = cfg.TRAIN_SEED
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+
+    image_cache = make_image_cache(cfg)
+    # the batches keras may hold: its queue and one being made by each worker
+    num_buffers = cfg.TRAIN_PREFETCH + (cfg.TRAIN_WORKERS or os.cpu_count() or 1) + 2
+    make_batch = BatchMaker(kl, cfg, aug, image_cache, num_buffers, seed)
+
+    def generator(save_best, opts, data, batch_size, make_batch, isTrainSet=True, min_records_to_train=1000):
         
         num_records = len(data)
 
@@ -385,26 +614,6 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
 
             random.shuffle(keys)
 
-            kl = opts['keras_pilot']
-
-            if type(kl.model.output) is list:
-                model_out_shape = (2, 1)
-            else:
-                model_out_shape = kl.model.output.shape
-
-            if type(kl.model.input) is list:
-                model_in_shape = (2, 1)
-            else:    
-                model_in_shape = kl.model.input.shape
-
-            has_imu = type(kl) is KerasIMU
-            has_bvh = type(kl) is KerasBehavioral
-            img_out = type(kl) is KerasLatent
-            loc_out = type(kl) is KerasLocalizer
-            
-            if img_out:
-                import cv2
-
             for key in keys:
 
                 if not key in data:
@@ -418,81 +627,17 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                 if continuous:
                     #in continuous mode we need to handle files getting deleted
                     filename = _record['image_path']
-                    if not os.path.exists(filename):
+                    if not os.path.exists(source_path(filename)):
                         data.pop(key, None)
                         continue
 
                 batch_data.append(_record)
 
                 if len(batch_data) == batch_size:
-                    inputs_img = []
-                    inputs_imu = []
-                    inputs_bvh = []
-                    angles = []
-                    throttles = []
-                    out_img = []
-                    out_loc = []
-                    out = []
+                    X, y = make_batch(batch_data)
 
-                    for record in batch_data:
-                        #get image data if we don't already have it
-                        if record['img_data'] is None:
-                            filename = record['image_path']
-                            
-                            img_arr = load_scaled_image_arr(filename, cfg)
-
-                            if img_arr is None:
-                                break
-                            
-                            if aug:
-                                img_arr = augment_image(img_arr)
-
-                            if cfg.CACHE_IMAGES:
-                                record['img_data'] = img_arr
-                        else:
-                            img_arr = record['img_data']
-                            
-                        if img_out:                            
-                            rz_img_arr = cv2.resize(img_arr, (127, 127)) / 255.0
-                            out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
-
-                        if loc_out:
-                            out_loc.append(record['location'])
-                            
-                        if has_imu:
-                            inputs_imu.append(record['imu_array'])
-                        
-                        if has_bvh:
-                            inputs_bvh.append(record['behavior_arr'])
-
-                        inputs_img.append(img_arr)
-                        angles.append(record['angle'])
-                        throttles.append(record['throttle'])
-                        out.append([record['angle'], record['throttle']])
-
-                    if img_arr is None:
-                        continue
-
-                    img_arr = np.array(inputs_img).reshape(batch_size,\
-                        cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
-
-                    if has_imu:
-                        X = [img_arr, np.array(inputs_imu)]
-                    elif has_bvh:
-                        X = [img_arr, np.array(inputs_bvh)]
-                    else:
-                        X = [img_arr]
-
-                    if img_out:
-                        y = [out_img, np.array(angles), np.array(throttles)]
-                    elif out_loc:
-                        y = [ np.array(angles), np.array(throttles), np.array(out_loc)]
-                    elif model_out_shape[1] == 2:
-                        y = [np.array([out]).reshape(batch_size, 2) ]
-                    else:
-                        y = [np.array(angles), np.array(throttles)]
-
-                    yield X, y
+                    if len(X[0]):
+                        yield X, y
 
                     batch_data = []
     
@@ -508,8 +653,17 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                                     mode='min',
                                     cfg=cfg)
 
-    train_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, True)
-    val_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, False)
+    if continuous:
+        # the generators pick up new records as they go
+        train_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, make_batch, True)
+        val_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, make_batch.for_split(), False)
+    else:
+        print('shuffling records with seed', seed)
+        keys = sorted(gen_records.keys())
+        train_gen = RecordSequence([gen_records[k] for k in keys if gen_records[k]['train']],
+                                   cfg.BATCH_SIZE, make_batch, seed)
+        val_gen = RecordSequence([gen_records[k] for k in keys if not gen_records[k]['train']],
+                                 cfg.BATCH_SIZE, make_batch.for_split(), seed + 1)
     
     total_records = len(gen_records)
 
@@ -535,11 +689,11 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
 
     cfg.model_type = model_type
 
-    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best)
+    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best, image_cache)
 
     
     
-def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best=None):
+def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best=None, image_cache=None):
 
     start = time.time()
 
@@ -570,11 +724,19 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
     else:
         epochs = cfg.MAX_EPOCHS
 
-    workers_count = 1
-    use_multiprocessing = False
+    if isinstance(train_gen, keras.utils.Sequence):
+        # batches are made by their index, so several workers can make them
+        workers_count = cfg.TRAIN_WORKERS or os.cpu_count() or 1
+        use_multiprocessing = cfg.TRAIN_MULTIPROCESSING
+    else:
+        workers_count = 1
+        use_multiprocessing = False
 
     callbacks_list = [save_best]
 
+    if image_cache is not None:
+        callbacks_list.append(ImageCacheStats(image_cache))
+
     if cfg.USE_EARLY_STOP and not continuous:
         callbacks_list.append(early_stop)
 
@@ -587,7 +749,8 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
                     callbacks=callbacks_list, 
                     validation_steps=val_steps,
                     workers=workers_count,
-                    use_multiprocessing=use_multiprocessing)
+                    use_multiprocessing=use_multiprocessing,
+                    max_queue_size=cfg.TRAIN_PREFETCH)
                     
     full_model_val_loss = min(history.history['val_loss'])
     max_val_loss = full_model_val_loss + cfg.PRUNE_VAL_LOSS_DEGRADATION_LIMIT
@@ -704,47 +867,37 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
     
     verbose = cfg.VERBOSE_TRAIN
 
-    records = []
-
-    for tub in tubs:
-        record_paths = glob.glob(os.path.join(tub.path, 'record_*.json'))
-        print("Tub:", tub.path, "has", len(record_paths), 'records')
-
-        record_paths.sort(key=get_record_index)
-        records += record_paths
-
-
     print('collating records')
     gen_records = {}
 
-    for record_path in records:
-
-        with open(record_path, 'r') as fp:
-            json_data = json.load(fp)
-
-        basepath = os.path.dirname(record_path)
-        image_filename = json_data["cam/image_array"]
-        image_path = os.path.join(basepath, image_filename)
-        sample = { 'record_path' : record_path, "image_path" : image_path, "json_data" : json_data }
-
-        sample["tub_path"] = basepath
-        sample["index"] = get_image_index(image_filename)
-
-        angle = float(json_data['user/angle'])
-        throttle = float(json_data["user/throttle"])
-
-        sample['target_output'] = np.array([angle, throttle])
-        sample['angle'] = angle
-        sample['throttle'] = throttle
+    for tub in tubs:
+        # the records of the manifest, in version 1 and 2 tubs alike
+        index = tub.get_index(shuffled=False)
+        print("Tub:", tub.path, "has", len(index), 'records')
+
+        for ix in index:
+            try:
+                json_data = tub.get_json_record(ix)
+            except Exception as e:
+                print('could not read record %d of %s: %s' % (ix, tub.path, e))
+                continue
 
+            image_path = json_data["cam/image_array"]
+            sample = { 'record_path' : tub.get_json_record_path(ix), "image_path" : image_path, "json_data" : json_data }
 
-        sample['img_data'] = None
+            sample["tub_path"] = tub.path
+            sample["index"] = ix
 
-        key = make_key(sample)
+            angle = float(json_data['user/angle'])
+            throttle = float(json_data["user/throttle"])
 
-        gen_records[key] = sample
+            sample['target_output'] = np.array([angle, throttle])
+            sample['angle'] = angle
+            sample['throttle'] = throttle
 
+            key = make_key(sample)
 
+            gen_records[key] = sample
 
     print('collating sequences')
 
@@ -775,16 +928,32 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
 
     print("collated", len(sequences), "sequences of length", target_len)
 
+    seed = cfg.TRAIN_SEED
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    print('shuffling and augmenting sequences with seed', seed)
+
     #shuffle and split the data
     train_data, val_data  = train_test_split(sequences, test_size=(1 - cfg.TRAIN_TEST_SPLIT))
 
+    image_cache = make_image_cache(cfg)
+
+
+    num_buffers = cfg.TRAIN_PREFETCH + 3
+    shadow_arrays = None
+    if aug and cfg.AUG_SHADOW_IMAGES:
+        shadow_arrays = load_shadow_arrays(cfg.AUG_SHADOW_IMAGES)
 
-    def generator(data, opt, batch_size=cfg.BATCH_SIZE):
+    def generator(data, opt, seed, batch_size=cfg.BATCH_SIZE):
         num_records = len(data)
+        ring = BufferRing(num_buffers)
+        seq_len = cfg.SEQUENCE_LENGTH
+        # the order and the augmentation of the batches follow the seed
+        rng = np.random.RandomState(seed)
 
         while True:
             #shuffle again for good measure
-            random.shuffle(data)
+            rng.shuffle(data)
 
             for offset in range(0, num_records, batch_size):
                 batch_data = data[offset:offset+batch_size]
@@ -792,75 +961,57 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
                 if len(batch_data) != batch_size:
                     break
 
-                b_inputs_img = []
-                b_vec_in = []
-                b_labels = []
-                b_vec_out = []
+                buffers = ring.take()
+                b_inputs_img = take_buffer(buffers, 'img',
+                    (batch_size, seq_len, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D))
+                if opt['look_ahead']:
+                    # the labels of the last input image and the images after it
+                    b_labels = take_buffer(buffers, 'labels', (batch_size, (seq_len + 1) * 2), np.float64)
+                else:
+                    b_labels = take_buffer(buffers, 'labels', (batch_size, 2), np.float64)
 
+                row = 0
                 for seq in batch_data:
-                    inputs_img = []
-                    vec_in = []
-                    labels = []
-                    vec_out = []
-                    num_images_target = len(seq)
-                    iTargetOutput = -1
-                    if opt['look_ahead']:
-                        num_images_target = cfg.SEQUENCE_LENGTH
-                        iTargetOutput = cfg.SEQUENCE_LENGTH - 1
-
-                    for iRec, record in enumerate(seq):
-                        #get image data if we don't already have it
-                        if len(inputs_img) < num_images_target:
-                            if record['img_data'] is None:
-                                img_arr = load_scaled_image_arr(record['image_path'], cfg)
-                                if img_arr is None:
-                                    break
-                                if aug:
-                                    img_arr = augment_image(img_arr)
-                                
-                                if cfg.CACHE_IMAGES:
-                                    record['img_data'] = img_arr
-                            else:
-                                img_arr = record['img_data']                  
-                                
-                            inputs_img.append(img_arr)
-
-                        if iRec >= iTargetOutput:
-                            vec_out.append(record['angle'])
-                            vec_out.append(record['throttle'])
+                    for iRec in range(seq_len):
+                        #get image data
+                        record = seq[iRec]
+                        if image_cache is not None:
+                            img_arr = image_cache.get_images([record['image_path']])[0]
                         else:
-                            vec_in.append(0.0) #record['angle'])
-                            vec_in.append(0.0) #record['throttle'])
-                        
-                    label_vec = seq[iTargetOutput]['target_output']
-
-                    if look_ahead:
-                        label_vec = np.array(vec_out)
-
-                    labels.append(label_vec)
-
-                    b_inputs_img.append(inputs_img)
-                    b_vec_in.append(vec_in)
+                            img_arr = load_scaled_image_arr(record['image_path'], cfg)
+                        if img_arr is None:
+                            break
+                        b_inputs_img[row, iRec] = img_arr.reshape(b_inputs_img.shape[2:])
+                    else:
+                        if opt['look_ahead']:
+                            for i, record in enumerate(seq[seq_len - 1:]):
+                                b_labels[row, 2 * i] = record['angle']
+                                b_labels[row, 2 * i + 1] = record['throttle']
+                        else:
+                            b_labels[row] = seq[-1]['target_output']
+                        row += 1
 
-                    b_labels.append(labels)
+                if aug:
+                    augment_batch(b_inputs_img[:row].reshape((-1,) + b_inputs_img.shape[2:]),
+                                  rng, shadow_arrays,
+                                  do_warp_persp=cfg.AUG_WARP_PERSPECTIVE)
 
-                
+                # sequences with an image that can't be loaded are left out
                 if look_ahead:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.TARGET_H, cfg.TARGET_W, cfg.SEQUENCE_LENGTH)]
-                    X.append(np.array(b_vec_in))
-                    y = np.array(b_labels).reshape(batch_size, (cfg.SEQUENCE_LENGTH + 1) * 2)
+                    X = [b_inputs_img[:row].reshape(row,\
+                        cfg.TARGET_H, cfg.TARGET_W, seq_len)]
+                    X.append(np.zeros((row, (seq_len - 1) * 2)))
+                    y = b_labels[:row]
                 else:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.SEQUENCE_LENGTH, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)]
-                    y = np.array(b_labels).reshape(batch_size, 2)
+                    X = [b_inputs_img[:row]]
+                    y = b_labels[:row]
 
                 yield X, y
 
     opt = { 'look_ahead' : look_ahead, 'cfg' : cfg }
 
-    train_gen = generator(train_data, opt)
-    val_gen = generator(val_data, opt)   
+    train_gen = generator(train_data, opt, seed)
+    val_gen = generator(val_data, opt, seed + 1)   
 
     model_path = os.path.expanduser(model_name)
 
@@ -878,7 +1029,7 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
     
     cfg.model_type = model_type
 
-    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose)
+    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, image_cache=image_cache)
     
     ''' 
     kl.train(train_gen, 
@@ -12,3 +12,28 @@ def test_PCA9685():
 def test_PWMSteering():
     c = PCA9685(0)
     s = PWMSteering(c)
+
+
+class _PulseRecorder:
+    def __init__(self):
+        self.pulses = []
+
+    def set_pulse(self, pulse):
+        self.pulses.append(pulse)
+
+
+def test_PWMSteering_writes_only_new_pulses():
+    from threading import Thread
+    import time
+    c = _PulseRecorder()
+    s = PWMSteering(c, left_pulse=300, right_pulse=500)
+    t = Thread(target=s.update)
+    t.start()
+    for angle in (0, 0, 1, 1, 1):
+        s.run_threaded(angle)
+        time.sleep(0.01)
+    s.running = False
+    s.pulses.close()
+    t.join(1)
+    assert not t.is_alive()
+    assert c.pulses == [400, 500]
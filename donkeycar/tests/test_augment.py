@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from donkeycar.parts.augment import augment_batch, find_coeffs, persp_coeffs_batch
+
+
+class FixedFactors(object):
+    '''
+    stands in for a RandomState, giving the factors in order
+    '''
+    def __init__(self, factors):
+        self.factors = list(factors)
+
+    def uniform(self, low, high, n):
+        return np.full(n, self.factors.pop(0))
+
+
+def smooth_images(n, seed=0):
+    rs = np.random.RandomState(seed)
+    imgs = rs.rand(n, 30, 40, 3)
+    # smooth the noise, so sharpness has something to work with
+    for axis in (1, 2):
+        imgs = (imgs + np.roll(imgs, 1, axis) + np.roll(imgs, -1, axis)) / 3.0
+    return imgs.astype(np.float32)
+
+
+def test_augment_batch_repeats_with_seed():
+    """ The same seed augments a batch the same way, within 0..1 """
+    imgs = smooth_images(8)
+    a = augment_batch(imgs.copy(), np.random.RandomState(3), do_warp_persp=True)
+    b = augment_batch(imgs.copy(), np.random.RandomState(3), do_warp_persp=True)
+    c = augment_batch(imgs.copy(), np.random.RandomState(4), do_warp_persp=True)
+    assert a.shape == imgs.shape and a.dtype == np.float32
+    assert np.array_equal(a, b)
+    assert not np.array_equal(a, c)
+    assert a.min() >= 0.0 and a.max() <= 1.0
+
+    u8 = (imgs * 255).astype(np.uint8)
+    out = augment_batch(u8, np.random.RandomState(3))
+    assert out is u8 and out.dtype == np.uint8
+
+
+def test_augment_batch_like_pil():
+    """ Fixed factors change an image about like the PIL enhancements of augment_image """
+    img = (smooth_images(1)[0] * 255).astype(np.uint8)
+    factors = [1.3, 0.8, 1.2, 0.6]
+    pil = Image.fromarray(img)
+    for enhance, factor in zip([ImageEnhance.Brightness, ImageEnhance.Contrast,
+                                ImageEnhance.Sharpness, ImageEnhance.Color], factors):
+        pil = enhance(pil).enhance(factor)
+    expected = np.asarray(pil) / 255.0
+
+    out = augment_batch(img[np.newaxis].astype(np.float32) / 255.0, FixedFactors(factors))
+    assert np.abs(out[0] - expected).mean() < 0.01
+
+    coeffs = persp_coeffs_batch(np.array([170.0]), np.array([-20.0]), 120)
+    expected = find_coeffs([(0, 0), (256, 0), (256, 256), (0, 256)],
+                           [(0, 0), (256, 0), (170, 120), (-20, 120)])
+    assert np.allclose(coeffs[0], np.ravel(expected))
@@ -0,0 +1,51 @@
+import time
+from threading import Thread
+
+from donkeycar.mailbox import LatestValue
+
+
+def test_latest_value_keeps_newest():
+    box = LatestValue('a')
+    assert box.read() == (0, 'a')
+    assert box.put('b') == 1
+    assert box.put('c') == 2
+    assert box.get() == 'c'
+    assert box.read() == (2, 'c')
+
+
+def test_wait_returns_newer_value_at_once():
+    box = LatestValue()
+    box.put(1)
+    assert box.wait(0, timeout=0.01) == (1, 1)
+
+
+def test_wait_times_out_without_new_value():
+    box = LatestValue()
+    seq, _ = box.read()
+    start = time.time()
+    assert box.wait(seq, timeout=0.05) == (seq, None)
+    assert time.time() - start >= 0.04
+
+
+def test_wait_wakes_up_on_put():
+    box = LatestValue()
+    got = []
+
+    def reader():
+        got.append(box.wait(0, timeout=5))
+
+    t = Thread(target=reader)
+    t.start()
+    time.sleep(0.02)
+    box.put('frame')
+    t.join(1)
+    assert got == [(1, 'frame')]
+
+
+def test_close_releases_waiting_readers():
+    box = LatestValue()
+    t = Thread(target=box.wait, args=(0,))
+    t.start()
+    box.close()
+    t.join(1)
+    assert not t.is_alive()
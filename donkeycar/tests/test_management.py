@@ -1,9 +1,70 @@
 
+import os
 from donkeycar.management import base
 from tempfile import tempdir
 
+#fixtures
+from .setup import tub, tub_path
+
 def get_test_tub_path():
     tempdir()
 
 def test_tubcheck():
-    tc = base.TubCheck()
\ No newline at end of file
+    tc = base.TubCheck()
+
+def test_parse_importtime():
+    text = ('import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     numpy.version\n'
+            'import time:      1500 |       2000 |   numpy\n'
+            'import time:       300 |       2300 | donkeycar\n')
+    assert base.parse_importtime(text) == [
+        ('numpy.version', 2, 0.12, 0.12),
+        ('numpy', 1, 1.5, 2.0),
+        ('donkeycar', 0, 0.3, 2.3)]
+
+
+def test_lazy_imports():
+    import subprocess
+    import sys
+    code = ('import sys, donkeycar, donkeycar.management.base, '
+            'donkeycar.parts.controller; '
+            'print(sorted(m for m in ("pandas", "tornado", "tensorflow") '
+            'if m in sys.modules)); '
+            'print(donkeycar.Vehicle.__name__)')
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  universal_newlines=True)
+    assert out.splitlines()[-2:] == ['[]', 'Vehicle']
+
+
+def test_tub_web_reads_v2_tubs(tub, tub_path, tmpdir):
+    """ The tub web editor lists and shows the frames of version 2 tubs """
+    import json
+    from tornado.testing import AsyncHTTPTestCase
+    from donkeycar.management.tub import WebServer
+    from donkeycar.parts.datastore import Tub, convert_tub
+
+    index = tub.get_index(shuffled=False)
+    tub.remove_record(index[0])
+    data_path = str(tmpdir.join('data'))
+    convert_tub(tub_path, os.path.join(data_path, 'v2'), 2)
+
+    class Case(AsyncHTTPTestCase):
+        def get_app(self):
+            return WebServer(data_path)
+
+        def runTest(self):
+            clips = json.loads(self.fetch('/api/tubs/v2').body)['clips']
+            assert clips == [index[1:]]
+            image = self.fetch('/api/tubs/v2/%d/image' % index[5])
+            assert image.code == 200
+            assert image.body == tub.read_image_bytes(tub.get_json_record(index[5])['cam/image_array'])
+            record = json.loads(self.fetch('/api/tubs/v2/%d/record' % index[5]).body)
+            assert record['user/angle'] == tub.get_json_record(index[5])['user/angle']
+            assert self.fetch('/api/tubs/v2/%d/record' % index[0]).code == 404
+
+    case = Case()
+    case.setUp()
+    try:
+        case.runTest()
+    finally:
+        case.tearDown()
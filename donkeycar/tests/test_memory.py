@@ -66,3 +66,53 @@ class TestMemory(unittest.TestCase):
         mem.put(['myitem'], 888)
         
         assert dict(mem.items()) == {'myitem': 888}
+
+    def test_slot_is_stable(self):
+        mem = Memory()
+        ix = mem.slot('myitem')
+        mem.put(['myitem'], 888)
+        assert mem.slot('myitem') == ix
+        assert mem.get_slots((ix,)) == [888]
+
+    def test_put_slots_multi_item(self):
+        mem = Memory()
+        slots = (mem.slot('my1stitem'), mem.slot('my2nditem'))
+        mem.put_slots(slots, (777, '999'))
+        assert mem.get(['my1stitem', 'my2nditem']) == [777, '999']
+
+    def test_put_slots_single_item(self):
+        mem = Memory()
+        slots = (mem.slot('myitem'),)
+        mem.put_slots(slots, (1, 2))
+        assert mem['myitem'] == (1, 2)
+
+    def test_put_slots_too_few_values(self):
+        mem = Memory()
+        slots = (mem.slot('my1stitem'), mem.slot('my2nditem'))
+        with pytest.raises(IndexError):
+            mem.put_slots(slots, (777,))
+
+    def test_get_missing_item(self):
+        mem = Memory()
+        assert mem.get(['missing']) == [None]
+        with pytest.raises(KeyError):
+            mem['missing']
+
+    def test_versions_count_changes(self):
+        mem = Memory()
+        mem.put(['myitem'], 1.0)
+        assert mem.get_versions(['myitem', 'missing']) == [1, 0]
+        mem.put(['myitem'], 1.0)
+        assert mem.get_versions(['myitem']) == [1]
+        mem.put(['myitem'], 2.0)
+        assert mem.get_versions(['myitem']) == [2]
+
+    def test_versions_compare_objects_by_identity(self):
+        import numpy as np
+        mem = Memory()
+        arr = np.zeros(3)
+        mem['myitem'] = arr
+        mem['myitem'] = arr
+        assert mem.get_versions(['myitem']) == [1]
+        mem['myitem'] = arr.copy()
+        assert mem.get_versions(['myitem']) == [2]
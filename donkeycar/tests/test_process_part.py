@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import numpy as np
+import pytest
+
+import donkeycar as dk
+from donkeycar.process_part import ProcessPart, FrameWriter, FrameReader, shared_memory
+
+
+class Brighten:
+    def __init__(self, path=None):
+        self.path = path
+
+    def run(self, img, gain):
+        return img * gain, float(img.mean()), os.getpid()
+
+    def shutdown(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                f.write('stopped')
+
+
+class Fails:
+    def run(self):
+        raise ValueError('broken part')
+
+
+@pytest.mark.skipif(shared_memory is None, reason='needs python 3.8')
+def test_frame_ring_roundtrip():
+    writer = FrameWriter(depth=2)
+    reader = FrameReader()
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    msgs = writer.encode_all([img, 1.5, 'user'])
+    assert msgs[0][0] == 'shm'
+    assert msgs[1] == ('val', 1.5)
+    out = reader.decode_all(msgs)
+    assert np.array_equal(out[0], img)
+    assert out[1:] == [1.5, 'user']
+    del out
+    reader.close()
+    writer.close()
+
+
+@pytest.mark.skipif(shared_memory is None, reason='needs python 3.8')
+def test_frame_reader_drops_replaced_rings():
+    writer = FrameWriter(depth=2)
+    reader = FrameReader()
+    small = np.zeros((60, 80, 3), dtype=np.uint8)
+    big = np.ones((120, 160, 3), dtype=np.uint8)
+    out = reader.decode_all(writer.encode_all([small]))
+    assert len(reader.blocks) == 1
+    # a view of the old ring keeps its block until it is dropped
+    out2 = reader.decode_all(writer.encode_all([big]))
+    assert len(reader.blocks) == 1 and len(reader.replaced) == 1
+    del out
+    reader.decode_all(writer.encode_all([small]))
+    assert len(reader.blocks) == 1 and len(reader.replaced) == 1
+    del out2
+    reader.decode_all(writer.encode_all([small]))
+    assert len(reader.replaced) == 0
+    reader.close()
+    writer.close()
+
+
+@pytest.mark.skipif(shared_memory is None, reason='needs python 3.8')
+def test_frame_reader_refuses_overwritten_frames():
+    writer = FrameWriter(depth=2)
+    reader = FrameReader()
+    frames = [np.full((60, 80, 3), i, dtype=np.uint8) for i in range(3)]
+    msgs = [writer.encode_all([f]) for f in frames]
+    # the first slot was written again by the third frame
+    assert reader.decode_all(msgs[0]) == [None]
+    assert reader.stale == 1
+    assert np.array_equal(reader.decode_all(msgs[2])[0], frames[2])
+    # a slot being written is not read either
+    ring = writer.rings[0]
+    ring.seqs[msgs[1][0][2]] = 0
+    assert reader.decode_all(msgs[1]) == [None]
+    reader.close()
+    writer.close()
+
+
+def test_frame_writer_pickles_without_shared_memory(monkeypatch):
+    import donkeycar.process_part as process_part
+    monkeypatch.setattr(process_part, 'shared_memory', None)
+    img = np.ones((120, 160, 3), dtype=np.uint8)
+    msg = FrameWriter().encode(0, img)
+    assert msg[0] == 'val'
+    assert np.array_equal(FrameReader().decode(msg), img)
+
+
+def test_process_part_sync(tmpdir):
+    path = str(tmpdir.join('stopped.txt'))
+    part = ProcessPart(Brighten(path), sync=True)
+    img = np.ones((120, 160, 3), dtype=np.float32)
+    out_img, mean, pid = part.run(img, 2.0)
+    assert pid != os.getpid()
+    assert mean == 1.0
+    assert np.array_equal(out_img, img * 2.0)
+    part.shutdown()
+    with open(path) as f:
+        assert f.read() == 'stopped'
+
+
+def test_process_part_outputs_are_kept():
+    """ Outputs stay the same after the ring of the child wrapped around """
+    part = ProcessPart(Brighten(), sync=True, depth=2)
+    img = np.ones((120, 160, 3), dtype=np.float32)
+    first = part.run(img, 1.0)[0]
+    for gain in range(2, 6):
+        assert np.array_equal(part.run(img, float(gain))[0], img * gain)
+    assert np.array_equal(first, img)
+    part.shutdown()
+
+
+def test_process_part_raises_errors():
+    part = ProcessPart(Fails(), sync=True)
+    with pytest.raises(RuntimeError):
+        part.run()
+    part.shutdown()
+
+
+def test_vehicle_process_part():
+    vehicle = dk.Vehicle()
+    vehicle.mem.put(['img', 'gain'], [np.ones((60, 80, 3)), 3.0])
+    vehicle.add(Brighten(), inputs=['img', 'gain'],
+                outputs=['img/bright', 'img/mean', 'pid'], process=True)
+    deadline = time.time() + 10.0
+    while vehicle.mem.get(['pid'])[0] is None and time.time() < deadline:
+        vehicle.update_parts()
+        time.sleep(0.01)
+    vehicle.stop()
+    assert vehicle.mem['pid'] != os.getpid()
+    assert vehicle.mem['img/mean'] == 1.0
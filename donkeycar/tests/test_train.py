@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*- #
 import pytest
 import os
+import numpy as np
 
 from donkeycar.templates.train import multi_train
 from donkeycar.parts.datastore import Tub
 from donkeycar.parts.simulation import SquareBoxCamera, MovingSquareTelemetry
 
-from donkeycar.templates.train import gather_records, collate_records
+from donkeycar.templates.train import gather_records, collate_records, RecordSequence, BatchMaker
+from donkeycar.utils import get_model_by_type
 
 #fixtures
 from .setup import tub, tub_path, on_pi
@@ -126,6 +128,18 @@ def test_train_seq(tub, tub_path):
     aug = True
     multi_train(cfg, tub, model, transfer, model_type, continuous, aug)
 
+
+def test_train_seq_v2(tub, tub_path, tmpdir):
+    """ Sequence training reads the records of the manifest of a version 2 tub """
+    from donkeycar.parts.datastore import convert_tub
+    import donkeycar.templates.cfg_complete as cfg
+    cfg_defaults(cfg)
+    tub.remove_record(tub.get_index(shuffled=False)[0])
+    v2 = convert_tub(tub_path, str(tmpdir.join('v2')), 2)
+    model_path = str(tmpdir.join('test.h5'))
+    multi_train(cfg, v2.path, model_path, None, "rnn", False, False)
+    assert os.path.exists(model_path)
+
 # Helper function to calculate the Train-Test split (ratio) of a collated dataset
 def calculate_TrainTestSplit(gen_records):
     train_recs = 0
@@ -223,3 +237,90 @@ def test_train_TrainTestSplit_continuous(tub_path):
     collate_records(records, gen_records, opts)
     ratio = calculate_TrainTestSplit(gen_records)
     assert ratio == cfg.TRAIN_TEST_SPLIT
+
+
+def test_record_sequence_epochs():
+    """ Every epoch has each record once, in an order given by the seed """
+    records = list(range(103))
+    seq = RecordSequence(records, 10, lambda batch, rng: batch, seed=7)
+    assert len(seq) == 10
+
+    def epoch(seq):
+        return [r for i in range(len(seq)) for r in seq[i]]
+
+    first = epoch(seq)
+    assert len(set(first)) == 100
+    seq.on_epoch_end()
+    second = epoch(seq)
+    assert second != first
+    assert epoch(RecordSequence(records, 10, lambda batch, rng: batch, seed=7)) == first
+
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_batch_maker_reuses_buffers(tub, tub_path):
+    """ Batches are filled into a ring of buffers in the layout of the model """
+    import donkeycar.templates.cfg_complete as cfg
+    cfg_defaults(cfg)
+    opts = {'cfg': cfg, 'categorical': False}
+    gen_records = {}
+    collate_records(gather_records(cfg, tub_path, opts), gen_records, opts)
+    records = list(gen_records.values())[:10]
+
+    maker = BatchMaker(get_model_by_type('linear', cfg), cfg, num_buffers=2)
+    X, y = maker(records)
+    assert X[0].shape == (10, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+    assert np.array_equal(y[0], [r['angle'] for r in records])
+    assert np.array_equal(y[1], [r['throttle'] for r in records])
+    X2, _ = maker(records)
+    assert not np.shares_memory(X[0], X2[0])
+    X3, _ = maker(records)
+    assert np.shares_memory(X[0], X3[0])
+
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_batch_maker_splits_keep_batches(tub, tub_path):
+    """ Training and validation batches made in turn don't overwrite each other """
+    import donkeycar.templates.cfg_complete as cfg
+    cfg_defaults(cfg)
+    opts = {'cfg': cfg, 'categorical': False}
+    gen_records = {}
+    collate_records(gather_records(cfg, tub_path, opts), gen_records, opts)
+    records = sorted(gen_records.values(), key=lambda r: r['image_path'])
+
+    maker = BatchMaker(get_model_by_type('linear', cfg), cfg, num_buffers=3)
+    train_seq = RecordSequence(records[:60], 10, maker, seed=1)
+    val_seq = RecordSequence(records[60:120], 10, maker.for_split(), seed=2)
+
+    # keras holds as many batches of each sequence as the ring has buffers
+    held = []
+    for i in range(3):
+        for seq in (train_seq, val_seq):
+            X, y = seq[i]
+            held.append((seq, i, X[0].copy(), y[0].copy(), X, y))
+    for seq, i, img, angle, X, y in held:
+        assert np.array_equal(X[0], img)
+        assert np.array_equal(y[0], angle)
+        X2, y2 = seq.make_batch.for_split()([seq.records[row] for row in seq.order[i * 10:(i + 1) * 10]])
+        assert np.array_equal(X[0], X2[0])
+
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_batch_augmentation_repeats(tub, tub_path):
+    """ The augmentation of a batch depends on the seed, epoch and index, not the order batches are made in """
+    import donkeycar.templates.cfg_complete as cfg
+    cfg_defaults(cfg)
+    opts = {'cfg': cfg, 'categorical': False}
+    gen_records = {}
+    collate_records(gather_records(cfg, tub_path, opts), gen_records, opts)
+    records = sorted(gen_records.values(), key=lambda r: r['image_path'])[:40]
+    kl = get_model_by_type('linear', cfg)
+
+    def batches(order, seed=3):
+        seq = RecordSequence(records, 10, BatchMaker(kl, cfg, aug=True, num_buffers=4), seed)
+        return {i: seq[i][0][0].copy() for i in order}
+
+    first = batches([0, 1, 2, 3])
+    again = batches([3, 1, 0, 2])
+    for i in range(4):
+        assert np.array_equal(first[i], again[i])
+    assert not np.array_equal(first[0], batches([0], seed=4)[0])
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
+import glob
 import tempfile
 import unittest
 from donkeycar.parts.datastore import TubWriter, Tub
-from donkeycar.parts.datastore import TubHandler
+from donkeycar.parts.datastore import TubHandler, convert_tub
+from donkeycar.parts.datastore import TubImageStacker, TubTimeStacker, gray_frame
+from donkeycar.parts.datastore import read_images
 import os
+import time
+import numpy as np
 
 import pytest
 
@@ -64,6 +69,208 @@ def test_tub_exclude(tub):
     assert len(diff) == 1
     assert 1 in diff # Make sure we exclude the correct index
 
+def test_tub_batch_gen(tub):
+    """ A shuffled epoch of batches has every record once """
+    gen = tub.get_batch_gen(['cam/image_array', 'user/angle', 'location/one_hot_state_array'],
+                            batch_size=32)
+    batches = [next(gen) for _ in range(4)]
+    angles = np.concatenate([b['user/angle'] for b in batches])
+    assert sorted(angles) == sorted(tub.get_df()['user/angle'])
+    assert batches[0]['cam/image_array'].shape == (32, 120, 160, 3)
+    assert batches[0]['location/one_hot_state_array'].shape == (32, 10)
+
+
+def test_tub_batch_gen_record_transform(tub):
+    """ Records go through record_transform before their images are read """
+    def rt(record):
+        record['twice'] = record['user/angle'] * 2
+        return record
+
+    df = tub.get_df()
+    gen = tub.get_batch_gen(['cam/image_array', 'user/angle', 'twice'],
+                            record_transform=rt, batch_size=len(df), shuffle=False)
+    batch = next(gen)
+    assert np.array_equal(batch['user/angle'], df['user/angle'].to_numpy())
+    assert np.array_equal(batch['twice'], batch['user/angle'] * 2)
+    first = tub.get_record(tub.get_index(shuffled=False)[0])
+    assert np.array_equal(batch['cam/image_array'][0], first['cam/image_array'])
+
+
+def test_tub_image_stacker_window(tub, tub_path):
+    """ Stacked records going through the tub in order decode each image once """
+    stacker = TubImageStacker(tub_path)
+    loads = []
+    load = stacker.frames.load
+    stacker.frames.load = lambda ix: loads.append(ix) or load(ix)
+
+    index = tub.get_index(shuffled=False)
+    records = dict(stacker.iter_records(index[:10]))
+    assert sorted(loads) == index[:10]
+    ix = index[5]
+    stacked = records[ix]['cam/image_array']
+    assert stacked.shape == (120, 160, 3)
+    assert stacked.dtype == np.uint8
+    assert np.array_equal(stacked[..., 2], gray_frame(tub.get_record(ix)['cam/image_array']))
+    assert np.array_equal(stacked[..., 0], records[ix - 2]['cam/image_array'][..., 2])
+
+
+def test_tub_image_stacker_reuses_output(tub, tub_path):
+    """ With reuse every record is stacked into the same image """
+    stacker = TubImageStacker(tub_path)
+    index = tub.get_index(shuffled=False)
+    first = None
+    for ix, record in stacker.iter_records(index[:5], reuse=True):
+        stacked = record['cam/image_array']
+        if first is None:
+            first = stacked
+        assert stacked is first
+        assert np.array_equal(stacked, TubImageStacker(tub_path).get_record(ix)['cam/image_array'])
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_read_images_after_fork(tub):
+    """ A forked child reads images with its own pool, not the dead one of its parent """
+    paths = [tub.make_record_paths_absolute(tub.get_json_record(ix))['cam/image_array']
+             for ix in tub.get_index(shuffled=False)[:4]]
+    assert len(read_images(paths)) == 4
+    pid = os.fork()
+    if pid == 0:
+        # the child exits without running the pytest teardown
+        code = 1
+        try:
+            code = 0 if len(read_images(paths)) == 4 else 1
+        finally:
+            os._exit(code)
+    for _ in range(100):
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        time.sleep(0.05)
+    else:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        pytest.fail('read_images hangs in a forked child')
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_tub_time_stacker_window(tub, tub_path):
+    """ Offset records are parsed once when going through the tub in order """
+    stacker = TubTimeStacker([0, 2, 5], tub_path)
+    loads = []
+    load = stacker.json_records.load
+    stacker.json_records.load = lambda ix: loads.append(ix) or load(ix)
+
+    index = tub.get_index(shuffled=False)
+    records = dict(stacker.iter_records(index[:10]))
+    assert sorted(loads) == list(range(index[0], index[9] + 6))
+    ix = index[3]
+    assert records[ix]['user/angle_5'] == tub.get_record(ix + 5)['user/angle']
+    assert np.array_equal(records[ix]['cam/image_array'], tub.get_record(ix)['cam/image_array'])
+
+
+def test_tub_manifest(tub, tub_path):
+    """ The manifest follows written and erased records across reopening """
+    index = tub.get_index(shuffled=False)
+    assert len(index) == 128
+    tub.erase_record(index[-1])
+    tub.remove_record(index[0])
+    t2 = Tub(tub_path)
+    assert t2.get_index(shuffled=False) == index[1:-1]
+    assert t2.get_num_records() == 126
+    assert t2.get_index(shuffled=False) == t2.scan_index()
+    ix = t2.put_record({'user/angle': 0.5, 'user/throttle': 0.1})
+    assert Tub(tub_path).get_last_ix() == ix
+
+
+def test_tub_manifest_rebuilt_for_legacy_tub(tub, tub_path):
+    """ A tub without a manifest gets one built from its record files """
+    index = tub.get_index(shuffled=False)
+    os.unlink(tub.manifest.path)
+    t2 = Tub(tub_path)
+    assert os.path.exists(t2.manifest.path)
+    assert t2.get_index(shuffled=False) == index
+    assert t2.get_last_ix() == index[-1]
+
+
+def test_tub_v2_chunks(tmpdir):
+    """ A version 2 tub reads back what was written across chunks and reopening """
+    path = str(tmpdir.join('tub_v2'))
+    inputs = ['cam/image_array', 'user/angle', 'user/mode', 'behavior/state', 'flag']
+    types = ['image_array', 'float', 'str', 'vector', 'boolean']
+    tub = Tub(path, inputs=inputs, types=types, version=2)
+    tub.chunks.chunk_size = 7
+    img = np.zeros((12, 16, 3), dtype=np.uint8)
+    for i in range(20):
+        img[:] = i * 10
+        tub.put_record({'cam/image_array': img, 'user/angle': i / 10.0,
+                        'user/mode': 'user', 'behavior/state': [i, 0],
+                        'flag': None})
+    tub.erase_record(20)
+    tub.shutdown()
+    assert len(glob.glob(os.path.join(path, 'chunk_*.rows'))) == 3
+
+    t2 = Tub(path)
+    assert t2.version == 2
+    assert t2.get_index(shuffled=False) == list(range(1, 20))
+    record = t2.get_record(5)
+    assert record['user/angle'] == 0.4
+    assert record['user/mode'] == 'user'
+    assert record['behavior/state'] == [4, 0]
+    assert record['flag'] is None
+    assert record['cam/image_array'].shape == (12, 16, 3)
+    assert abs(int(record['cam/image_array'][0, 0, 0]) - 40) <= 2
+
+    # writing an index again hides the older record
+    t2.write_record(20, {'user/angle': -1.0}, 0)
+    assert t2.get_record(20)['user/angle'] == -1.0
+    assert t2.get_record(20)['cam/image_array'] is None
+
+
+def test_tub_v2_many_chunks_bounded_files(tmpdir):
+    """ Reading a tub of many chunks keeps only a few files open """
+    from donkeycar.parts import tub_chunks
+    path = str(tmpdir.join('tub_v2'))
+    tub = Tub(path, inputs=['cam/image_array', 'user/angle', 'extra'],
+              types=['image_array', 'float', 'str'], version=2)
+    tub.chunks.chunk_size = 2
+    img = np.zeros((12, 16, 3), dtype=np.uint8)
+    num_chunks = 2 * tub_chunks.MAX_OPEN_BLOBS + 20
+    for i in range(2 * num_chunks):
+        tub.put_record({'cam/image_array': img, 'user/angle': i / 10.0, 'extra': str(i)})
+    tub.shutdown()
+
+    def open_files():
+        return len(os.listdir('/proc/self/fd'))
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('needs /proc to count open files')
+    before = open_files()
+    t2 = Tub(path)
+    for i, ix in enumerate(t2.get_index(shuffled=False)):
+        record = t2.get_record(ix)
+        assert record['extra'] == str(i)
+        assert record['cam/image_array'].shape == (12, 16, 3)
+    assert len(tub_chunks.blob_files) <= tub_chunks.MAX_OPEN_BLOBS
+    assert open_files() - before <= tub_chunks.MAX_OPEN_BLOBS + 4
+
+
+def test_convert_tub(tub, tub_path, tmpdir):
+    """ Converting to version 2 and back keeps records and images """
+    index = tub.get_index(shuffled=False)
+    tub.remove_record(index[0])
+    v2 = convert_tub(tub_path, str(tmpdir.join('v2')), 2)
+    v1 = convert_tub(v2.path, str(tmpdir.join('v1')), 1)
+    assert Tub(v2.path).version == 2
+    for t in (v2, v1):
+        t = Tub(t.path)
+        assert t.get_index(shuffled=False) == index[1:]
+        expected = tub.get_record(index[5])
+        record = t.get_record(index[5])
+        assert record['user/angle'] == expected['user/angle']
+        assert np.array_equal(record['cam/image_array'], expected['cam/image_array'])
+    with open(tub.get_json_record(index[5])['cam/image_array'], 'rb') as f:
+        assert v1.read_image_bytes(Tub(v1.path).get_json_record(index[5])['cam/image_array']) == f.read()
+
+
 class TestTubWriter(unittest.TestCase):
     def setUp(self):
         self.tempfolder = tempfile.TemporaryDirectory().name
@@ -78,6 +285,34 @@ class TestTubWriter(unittest.TestCase):
         tub = TubWriter(self.path, inputs=self.inputs, types=self.types)
         tub.run('will', 323, 'asdfasdf')
 
+    def test_tub_writer_queued(self):
+        """ Queued records are all written when the writer shuts down """
+        tub = TubWriter(self.path, inputs=['cam/image_array', 'angle'],
+                        types=['image_array', 'float'], queue_size=4)
+        img = np.zeros((12, 16, 3), dtype=np.uint8)
+        for i in range(10):
+            img[:] = i
+            ix, depth, dropped = tub.run(img, i / 10.0)
+            assert depth <= 4
+            assert dropped == 0
+        tub.shutdown()
+        t2 = Tub(self.path)
+        index = t2.get_index(shuffled=False)
+        assert len(index) == 10
+        for i, ix in enumerate(index):
+            record = t2.get_record(ix)
+            assert record['angle'] == i / 10.0
+            assert record['cam/image_array'][0, 0, 0] == i
+
+    def test_tub_writer_drops_when_full(self):
+        """ With the drop policy run() never waits for a full queue """
+        tub = TubWriter(self.path, inputs=self.inputs, types=self.types,
+                        queue_size=2, policy='drop', workers=0)
+        outputs = [tub.run('will', i, 'pic') for i in range(5)]
+        assert outputs[-1] == (2, 2, 3)
+        tub.shutdown()
+        assert Tub(self.path).get_num_records() == 2
+
     def test_make_paths_absolute(self):
         tub = Tub(self.path, inputs=['file_path'], types=['image'])
         rel_file_name = 'test.jpg'
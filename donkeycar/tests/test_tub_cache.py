@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+
+from donkeycar.parts.datastore import Tub, TubGroup
+from donkeycar.parts.tub_cache import TubImageCache, TubRecordCache, CollatedIndex, collate_tubs
+from donkeycar.parts.tub_cache import ImageMemoryCache
+from donkeycar.utils import load_scaled_image_arr
+
+#fixtures
+from .setup import tub, tub_path, tubs
+
+
+class Config:
+    IMAGE_W = 160
+    IMAGE_H = 120
+    IMAGE_DEPTH = 3
+    ROI_CROP_TOP = 20
+    ROI_CROP_BOTTOM = 0
+
+
+def test_tub_cache_matches_loaded_images(tub):
+    """ Cached images are the images training loads from the tub """
+    cfg = Config()
+    cache = TubImageCache.open(tub, cfg)
+    index = tub.get_index(shuffled=False)
+    assert cache.images.shape == (len(index), 100, 160, 3)
+    assert cache.images.dtype == np.uint8
+    rows = [cache.row(ix) for ix in index[3:8]]
+    imgs = cache.get_images(rows)
+    for ix, img in zip(index[3:8], imgs):
+        record = tub.get_json_record(ix)
+        expected = load_scaled_image_arr(record['cam/image_array'], cfg)
+        assert img.dtype == np.float32
+        assert np.allclose(img, expected)
+    ix = index[3]
+    assert cache.labels['user/angle'][cache.row(ix)] == \
+        np.float32(tub.get_json_record(ix)['user/angle'])
+
+
+def test_tub_cache_follows_records_and_settings(tub, tub_path):
+    """ A cache is reused until the records or image settings change """
+    cfg = Config()
+    cache = TubImageCache.open(tub, cfg)
+    mtime = os.path.getmtime(cache.images_path)
+    assert TubImageCache.open(Tub(tub_path), cfg).images_path == cache.images_path
+    assert os.path.getmtime(cache.images_path) == mtime
+
+    tub.remove_record(tub.get_index(shuffled=False)[0])
+    cfg.IMAGE_DEPTH = 1
+    gray = TubImageCache.open(Tub(tub_path), cfg)
+    assert gray.key != cache.key
+    assert gray.images.shape[1:] == (100, 160, 1)
+    assert not os.path.exists(cache.images_path)
+    assert sorted(os.listdir(gray.dir)) == \
+        sorted([os.path.basename(gray.images_path), os.path.basename(gray.labels_path)])
+
+
+def test_tub_group_record_cache(tubs):
+    """ TubGroup parses the tubs once and loads their records from the cache after """
+    tubs_dir, tub_paths, _ = tubs
+    group = TubGroup(os.path.join(tubs_dir, '*'))
+    assert len(group.df) == 25
+    caches = [TubRecordCache(Tub(p)) for p in tub_paths]
+    assert all(os.path.exists(c.columns_path) for c in caches)
+
+    cached = TubGroup(os.path.join(tubs_dir, '*'))
+    assert cached.df.equals(group.df)
+
+    t = Tub(tub_paths[0])
+    t.put_record({'user/angle': 0.5, 'user/throttle': 0.1})
+    assert TubRecordCache(t).load() is None
+    assert len(TubGroup(os.path.join(tubs_dir, '*')).df) == 26
+
+
+def test_collated_index_collates_new_records_only(tub, tub_path):
+    """ Records are collated once, keep their split and new ones are added """
+    columns = collate_tubs([tub], 0.8)[0]
+    index = tub.get_index(shuffled=False)
+    assert list(columns['index']) == index
+    assert columns['valid'].all()
+    assert columns['train'].sum() == int(0.8 * len(index))
+    record = tub.get_json_record(index[4])
+    assert columns['angle'][4] == record['user/angle']
+    assert os.path.join(tub_path, columns['image'][4]) == record['cam/image_array']
+    assert columns['location'][4] == record['location/one_hot_state_array']
+    assert np.isnan(columns['imu']).all()
+
+    t2 = Tub(tub_path)
+    t2.remove_record(index[0])
+    ix = t2.put_record({'user/angle': 0.5, 'user/throttle': 0.1})
+    t2.erase_record(index[5])
+    t2.write_record(index[5], {'user/angle': -0.5, 'user/throttle': 0.1}, 0)
+    again = collate_tubs([Tub(tub_path)], 0.8)[0]
+    assert list(again['index']) == index[1:] + [ix]
+    # records without an image are not trained on
+    assert not again['valid'][-1] and not again['valid'][4]
+    assert np.array_equal(again['train'][5:-1], columns['train'][6:])
+
+    mtime = os.path.getmtime(CollatedIndex(tub).path)
+    collate_tubs([Tub(tub_path)], 0.8)
+    assert os.path.getmtime(CollatedIndex(tub).path) == mtime
+
+
+def test_image_memory_cache_budget(tub):
+    """ The memory cache holds as many images as fit its budget and evicts unused ones """
+    cfg = Config()
+    paths = [tub.get_json_record(ix)['cam/image_array']
+             for ix in tub.get_index(shuffled=False)[:6]]
+    cache = ImageMemoryCache(cfg, 100 * 160 * 3 * 4 + 10)
+    imgs = cache.get_images(paths[:4])
+    assert cache.nbytes == 100 * 160 * 3 * 4
+    assert np.allclose(imgs[1], load_scaled_image_arr(paths[1], cfg))
+    assert cache.reset_stats() == (0, 4, 0.0)
+
+    cache.get_images(paths[1:2])
+    cache.get_images(paths[4:6])
+    # the images not used since they were cached were evicted first
+    assert sorted(cache.slots) == sorted([paths[1], paths[3], paths[4], paths[5]])
+    assert cache.reset_stats() == (1, 2, 1 / 3)
+
+
+def test_tub_cache_follows_rewritten_records(tmpdir):
+    """ Records erased and written again under the same indexes make a new cache """
+    path = str(tmpdir.join('tub'))
+    inputs = ['cam/image_array', 'user/angle', 'user/throttle']
+    types = ['image_array', 'float', 'float']
+    t = Tub(path, inputs=inputs, types=types)
+
+    def record(pixel, angle):
+        img = np.full((120, 160, 3), pixel, dtype=np.uint8)
+        return {'cam/image_array': img, 'user/angle': angle, 'user/throttle': 0.1}
+
+    for _ in range(5):
+        t.put_record(record(10, 0.1))
+    cfg = Config()
+    cache = TubImageCache.open(Tub(path), cfg)
+    t.erase_last_n_records(2)
+    for _ in range(3):
+        t.put_record(record(200, 0.9))
+
+    again = TubImageCache.open(Tub(path), cfg)
+    assert again.key != cache.key
+    for ix in Tub(path).get_index(shuffled=False)[2:]:
+        row = again.row(ix)
+        assert again.images[row].min() > 150
+        assert again.labels['user/angle'][row] == np.float32(0.9)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+
+from donkeycar.parts.datastore import Tub
+from donkeycar.parts import tub_check
+from donkeycar.parts.tub_check import check_tubs, check_records, open_worker_tubs, STAMPS_FILE
+
+#fixtures
+from .setup import tub, tub_path
+
+
+def test_tub_check_is_incremental(tub, tub_path):
+    """ Records that passed are not read again until their files change """
+    report = tub.check()
+    assert report['records'] == 128
+    assert report['checked'] == 128
+    assert report['problems'] == []
+    assert os.path.exists(os.path.join(tub_path, STAMPS_FILE))
+
+    report = Tub(tub_path).check()
+    assert report['checked'] == 0
+    assert report['unchanged'] == 128
+
+    # a full check decodes the images only checked by their header before
+    assert Tub(tub_path).check(full=True)['checked'] == 128
+    assert Tub(tub_path).check(full=True)['checked'] == 0
+
+    ix = tub.get_index(shuffled=False)[3]
+    img_path = tub.get_json_record(ix)['cam/image_array']
+    with open(img_path, 'wb') as f:
+        f.write(b'not a jpg')
+    report = Tub(tub_path).check()
+    assert report['checked'] == 0
+    assert [p['index'] for p in report['problems']] == [ix]
+
+
+def test_tub_check_fix_and_report(tub, tub_path, monkeypatch):
+    """ --fix removes the problem records and the report lists them """
+    # several tasks, so the records are checked in worker processes
+    monkeypatch.setattr(tub_check, 'CHECK_CHUNK_RECORDS', 32)
+    index = tub.get_index(shuffled=False)
+    os.unlink(tub.get_json_record(index[0])['cam/image_array'])
+    with open(tub.get_json_record_path(index[1]), 'w') as f:
+        f.write('{"user/angle": ')
+
+    report = check_tubs([tub], fix=True, workers=2)
+    tub_report = report['tubs'][0]
+    assert sorted(tub_report['removed']) == index[:2]
+    assert Tub(tub_path).get_index(shuffled=False) == index[2:]
+    json.dumps(report)
+
+
+def test_tub_check_worker_opens_tub_once(tub, tub_path, monkeypatch):
+    """ The tasks of a worker share the tub it opened, not reading the manifest again """
+    monkeypatch.setattr(tub_check, 'worker_tubs', {})
+    open_worker_tubs([tub_path])
+    monkeypatch.setattr(Tub, '__init__', None)
+    index = tub.get_index(shuffled=False)
+    for start in (0, 64):
+        results = check_records(tub_path, index[start:start + 64], {}, False)
+        assert [ix for ix, error, stamp in results] == index[start:start + 64]
+        assert all(error is None for ix, error, stamp in results)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+
+from donkeycar.parts.datastore import Tub, TubWriter
+from donkeycar.parts.tub_stats import TubStats, load_tub_stats, STATS_FILE, MAX_BINS
+
+#fixtures
+from .setup import tub, tub_path
+
+
+def test_tub_stats_match_records(tub, tub_path):
+    """ Stats of a legacy tub are made once and follow new and removed records """
+    stats = tub.get_stats()
+    angles = tub.get_df()['user/angle'].to_numpy()
+    channel = stats.channels['user/angle']
+    assert stats.records == 128
+    assert channel['count'] == 128
+    assert channel['min'] == angles.min() and channel['max'] == angles.max()
+    assert np.isclose(stats.mean('user/angle'), angles.mean())
+    assert np.isclose(stats.std('user/angle'), angles.std())
+    counts, edges = stats.histogram('user/angle')
+    assert counts.sum() == 128
+    assert len(counts) <= MAX_BINS
+    assert np.array_equal(counts, np.histogram(angles, bins=edges)[0])
+    assert os.path.exists(os.path.join(tub_path, STATS_FILE))
+
+    # only the new record is read
+    Tub(tub_path).put_record({'user/angle': 1000.0, 'user/throttle': 0.1})
+    t2 = Tub(tub_path)
+    read = []
+    get_json_record = t2.get_json_record
+    t2.get_json_record = lambda ix: read.append(ix) or get_json_record(ix)
+    stats = t2.get_stats()
+    assert read == [t2.get_last_ix()]
+    assert stats.records == 129
+    assert stats.channels['user/angle']['max'] == 1000.0
+
+    tub.remove_record(tub.get_index(shuffled=False)[0])
+    assert load_tub_stats(Tub(tub_path)).records == 128
+
+
+def test_tub_writer_stats(tmpdir):
+    """ The writer keeps stats of what it records, and of erased records """
+    path = str(tmpdir.join('tub'))
+    tub = TubWriter(path, inputs=['user/angle', 'user/mode', 'flag'],
+                    types=['float', 'str', 'boolean'], queue_size=4)
+    for i in range(10):
+        tub.run(i / 10.0, 'user' if i < 6 else 'local_angle', i % 2 == 0)
+    tub.flush()
+    tub.erase_last_n_records(2)
+    tub.shutdown()
+
+    stats = TubStats.load(path)
+    assert stats.records == Tub(path).get_num_records()
+    assert stats.channels['user/mode']['values'] == {'user': 6, 'local_angle': 2}
+    assert stats.channels['flag']['values'] == {'True': 4, 'False': 4}
+    assert np.isclose(stats.mean('user/angle'), 0.375)
+
+    merged = TubStats().merge(stats).merge(load_tub_stats(Tub(path)))
+    assert merged.records == 2 * stats.records
+    assert merged.channels['user/mode']['values']['user'] == 12
@@ -1,3 +1,4 @@
+import time
 import pytest
 import donkeycar as dk
 from donkeycar.parts.transform import Lambda
@@ -54,4 +55,259 @@ def test_should_raise_assertion_on_non_boolean_threaded_for_add_part():
     threaded = 'non_boolean'
     with pytest.raises(AssertionError):
         vehicle.add(_get_sample_lambda(), threaded=threaded)
-        pytest.fail("threaded is not a boolean: %r" % threaded)
\ No newline at end of file
+        pytest.fail("threaded is not a boolean: %r" % threaded)
+
+class _Counter:
+    def __init__(self):
+        self.count = 0
+
+    def run(self):
+        self.count += 1
+        return self.count
+
+
+def test_should_raise_assertion_on_rate_and_period_for_add_part():
+    vehicle = dk.Vehicle()
+    with pytest.raises(AssertionError):
+        vehicle.add(_Counter(), rate_hz=10, period=0.1)
+
+
+def test_part_rate_sets_loop_rate():
+    vehicle = dk.Vehicle()
+    vehicle.add(_Counter(), rate_hz=50)
+    vehicle.add(_Counter(), period=0.5)
+    assert vehicle.loop_rate(10) == 50
+    assert vehicle.loop_rate(100) == 100
+
+
+def test_part_runs_at_own_rate():
+    vehicle = dk.Vehicle()
+    fast = _Counter()
+    slow = _Counter()
+    vehicle.add(fast, outputs=['fast'])
+    vehicle.add(slow, outputs=['slow'], rate_hz=10)
+    vehicle.start(rate_hz=40, max_loop_count=20)
+    assert fast.count == 21
+    assert 4 <= slow.count <= 7
+    assert vehicle.mem['slow'] == slow.count
+
+
+class _Adder:
+    def run(self, a, b):
+        return a + b, a - b
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_vehicle_modes_share_memory(compiled):
+    vehicle = dk.Vehicle(compiled=compiled)
+    vehicle.mem.put(['a', 'b', 'run'], [3, 2, True])
+    vehicle.add(_Adder(), inputs=['a', 'b'], outputs=['sum', 'diff'],
+                run_condition='run')
+    vehicle.update_parts()
+    assert vehicle.mem.get(['sum', 'diff']) == [5, 1]
+
+    vehicle.mem.put(['a', 'run'], [10, False])
+    vehicle.update_parts()
+    assert vehicle.mem['sum'] == 5
+
+
+def test_compiled_vehicle_picks_up_new_parts():
+    vehicle = dk.Vehicle()
+    vehicle.add(_Counter(), outputs=['first'])
+    vehicle.update_parts()
+    vehicle.add(_Counter(), outputs=['second'])
+    vehicle.update_parts()
+    assert vehicle.mem.get(['first', 'second']) == [2, 1]
+
+
+class _Doubler:
+    def __init__(self):
+        self.count = 0
+
+    def run(self, x):
+        self.count += 1
+        return x * 2
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_skip_if_unchanged(compiled):
+    vehicle = dk.Vehicle(compiled=compiled)
+    part = _Doubler()
+    vehicle.mem['x'] = 1
+    vehicle.add(part, inputs=['x'], outputs=['y'], skip_if_unchanged=True)
+    vehicle.update_parts()
+    vehicle.mem['y'] = None
+    vehicle.update_parts()
+    assert part.count == 1
+    # the previous output is written again when the part is skipped
+    assert vehicle.mem['y'] == 2
+
+    vehicle.mem['x'] = 3
+    vehicle.update_parts()
+    assert part.count == 2
+    assert vehicle.mem['y'] == 6
+
+
+def test_skip_if_unchanged_from_part_attribute():
+    vehicle = dk.Vehicle()
+    part = _Doubler()
+    part.skip_if_unchanged = True
+    vehicle.mem['x'] = 1
+    vehicle.add(part, inputs=['x'], outputs=['y'])
+    vehicle.update_parts()
+    vehicle.update_parts()
+    assert part.count == 1
+
+
+def test_should_raise_assertion_on_skip_threaded_part():
+    vehicle = dk.Vehicle()
+    with pytest.raises(AssertionError):
+        vehicle.add(_get_sample_lambda(), threaded=True, skip_if_unchanged=True)
+
+
+def test_log_histogram_percentiles():
+    from donkeycar.vehicle import LogHistogram
+    hist = LogHistogram()
+    for i in range(1, 1001):
+        hist.add(i / 1000.0)
+    assert hist.count == 1000
+    assert hist.min == 0.001
+    assert hist.max == 1.0
+    assert abs(hist.mean() - 0.5005) < 1e-9
+    assert abs(hist.percentile(50) - 0.5) < 0.5 * 0.05
+    assert abs(hist.percentile(99) - 0.99) < 0.99 * 0.05
+    assert len(hist.buckets) == hist.num_buckets
+
+
+def test_profiler_snapshot(vehicle):
+    import json
+    vehicle.start(rate_hz=100, max_loop_count=5)
+    snap = json.loads(json.dumps(vehicle.profiler.snapshot()))
+    assert snap['loop']['busy']['count'] == 6
+    assert len(snap['parts']) == 1
+    assert snap['parts'][0]['part'] == 'Lambda'
+    # the first run of a part is not profiled
+    assert snap['parts'][0]['count'] == 5
+
+
+def test_link_records_follows_channel_order():
+    from donkeycar.vehicle import link_records
+    vehicle = dk.Vehicle()
+    vehicle.add(_Counter(), outputs=['a'])
+    vehicle.add(_Doubler(), inputs=['a'], outputs=['b'])
+    vehicle.add(_Counter(), outputs=['c'])
+    vehicle.add(_Counter(), outputs=['a'])
+    plan = vehicle.compile()
+    link_records(plan)
+    assert [rec.deps for rec in plan] == [(), (0,), (), (0, 1)]
+    assert plan[0].dependents == (1, 3)
+
+
+class _Sleeper:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def run(self, x=0):
+        time.sleep(self.delay)
+        return (x or 0) + 1
+
+
+def test_parallel_vehicle_matches_sequential():
+    results = []
+    for workers in (0, 4):
+        vehicle = dk.Vehicle(workers=workers)
+        vehicle.mem['x'] = 1
+        vehicle.add(_Doubler(), inputs=['x'], outputs=['y'])
+        vehicle.add(_Doubler(), inputs=['y'], outputs=['z'])
+        vehicle.add(_Adder(), inputs=['x', 'z'], outputs=['x', 'w'])
+        vehicle.add(_Doubler(), inputs=['x'], outputs=['v'])
+        for _ in range(3):
+            vehicle.update_parts()
+        results.append(dict(vehicle.mem.items()))
+        vehicle.stop()
+    assert results[0] == results[1]
+
+
+def test_parallel_vehicle_overlaps_independent_parts():
+    vehicle = dk.Vehicle(workers=4)
+    for i in range(4):
+        vehicle.add(_Sleeper(0.05), outputs=['out/%d' % i])
+    vehicle.update_parts()
+    start = time.time()
+    vehicle.update_parts()
+    elapsed = time.time() - start
+    vehicle.stop()
+    assert elapsed < 0.15
+    assert vehicle.mem.get(['out/%d' % i for i in range(4)]) == [1] * 4
+
+
+def test_parallel_vehicle_raises_part_errors():
+    class Broken:
+        def run(self):
+            raise ValueError('broken')
+
+    vehicle = dk.Vehicle(workers=2)
+    vehicle.add(Broken(), outputs=['a'])
+    with pytest.raises(ValueError):
+        vehicle.update_parts()
+    vehicle.stop()
+
+
+@pytest.mark.parametrize('overrun,expected', [
+    ('skip', 1.3), ('catchup', 1.1), ('stretch', 1.25)])
+def test_next_tick_overrun_policies(overrun, expected):
+    from donkeycar.vehicle import next_tick
+    # on time: the grid is kept whatever the policy
+    assert next_tick(1.0, 1.05, 0.1, overrun) == pytest.approx(1.1)
+    # the loop started at 1.0 ran until 1.25, past two ticks
+    assert next_tick(1.0, 1.25, 0.1, overrun) == pytest.approx(expected)
+
+
+def test_vehicle_publishes_loop_stats():
+    vehicle = dk.Vehicle()
+    vehicle.add(_Sleeper(0.02), outputs=['a'])
+    vehicle.add(_Counter(), outputs=['b'])
+    vehicle.start(rate_hz=100, max_loop_count=3)
+    loop_ms, missed, late_part = vehicle.mem.get(
+        ['vehicle/loop_ms', 'vehicle/missed', 'vehicle/late_part'])
+    assert loop_ms >= 20
+    assert missed == 4
+    assert late_part == '_Sleeper'
+    snap = vehicle.profiler.snapshot()
+    assert snap['loop']['blame'] == {'_Sleeper': 4}
+    assert snap['loop']['period']['count'] == 3
+
+
+def test_tracer_records_parts_and_loops(tmpdir):
+    import json
+    from donkeycar.vehicle import Tracer
+    tracer = Tracer(seconds=60)
+    vehicle = dk.Vehicle(tracer=tracer)
+    vehicle.add(_Counter(), outputs=['a'])
+    vehicle.add(_Doubler(), inputs=['a'], outputs=['b'])
+    vehicle.start(rate_hz=100, max_loop_count=2)
+    path = tracer.dump(str(tmpdir.join('trace.json')))
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    spans = [e['name'] for e in events if e['ph'] == 'X']
+    assert spans == ['_Counter', '_Doubler', 'loop'] * 3
+    assert all(e['dur'] >= 0 for e in events if e['ph'] == 'X')
+    assert tracer.window(0) == []
+
+
+def test_tracer_dumps_window_on_deadline_miss(tmpdir):
+    from donkeycar.vehicle import Tracer, trace
+    tracer = Tracer(dump_dir=str(tmpdir), dump_on_miss=True)
+    vehicle = dk.Vehicle(tracer=tracer)
+    vehicle.add(_Sleeper(0.02), outputs=['a'])
+    vehicle.start(rate_hz=100, max_loop_count=3)
+    with trace(None, 'untraced'):
+        pass
+    # only one dump within the cooldown
+    for _ in range(100):
+        if tmpdir.listdir():
+            break
+        time.sleep(0.01)
+    dumps = tmpdir.listdir()
+    assert len(dumps) == 1
+    assert dumps[0].basename.startswith('trace_miss_')
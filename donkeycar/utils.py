@@ -147,8 +147,9 @@ def load_scaled_image_arr(filename, cfg):
     also apply cropping and normalize
     '''
     import donkeycar as dk
+    from donkeycar.parts.tub_chunks import open_file
     try:
-        img = Image.open(filename)
+        img = Image.open(open_file(filename))
         if img.height != cfg.IMAGE_H or img.width != cfg.IMAGE_W:
             img = img.resize((cfg.IMAGE_W, cfg.IMAGE_H))
         img_arr = np.array(img)
@@ -438,12 +439,9 @@ def get_model_by_type(model_type, cfg):
     '''
     given the string model_type and the configuration settings in cfg
     create a Keras model and return it.
+    Only the module of the requested model type is imported, as tensorflow
+    takes seconds to import on a Pi.
     '''
-    from donkeycar.parts.keras import KerasRNN_LSTM, KerasBehavioral, \
-        KerasCategorical, KerasIMU, KerasLinear, Keras3D_CNN, \
-        KerasLocalizer, KerasLatent
-    from donkeycar.parts.tflite import TFLitePilot
- 
     if model_type is None:
         model_type = cfg.DEFAULT_MODEL_TYPE
     print("\"get_model_by_type\" model Type is: {}".format(model_type))
@@ -452,14 +450,19 @@ def get_model_by_type(model_type, cfg):
     roi_crop = (cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM)
 
     if model_type == "tflite_linear":
+        from donkeycar.parts.tflite import TFLitePilot
         kl = TFLitePilot()
     elif model_type == "localizer" or cfg.TRAIN_LOCALIZER:
+        from donkeycar.parts.keras import KerasLocalizer
         kl = KerasLocalizer(num_locations=cfg.NUM_LOCATIONS, input_shape=input_shape)
     elif model_type == "behavior" or cfg.TRAIN_BEHAVIORS:
+        from donkeycar.parts.keras import KerasBehavioral
         kl = KerasBehavioral(num_outputs=2, num_behavior_inputs=len(cfg.BEHAVIOR_LIST), input_shape=input_shape)        
     elif model_type == "imu":
+        from donkeycar.parts.keras import KerasIMU
         kl = KerasIMU(num_outputs=2, num_imu_inputs=6, input_shape=input_shape)        
     elif model_type == "linear":
+        from donkeycar.parts.keras import KerasLinear
         kl = KerasLinear(input_shape=input_shape, roi_crop=roi_crop)
     elif model_type == "tensorrt_linear":
         # Aggressively lazy load this. This module imports pycuda.autoinit which causes a lot of unexpected things
@@ -470,12 +473,16 @@ def get_model_by_type(model_type, cfg):
         from donkeycar.parts.coral import CoralLinearPilot
         kl = CoralLinearPilot()
     elif model_type == "3d":
+        from donkeycar.parts.keras import Keras3D_CNN
         kl = Keras3D_CNN(image_w=cfg.IMAGE_W, image_h=cfg.IMAGE_H, image_d=cfg.IMAGE_DEPTH, seq_length=cfg.SEQUENCE_LENGTH)
     elif model_type == "rnn":
+        from donkeycar.parts.keras import KerasRNN_LSTM
         kl = KerasRNN_LSTM(image_w=cfg.IMAGE_W, image_h=cfg.IMAGE_H, image_d=cfg.IMAGE_DEPTH, seq_length=cfg.SEQUENCE_LENGTH)
     elif model_type == "categorical":
+        from donkeycar.parts.keras import KerasCategorical
         kl = KerasCategorical(input_shape=input_shape, throttle_range=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE, roi_crop=roi_crop)
     elif model_type == "latent":
+        from donkeycar.parts.keras import KerasLatent
         kl = KerasLatent(input_shape=input_shape)
     elif model_type == "fastai":
         from donkeycar.parts.fastai import FastAiPilot
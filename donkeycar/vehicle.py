@@ -6,68 +6,498 @@ Created on Sun Jun 25 10:44:24 2017
 @author: wroscoe
 """
 
+import os
 import time
+import math
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
 import numpy as np
-from threading import Thread
+from threading import Thread, Condition
+from concurrent.futures import ThreadPoolExecutor
 from .memory import Memory
 from prettytable import PrettyTable
 import traceback
 
 
+class LogHistogram:
+    '''
+    Histogram of durations in seconds with logarithmic buckets. It has a fixed
+    size however many samples are added, and estimates percentiles to within
+    the bucket ratio, 5% by default.
+    '''
+    def __init__(self, lo=0.000001, hi=100.0, ratio=1.05):
+        self.lo = lo
+        self.log_ratio = math.log(ratio)
+        self.num_buckets = int(math.ceil(math.log(hi / lo) / self.log_ratio)) + 1
+        self.buckets = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value):
+        if value > self.lo:
+            ix = int(math.log(value / self.lo) / self.log_ratio) + 1
+            if ix >= self.num_buckets:
+                ix = self.num_buckets - 1
+        else:
+            ix = 0
+        self.buckets[ix] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        '''
+        estimate of the q-th percentile, the geometric middle of the bucket
+        it falls into, clamped to the observed min and max
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        cumulative = np.cumsum(self.buckets)
+        ix = int(np.searchsorted(cumulative, rank))
+        ix = min(ix, self.num_buckets - 1)
+        if ix == 0:
+            value = self.lo
+        else:
+            value = self.lo * math.exp((ix - 0.5) * self.log_ratio)
+        return min(max(value, self.min), self.max)
+
+    def summary(self, pctile):
+        '''
+        dict of the stats in milliseconds
+        '''
+        d = {'count': self.count,
+             'max_ms': self.max * 1000 if self.count else 0.0,
+             'min_ms': self.min * 1000 if self.count else 0.0,
+             'avg_ms': self.mean() * 1000}
+        for q in pctile:
+            d['p%s_ms' % q] = self.percentile(q) * 1000
+        return d
+
+
 class PartProfiler:
+    '''
+    Collects the run time of every part and of the whole drive loop in fixed
+    size histograms, so it can stay on for drives of any length.
+    '''
+    pctile = [50, 90, 99, 99.9]
+
     def __init__(self):
         self.records = {}
+        # Tracer that gets a span for every part run, when tracing
+        self.tracer = None
+        self.loop = {'busy': LogHistogram(), 'sleep': LogHistogram(),
+                     'period': LogHistogram(), 'missed': 0, 'blame': {}}
+        # slowest part of the current loop and its run time
+        self.worst = (0.0, None)
+
+    def profile_part(self, p, rate_hz=None):
+        self.records[p] = { "times" : LogHistogram(), "start" : None,
+                            "starts" : 0, "first" : None, "last" : None,
+                            "rate_hz" : rate_hz }
+
+    def on_part_start(self, p, rec=None):
+        '''
+        rec is the record of p, when the caller looked it up already
+        '''
+        now = time.time()
+        if rec is None:
+            rec = self.records[p]
+        rec['start'] = now
+        rec['starts'] += 1
+        if rec['first'] is None:
+            rec['first'] = now
+        rec['last'] = now
+
+    def actual_rate(self, p):
+        '''
+        average rate in Hz at which the part was started, or None when
+        it has not run often enough to tell
+        '''
+        rec = self.records[p]
+        if rec['starts'] < 2 or rec['last'] <= rec['first']:
+            return None
+        return (rec['starts'] - 1) / (rec['last'] - rec['first'])
 
-    def profile_part(self, p):
-        self.records[p] = { "times" : [] }
-
-    def on_part_start(self, p):
-        self.records[p]['times'].append(time.time())
-
-    def on_part_finished(self, p):
+    def on_part_finished(self, p, rec=None):
         now = time.time()
-        prev = self.records[p]['times'][-1]
-        delta = now - prev
+        if rec is None:
+            rec = self.records[p]
+        delta = now - rec['start']
         thresh = 0.000001
         if delta < thresh or delta > 100000.0:
             delta = thresh
-        self.records[p]['times'][-1] = delta
+        # leave out the first run, there could be one-off time spent in
+        # initialisations
+        if rec['starts'] > 1:
+            rec['times'].add(delta)
+        if delta > self.worst[0]:
+            self.worst = (delta, p)
+        if self.tracer is not None:
+            self.tracer.span(p.__class__.__name__, rec['start'], now)
+
+    def on_loop_start(self):
+        self.worst = (0.0, None)
+
+    def on_loop_finished(self, busy_time, sleep_time, period=None, missed=None):
+        '''
+        record the time one drive loop spent running parts and sleeping, and
+        the period since the previous loop started. A loop missed its
+        deadline when it had no time left to sleep, unless told otherwise,
+        and the slowest part of a missed loop gets the blame for it.
+        Returns the blamed part or None.
+        '''
+        self.loop['busy'].add(busy_time)
+        if sleep_time > 0.0:
+            self.loop['sleep'].add(sleep_time)
+        if period is not None:
+            self.loop['period'].add(period)
+        if missed is None:
+            missed = sleep_time <= 0.0
+        if not missed:
+            return None
+        self.loop['missed'] += 1
+        p = self.worst[1]
+        if p is not None:
+            blame = self.loop['blame']
+            blame[p] = blame.get(p, 0) + 1
+        return p
+
+    def snapshot(self):
+        '''
+        current stats as a dict that can be served as json
+        '''
+        parts = []
+        for p, rec in list(self.records.items()):
+            d = {'part': p.__class__.__name__,
+                 'target_hz': rec['rate_hz'],
+                 'actual_hz': self.actual_rate(p)}
+            d.update(rec['times'].summary(self.pctile))
+            parts.append(d)
+        blame = {}
+        for p, n in list(self.loop['blame'].items()):
+            name = p.__class__.__name__
+            blame[name] = blame.get(name, 0) + n
+        loop = {'missed': self.loop['missed'],
+                'blame': blame,
+                'busy': self.loop['busy'].summary(self.pctile),
+                'sleep': self.loop['sleep'].summary(self.pctile),
+                'period': self.loop['period'].summary(self.pctile)}
+        return {'parts': parts, 'loop': loop}
 
     def report(self):
         print("Part Profile Summary: (times in ms)")
         pt = PrettyTable()
         field_names = ["part", "max", "min", "avg"]
-        pctile = [50, 90, 99, 99.9]
-        pt.field_names = field_names + [str(p) + '%' for p in pctile]
-        for p, val in self.records.items():
-            # remove first and last entry because you there could be one-off
-            # time spent in initialisations, and the latest diff could be
-            # incomplete because of user keyboard interrupt
-            arr = val['times'][1:-1]
-            if len(arr) == 0:
+        pt.field_names = field_names + [str(p) + '%' for p in self.pctile] + \
+            ["target hz", "actual hz", "rate err %"]
+        for p, val in list(self.records.items()):
+            hist = val['times']
+            if hist.count == 0:
                 continue
             row = [p.__class__.__name__,
-                   "%.2f" % (max(arr) * 1000),
-                   "%.2f" % (min(arr) * 1000),
-                   "%.2f" % (sum(arr) / len(arr) * 1000)]
-            row += ["%.2f" % (np.percentile(arr, p) * 1000) for p in pctile]
+                   "%.2f" % (hist.max * 1000),
+                   "%.2f" % (hist.min * 1000),
+                   "%.2f" % (hist.mean() * 1000)]
+            row += ["%.2f" % (hist.percentile(q) * 1000) for q in self.pctile]
+            row += self.rate_columns(p)
             pt.add_row(row)
         print(pt)
 
+        busy = self.loop['busy']
+        if busy.count:
+            print("Loop: %d loops, %d missed their rate, busy avg %.2f ms "
+                  "99%% %.2f ms, sleep avg %.2f ms" %
+                  (busy.count, self.loop['missed'], busy.mean() * 1000,
+                   busy.percentile(99) * 1000,
+                   self.loop['sleep'].mean() * 1000))
+        period = self.loop['period']
+        if period.count:
+            print("Loop period: avg %.2f ms, 1%% %.2f ms, 99%% %.2f ms, "
+                  "max %.2f ms" %
+                  (period.mean() * 1000, period.percentile(1) * 1000,
+                   period.percentile(99) * 1000, period.max * 1000))
+        blame = sorted(self.loop['blame'].items(), key=lambda kv: -kv[1])
+        if blame:
+            print("Missed loops by slowest part: " +
+                  ", ".join("%s %d" % (p.__class__.__name__, n)
+                            for p, n in blame))
+
+    def rate_columns(self, p):
+        '''
+        target rate, achieved rate and their relative difference, as
+        strings for the report table
+        '''
+        target = self.records[p]['rate_hz']
+        actual = self.actual_rate(p)
+        cols = ["-" if target is None else "%.1f" % target,
+                "-" if actual is None else "%.1f" % actual]
+        if target is None or actual is None:
+            cols.append("-")
+        else:
+            cols.append("%.1f" % ((actual - target) / target * 100.0))
+        return cols
+
+
+class Tracer:
+    '''
+    Timeline of the drive loop for finding out why a single loop was late.
+    The profiler adds a span for every part run, the vehicle one for every
+    loop and a mark for every missed deadline, and threaded parts can add
+    spans from their update() threads with trace(). Events go to a ring
+    holding at most capacity of them, and dump() writes the last seconds
+    as a Chrome trace that chrome://tracing or https://ui.perfetto.dev open.
+
+    With a dump_dir, trigger() writes the window before an event, like a
+    missed deadline, to that directory in the background, at most once
+    every cooldown seconds.
+    '''
+    def __init__(self, seconds=10.0, capacity=200000, dump_dir=None,
+                 dump_on_miss=False, cooldown=10.0):
+        self.seconds = seconds
+        self.events = deque(maxlen=capacity)
+        self.dump_dir = dump_dir
+        self.dump_on_miss = dump_on_miss
+        self.cooldown = cooldown
+        self.last_trigger = 0.0
+        self.pid = os.getpid()
+
+    def span(self, name, start, end, cat='part', args=None):
+        '''
+        add a span of name from start to end, times in seconds since epoch
+        '''
+        self.events.append(('X', name, cat, start, end - start,
+                            threading.get_ident(), args))
+
+    def mark(self, name, cat='loop', args=None):
+        self.events.append(('i', name, cat, time.time(), 0.0,
+                            threading.get_ident(), args))
+
+    @contextmanager
+    def trace(self, name, cat='thread', args=None):
+        '''
+        add a span for the body of a with statement
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.span(name, start, time.time(), cat, args)
+
+    def window(self, seconds=None):
+        '''
+        the events of the last seconds, the ring's default window when None
+        '''
+        since = time.time() - (self.seconds if seconds is None else seconds)
+        return [e for e in list(self.events) if e[3] + e[4] >= since]
+
+    def chrome_trace(self, events):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        trace = []
+        for tid in sorted(set(e[5] for e in events)):
+            trace.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid,
+                          'tid': tid, 'args': {'name': names.get(tid, str(tid))}})
+        for ph, name, cat, ts, dur, tid, args in events:
+            e = {'ph': ph, 'name': name, 'cat': cat, 'pid': self.pid,
+                 'tid': tid, 'ts': ts * 1e6}
+            if ph == 'X':
+                e['dur'] = dur * 1e6
+            else:
+                e['s'] = 'p'
+            if args:
+                e['args'] = args
+            trace.append(e)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path, seconds=None):
+        '''
+        write the events of the last seconds as a Chrome trace json file
+        '''
+        trace = self.chrome_trace(self.window(seconds))
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        return path
+
+    def trigger(self, reason):
+        '''
+        keep the current window in a file of dump_dir, written by a
+        background thread. Returns the path, or None when there is no
+        dump_dir or the last trigger was less than cooldown seconds ago.
+        '''
+        now = time.time()
+        if self.dump_dir is None or now - self.last_trigger < self.cooldown:
+            return None
+        self.last_trigger = now
+        events = self.window()
+        path = os.path.join(self.dump_dir, 'trace_%s_%d.json' %
+                            (reason, int(now * 1000)))
+
+        def write():
+            os.makedirs(self.dump_dir, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(self.chrome_trace(events), f)
+
+        Thread(target=write, daemon=True).start()
+        return path
+
+
+@contextmanager
+def trace(tracer, name, cat='thread'):
+    '''
+    span of a with statement in the tracer, which may be None when the
+    vehicle is not traced. Threaded parts get the vehicle's tracer as their
+    tracer attribute when they have one.
+    '''
+    if tracer is None:
+        yield
+    else:
+        with tracer.trace(name, cat):
+            yield
+
+
+# what the drive loop does when a loop runs past the start of the next one
+OVERRUN_POLICIES = ('skip', 'catchup', 'stretch')
+
+
+def next_tick(tick, now, period, overrun='skip'):
+    '''
+    scheduled start of the drive loop after the one which started at tick,
+    when that loop finished at now. Ticks lie on a fixed grid of the loop
+    period, so sleeping too long or a slow loop does not shift later ones.
+    When the loop ran past the next tick,
+        skip: drops the ticks that already passed and waits for the next one
+        catchup: runs the missed loops back to back until back on the grid
+        stretch: starts the next loop at once and moves the grid with it
+    '''
+    tick += period
+    if now <= tick or overrun == 'catchup':
+        return tick
+    if overrun == 'stretch':
+        return now
+    return tick + math.ceil((now - tick) / period) * period
+
+
+class PartRecord:
+    '''
+    A part entry compiled against a Memory: channel names are resolved to
+    memory slots once, so the drive loop does no string lookups.
+    '''
+    __slots__ = ('entry', 'part', 'run', 'in_slots', 'out_slots',
+                 'cond_slot', 'period', 'skip', 'seen', 'last_out',
+                 'deps', 'dependents', 'prof')
+
+    def __init__(self, entry, mem, profiler=None):
+        self.entry = entry
+        self.part = entry['part']
+        # the profiler record of the part
+        self.prof = profiler.records.get(self.part) if profiler else None
+        if entry.get('thread'):
+            self.run = self.part.run_threaded
+        else:
+            self.run = self.part.run
+        self.in_slots = tuple(mem.slot(k) for k in entry['inputs'])
+        self.out_slots = tuple(mem.slot(k) for k in entry['outputs'])
+        cond = entry.get('run_condition')
+        self.cond_slot = mem.slot(cond) if cond else None
+        self.period = entry.get('period')
+        self.skip = entry.get('skip_if_unchanged', False)
+        # input versions and outputs of the last run, for skip_if_unchanged
+        self.seen = None
+        self.last_out = None
+        # indexes into the plan of the records that have to run before and
+        # after this one, for parallel execution
+        self.deps = ()
+        self.dependents = ()
+
+    def reads(self):
+        if self.cond_slot is None:
+            return self.in_slots
+        return self.in_slots + (self.cond_slot,)
+
+
+def link_records(plan):
+    '''
+    Build the dependency graph of a plan from the channels each part reads
+    and writes. A part runs after the last earlier part writing one of its
+    inputs, and a part writing a channel runs after the earlier parts
+    reading or writing it, so every part sees the same values as when all
+    parts run one after another in the order they were added.
+    '''
+    last_writer = {}
+    readers = {}
+    for i, rec in enumerate(plan):
+        deps = set()
+        for ix in rec.reads():
+            if ix in last_writer:
+                deps.add(last_writer[ix])
+        for ix in rec.out_slots:
+            if ix in last_writer:
+                deps.add(last_writer[ix])
+            deps.update(readers.get(ix, ()))
+        deps.discard(i)
+        for ix in rec.reads():
+            readers.setdefault(ix, []).append(i)
+        for ix in rec.out_slots:
+            last_writer[ix] = i
+            readers[ix] = []
+        rec.deps = tuple(sorted(deps))
+
+    dependents = [[] for _ in plan]
+    for i, rec in enumerate(plan):
+        for j in rec.deps:
+            dependents[j].append(i)
+    for rec, d in zip(plan, dependents):
+        rec.dependents = tuple(d)
+
 
 class Vehicle:
-    def __init__(self, mem=None):
+    def __init__(self, mem=None, compiled=True, workers=0, tracer=None):
+        '''
+        mem : Memory
+            memory holding the channels, a new one when None
+        compiled : bool
+            resolve channel names to memory slots once when the vehicle
+            starts instead of on every loop
+        workers : int
+            when larger than 0, parts which do not depend on each other
+            through their channels run concurrently on this many threads.
+            Only parts that release the GIL, like TensorFlow inference or
+            OpenCV and JPEG encoding, gain from this. Requires compiled.
+        tracer : Tracer
+            when given, records a timeline of the part runs and loops
+        '''
 
         if not mem:
             mem = Memory()
         self.mem = mem
+        # the compiled drive loop needs a slot based memory
+        self.compiled = compiled and hasattr(mem, 'put_slots')
+        self.workers = workers if self.compiled else 0
+        self.executor = None
+        self.plan = None
         self.parts = []
         self.on = True
         self.threads = []
         self.profiler = PartProfiler()
+        self.tracer = tracer
+        self.profiler.tracer = tracer
+        # parts with their own rate may run up to half a loop period early
+        # so that they line up with the nearest tick of the drive loop.
+        self.tick_slack = 0.0
 
     def add(self, part, inputs=[], outputs=[],
-            threaded=False, run_condition=None):
+            threaded=False, run_condition=None, rate_hz=None, period=None,
+            skip_if_unchanged=None, process=False):
         """
         Method to add a part to the vehicle drive loop.
 
@@ -83,34 +513,91 @@ class Vehicle:
                 If a part should be run in a separate thread.
             run_condition : boolean
                 If a part should be run or not
+            rate_hz : float
+                How often the part should run. None runs it on every loop.
+            period : float
+                Alternative to rate_hz, seconds between two runs of the part.
+            skip_if_unchanged : boolean
+                If the part should be skipped when none of its inputs changed
+                since it last ran. Its previous outputs are written again
+                instead. Defaults to the skip_if_unchanged attribute of the
+                part. Parts without inputs and threaded parts always run.
+            process : boolean
+                If the part should run in a child process, see ProcessPart.
+                Like a threaded part it returns the latest outputs of the
+                child, and numpy arrays travel through shared memory. The
+                part gets its input arrays as views, valid for the next
+                three frames, its outputs are copies.
         """
         assert type(inputs) is list, "inputs is not a list: %r" % inputs
         assert type(outputs) is list, "outputs is not a list: %r" % outputs
         assert type(threaded) is bool, "threaded is not a boolean: %r" % threaded
+        assert rate_hz is None or period is None, \
+            "give either rate_hz or period, not both"
+        assert rate_hz is None or rate_hz > 0, "rate_hz must be positive: %r" % rate_hz
+        assert period is None or period > 0, "period must be positive: %r" % period
+
+        assert not (threaded and skip_if_unchanged), \
+            "threaded parts can not be skipped when unchanged"
+        assert not (threaded and process), \
+            "a part can not be threaded and run in a process"
+
+        if skip_if_unchanged is None:
+            skip_if_unchanged = getattr(part, 'skip_if_unchanged', False) \
+                and not threaded
+
+        if rate_hz is not None:
+            period = 1.0 / rate_hz
+        elif period is not None:
+            rate_hz = 1.0 / period
 
         p = part
         print('Adding part {}.'.format(p.__class__.__name__))
+        if process:
+            from .process_part import ProcessPart
+            part = p = ProcessPart(part)
         entry = {}
         entry['part'] = p
         entry['inputs'] = inputs
         entry['outputs'] = outputs
         entry['run_condition'] = run_condition
+        entry['period'] = period
+        entry['next_run'] = 0.0
+        entry['skip_if_unchanged'] = bool(skip_if_unchanged) and \
+            len(inputs) > 0 and hasattr(self.mem, 'get_versions')
 
         if threaded:
-            t = Thread(target=part.update, args=())
+            t = Thread(target=part.update, args=(),
+                       name=part.__class__.__name__)
             t.daemon = True
             entry['thread'] = t
 
         self.parts.append(entry)
-        self.profiler.profile_part(part)
+        self.profiler.profile_part(part, rate_hz=rate_hz)
+        self.plan = None
 
     def remove(self, part):
         """
         remove part form list
         """
         self.parts.remove(part)
+        self.plan = None
 
-    def start(self, rate_hz=10, max_loop_count=None, verbose=False):
+    def compile(self):
+        '''
+        resolve the channels of every part to memory slots and build the
+        list of records the compiled drive loop executes
+        '''
+        plan = [PartRecord(entry, self.mem, self.profiler) for entry in self.parts]
+        if self.workers:
+            link_records(plan)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.plan = plan
+        return plan
+
+    def start(self, rate_hz=10, max_loop_count=None, verbose=False,
+              overrun='skip'):
         """
         Start vehicle's main drive loop.
 
@@ -124,12 +611,25 @@ class Vehicle:
         rate_hz : int
             The max frequency that the drive loop should run. The actual
             frequency may be less than this if there are many blocking parts.
+            When a part was added with a faster rate of its own, the loop
+            runs at that rate instead and parts without a rate run on every
+            loop.
         max_loop_count : int
             Maximum number of loops the drive loop should execute. This is
             used for testing that all the parts of the vehicle work.
         verbose: bool
             If debug output should be printed into shell
+        overrun: str
+            What to do when a loop takes longer than its period, one of
+            OVERRUN_POLICIES, see next_tick.
+
+        Every loop publishes its timing to the channels vehicle/loop_ms,
+        the time since the previous loop started, vehicle/missed, the
+        number of loops that finished late so far, and vehicle/late_part,
+        the slowest part of the last late loop, so they can be recorded.
         """
+        assert overrun in OVERRUN_POLICIES, \
+            'overrun must be one of {}'.format(OVERRUN_POLICIES)
 
         try:
 
@@ -137,17 +637,32 @@ class Vehicle:
 
             for entry in self.parts:
                 if entry.get('thread'):
+                    if hasattr(entry['part'], 'tracer'):
+                        entry['part'].tracer = self.tracer
                     #start the update thread
                     print('Starting update thread {}.'.format(entry['part'].__class__.__name__))
                     entry.get('thread').start()
 
+            rate_hz = self.loop_rate(rate_hz)
+            self.tick_slack = 0.5 / rate_hz
+
+            if self.compiled:
+                self.compile()
+
             # wait until the parts warm up.
             print('Starting vehicle at {} Hz'.format(rate_hz))
 
             loop_count = 0
+            period = 1.0 / rate_hz
+            tick = time.monotonic()
+            last_start = None
+            tracer = self.tracer
             while self.on:
-                start_time = time.time()
+                start_time = time.monotonic()
+                if tracer is not None:
+                    loop_start = time.time()
                 loop_count += 1
+                self.profiler.on_loop_start()
 
                 self.update_parts()
 
@@ -155,14 +670,29 @@ class Vehicle:
                 if max_loop_count and loop_count > max_loop_count:
                     self.on = False
 
-                sleep_time = 1.0 / rate_hz - (time.time() - start_time)
+                now = time.monotonic()
+                busy_time = now - start_time
+                deadline = tick + period
+                missed = now > deadline
+                tick = next_tick(tick, now, period, overrun)
+                sleep_time = tick - now
+                loop_time = None if last_start is None else start_time - last_start
+                last_start = start_time
+                late_part = self.profiler.on_loop_finished(
+                    busy_time, sleep_time, loop_time, missed)
+                self.publish_loop_stats(loop_time, late_part)
+                if tracer is not None:
+                    self.trace_loop(loop_start, loop_count, missed,
+                                    now - deadline, late_part)
+
+                if missed and verbose:
+                    # print a message when could not maintain loop rate.
+                    print('WARN::Vehicle: jitter violation in vehicle loop '
+                          'with {0:4.0f}ms, slowest part {1}'.format(
+                              1000 * (now - deadline),
+                              late_part.__class__.__name__))
                 if sleep_time > 0.0:
                     time.sleep(sleep_time)
-                else:
-                    # print a message when could not maintain loop rate.
-                    if verbose:
-                        print('WARN::Vehicle: jitter violation in vehicle loop '
-                              'with {0:4.0f}ms'.format(abs(1000 * sleep_time)))
 
                 if verbose and loop_count % 200 == 0:
                     self.profiler.report()
@@ -174,18 +704,83 @@ class Vehicle:
         finally:
             self.stop()
 
+    def trace_loop(self, loop_start, loop_count, missed, late, late_part):
+        tracer = self.tracer
+        tracer.span('loop', loop_start, time.time(), 'loop',
+                    {'loop': loop_count})
+        if missed:
+            tracer.mark('deadline miss', 'loop',
+                        {'late_ms': late * 1000,
+                         'part': late_part.__class__.__name__})
+            if tracer.dump_on_miss:
+                path = tracer.trigger('miss')
+                if path:
+                    print('Vehicle: missed deadline, trace in', path)
+
+    def publish_loop_stats(self, loop_time, late_part):
+        stats = {'vehicle/missed': self.profiler.loop['missed']}
+        if loop_time is not None:
+            stats['vehicle/loop_ms'] = loop_time * 1000
+        if late_part is not None:
+            stats['vehicle/late_part'] = late_part.__class__.__name__
+        self.mem.update(stats)
+
+    def loop_rate(self, rate_hz):
+        '''
+        the drive loop has to tick at least as fast as the fastest part
+        '''
+        periods = [entry['period'] for entry in self.parts
+                   if entry.get('period')]
+        if periods:
+            rate_hz = max(rate_hz, 1.0 / min(periods))
+        return rate_hz
+
+    def part_due(self, entry, now):
+        '''
+        True when a part with its own rate should run on this tick. The next
+        run is scheduled one period after the previous one so the part keeps
+        its rate on average, unless it fell behind by more than a period.
+        '''
+        period = entry.get('period')
+        if period is None:
+            return True
+        if now + self.tick_slack < entry['next_run']:
+            return False
+        next_run = entry['next_run'] + period
+        if next_run <= now:
+            next_run = now + period
+        entry['next_run'] = next_run
+        return True
+
     def update_parts(self):
         '''
         loop over all parts
         '''
+        if self.compiled:
+            self.update_compiled()
+            return
+
+        now = time.time()
         for entry in self.parts:
 
+            if not self.part_due(entry, now):
+                continue
+
             run = True
             # check run condition, if it exists
             if entry.get('run_condition'):
                 run_condition = entry.get('run_condition')
                 run = self.mem.get([run_condition])[0]
             
+            if run and entry.get('skip_if_unchanged'):
+                seen = self.mem.get_versions(entry['inputs'])
+                if seen == entry.get('seen'):
+                    # reuse the outputs of the previous run
+                    if entry.get('last_out') is not None:
+                        self.mem.put(entry['outputs'], entry['last_out'])
+                    continue
+                entry['seen'] = seen
+
             if run:
                 # get part
                 p = entry['part']
@@ -202,9 +797,102 @@ class Vehicle:
                 # save the output to memory
                 if outputs is not None:
                     self.mem.put(entry['outputs'], outputs)
+                if entry.get('skip_if_unchanged'):
+                    entry['last_out'] = outputs
                 # finish timing part run
                 self.profiler.on_part_finished(p)
 
+    def update_compiled(self):
+        '''
+        loop over all parts using the slots resolved by compile()
+        '''
+        plan = self.plan
+        # parts may be added or removed by a running part, see complete.py
+        if plan is None or len(plan) != len(self.parts):
+            plan = self.compile()
+
+        now = time.time()
+        if self.workers:
+            self.update_parallel(plan, now)
+            return
+
+        for rec in plan:
+            self.run_record(rec, now)
+
+    def run_record(self, rec, now):
+        '''
+        run one compiled part, unless it is not due, its run condition is
+        false or its inputs did not change
+        '''
+        mem = self.mem
+        buf = mem.buf
+        if rec.period is not None and not self.part_due(rec.entry, now):
+            return
+
+        if rec.cond_slot is not None and not buf[rec.cond_slot]:
+            return
+
+        if rec.skip:
+            seen = mem.get_slot_versions(rec.in_slots)
+            if seen == rec.seen:
+                # reuse the outputs of the previous run
+                if rec.last_out is not None:
+                    mem.put_slots(rec.out_slots, rec.last_out)
+                return
+            rec.seen = seen
+
+        profiler = self.profiler
+        profiler.on_part_start(rec.part, rec.prof)
+        outputs = rec.run(*[buf[ix] for ix in rec.in_slots])
+        if outputs is not None:
+            mem.put_slots(rec.out_slots, outputs)
+        if rec.skip:
+            rec.last_out = outputs
+        profiler.on_part_finished(rec.part, rec.prof)
+
+    def update_parallel(self, plan, now):
+        '''
+        run the compiled parts on the thread pool. A part is submitted as
+        soon as all the parts it depends on finished, see link_records.
+        '''
+        if not plan:
+            return
+        waiting = [len(rec.deps) for rec in plan]
+        state = {'left': len(plan), 'error': None}
+        done = Condition()
+
+        def run(rec):
+            error = None
+            if state['error'] is None:
+                try:
+                    self.run_record(rec, now)
+                except BaseException as e:
+                    error = e
+            ready = []
+            with done:
+                if error is not None and state['error'] is None:
+                    state['error'] = error
+                for j in rec.dependents:
+                    waiting[j] -= 1
+                    if waiting[j] == 0:
+                        ready.append(plan[j])
+                state['left'] -= 1
+                if state['left'] == 0:
+                    done.notify()
+            for r in ready:
+                self.executor.submit(run, r)
+
+        for rec in plan:
+            if not rec.deps:
+                self.executor.submit(run, rec)
+
+        with done:
+            while state['left'] > 0:
+                done.wait()
+
+        if state['error'] is not None:
+            raise state['error']
+
     def stop(self):        
         print('Shutting down vehicle and its parts...')
         for entry in reversed(self.parts):
@@ -217,4 +905,8 @@ class Vehicle:
             except Exception as e:
                 print(e)
 
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
         self.profiler.report()
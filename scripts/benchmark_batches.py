@@ -0,0 +1,139 @@
+'''
+Usage:
+    benchmark_batches.py [--type=<model_type>] [--batch=<int>] [--batches=<int>]
+
+Options:
+    --type=<model_type>   linear, categorical, imu, behavior, localizer or latent [default: linear]
+    --batch=<int>         records per batch [default: 128]
+    --batches=<int>       batches to make [default: 200]
+
+Note:
+    This script measures how many samples per second train.py puts
+    together into batches, with the images already decoded in memory, so
+    only the batch assembly is timed. It compares the BatchMaker of
+    train.py with the python lists batches were made with before.
+'''
+import time
+
+from docopt import docopt
+import numpy as np
+
+import donkeycar as dk
+import donkeycar.templates.cfg_complete as cfg
+from donkeycar.templates.train import BatchMaker
+from donkeycar.parts.tub_cache import TubImageCache
+from donkeycar.parts.keras import KerasIMU, KerasBehavioral, KerasLatent, KerasLocalizer
+
+
+class MemoryImages(TubImageCache):
+    '''
+    a TubImageCache of random images held in memory instead of a file
+    '''
+    def __init__(self, num_records):
+        shape = (num_records, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+        self.images = np.random.randint(0, 256, shape, dtype=np.uint8)
+
+
+def make_records(num_records, categorical):
+    images = MemoryImages(num_records)
+    records = []
+    for i in range(num_records):
+        angle, throttle = np.random.uniform(-1, 1), np.random.uniform(0, 1)
+        if categorical:
+            angle = dk.utils.linear_bin(angle)
+            throttle = dk.utils.linear_bin(throttle, N=20, offset=0, R=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
+        records.append({'image_cache': images, 'cache_row': i,
+                        'angle': angle, 'throttle': throttle,
+                        'imu_array': np.random.rand(6),
+                        'behavior_arr': np.eye(len(cfg.BEHAVIOR_LIST))[i % len(cfg.BEHAVIOR_LIST)],
+                        'location': np.eye(cfg.NUM_LOCATIONS)[i % cfg.NUM_LOCATIONS]})
+    return records
+
+
+def load_cached_images(batch_data):
+    '''
+    the images of the records in batch_data from their image caches, with
+    one fancy index per cache. None for records that are not cached.
+    '''
+    images = [None] * len(batch_data)
+    by_cache = {}
+    for i, record in enumerate(batch_data):
+        cache = record.get('image_cache')
+        if cache is not None:
+            by_cache.setdefault(id(cache), (cache, []))[1].append(i)
+    for cache, positions in by_cache.values():
+        imgs = cache.get_images([batch_data[i]['cache_row'] for i in positions])
+        for i, img in zip(positions, imgs):
+            images[i] = img
+    return images
+
+
+def list_batch(kl, batch_data):
+    '''
+    the batch made with lists, as train.py did before
+    '''
+    if type(kl.model.output) is list:
+        model_out_shape = (2, 1)
+    else:
+        model_out_shape = kl.model.output.shape
+    inputs_img, inputs_imu, inputs_bvh = [], [], []
+    angles, throttles, out_img, out_loc, out = [], [], [], [], []
+    for record, img_arr in zip(batch_data, load_cached_images(batch_data)):
+        if type(kl) is KerasLatent:
+            import cv2
+            rz_img_arr = cv2.resize(img_arr, (127, 127)) / 255.0
+            out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
+        if type(kl) is KerasLocalizer:
+            out_loc.append(record['location'])
+        if type(kl) is KerasIMU:
+            inputs_imu.append(record['imu_array'])
+        if type(kl) is KerasBehavioral:
+            inputs_bvh.append(record['behavior_arr'])
+        inputs_img.append(img_arr)
+        angles.append(record['angle'])
+        throttles.append(record['throttle'])
+        out.append([record['angle'], record['throttle']])
+    batch_size = len(inputs_img)
+    img_arr = np.array(inputs_img).reshape(batch_size, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+    if inputs_imu:
+        X = [img_arr, np.array(inputs_imu)]
+    elif inputs_bvh:
+        X = [img_arr, np.array(inputs_bvh)]
+    else:
+        X = [img_arr]
+    if out_img:
+        y = [out_img, np.array(angles), np.array(throttles)]
+    elif out_loc:
+        y = [np.array(angles), np.array(throttles), np.array(out_loc)]
+    elif model_out_shape[1] == 2:
+        y = [np.array([out]).reshape(batch_size, 2)]
+    else:
+        y = [np.array(angles), np.array(throttles)]
+    return X, y
+
+
+def samples_per_sec(make_batch, records, batch_size, num_batches):
+    start = time.time()
+    for i in range(num_batches):
+        rows = np.random.randint(0, len(records), batch_size)
+        make_batch([records[row] for row in rows])
+    return num_batches * batch_size / (time.time() - start)
+
+
+def main(model_type, batch_size, num_batches):
+    cfg.TARGET_H = cfg.IMAGE_H - cfg.ROI_CROP_TOP - cfg.ROI_CROP_BOTTOM
+    cfg.TARGET_W = cfg.IMAGE_W
+    cfg.TARGET_D = cfg.IMAGE_DEPTH
+    kl = dk.utils.get_model_by_type(model_type, cfg)
+    records = make_records(batch_size * 8, model_type == 'categorical')
+    maker = BatchMaker(kl, cfg)
+
+    before = samples_per_sec(lambda batch: list_batch(kl, batch), records, batch_size, num_batches)
+    after = samples_per_sec(maker, records, batch_size, num_batches)
+    print('%s batches of %d: lists %.0f samples/sec, BatchMaker %.0f samples/sec (%.1fx)' %
+          (model_type, batch_size, before, after, after / before))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['--type'], int(args['--batch']), int(args['--batches']))